@@ -0,0 +1,81 @@
+"""
+Snapshot of the camera attributes saved with every shot, without walking all GenICam nodes every shot.
+
+Nodes that the device caches (the writeable settings and the values derived from them) can only change when the
+camera is written to, so they are re-read only after IDS_Camera.attribute_generation changed. Volatile nodes
+(temperatures, counters, ...) are re-read every shot.
+
+With storage 'reference', the static part is written once per distinct content into a table file next to the shot
+files (one per run folder), and the shot only gets an external link to it plus the volatile values.
+"""
+import hashlib
+import json
+import os
+
+import labscript_utils.h5_lock
+import h5py
+from labscript_utils.properties import set_attributes
+
+ATTRIBUTE_STORAGES = ['full', 'reference']
+
+
+def attributes_digest(attributes: dict) -> str:
+    """Short content hash of an attribute dict, the key of the snapshot in the attribute table"""
+    text = json.dumps(attributes, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+class AttributeCache(object):
+    def __init__(self, camera):
+        """:param camera: the IDS_Camera"""
+        self.camera = camera
+        self.generation = None # attribute_generation of the camera when the static part was read
+        self.visibility_level = None
+        self.static = {}
+        self.volatile = {}
+        self.volatile_names = []
+        self.digest = None
+        self.node_reads = 0 # node reads of the last snapshot
+
+    def invalidate(self):
+        self.generation = None
+
+    def snapshot(self, visibility_level):
+        """
+        :return: (static, volatile) attribute dicts. `static` is the cached dict itself, do not modify it.
+        """
+        generation = self.camera.attribute_generation
+        if generation != self.generation or visibility_level != self.visibility_level:
+            names = self.camera.get_attribute_names(visibility_level, writeable_only=False)
+            volatile = set(self.camera.get_volatile_attribute_names(names))
+            self.volatile_names = [name for name in names if name in volatile]
+            self.static = {name: self.camera.get_attribute(name) for name in names if name not in volatile}
+            self.digest = attributes_digest(self.static)
+            self.generation = generation
+            self.visibility_level = visibility_level
+            self.node_reads = len(names)
+        else:
+            self.node_reads = len(self.volatile_names)
+        self.volatile = {name: self.camera.get_attribute(name) for name in self.volatile_names}
+        return self.static, self.volatile
+
+    def save(self, image_group, shot_path, device_name, storage='full'):
+        """
+        Save the last snapshot to the shot's image group.
+        :param storage: 'full' writes all attributes as attributes of the image group (like before), 'reference'
+            links the static part from the run's attribute table <device_name>_camera_attributes.h5
+        """
+        static, volatile = self.static, self.volatile
+        if storage == 'full':
+            set_attributes(image_group, dict(static, **volatile))
+            return
+        table_name = f'{device_name}_camera_attributes.h5'
+        with h5py.File(os.path.join(os.path.dirname(shot_path), table_name), 'a') as table:
+            if self.digest not in table:
+                set_attributes(table.create_group(self.digest), static)
+        # relative to the shot file, so the link survives moving the run folder
+        if 'camera_attributes' in image_group:
+            del image_group['camera_attributes']
+        image_group['camera_attributes'] = h5py.ExternalLink(table_name, '/' + self.digest)
+        image_group.attrs['camera_attributes_digest'] = self.digest
+        set_attributes(image_group, volatile)
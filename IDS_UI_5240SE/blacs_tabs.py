@@ -23,6 +23,7 @@ class IDSCameraTab(IMAQdxCameraTab):
             'serial_number': connection_table_properties['serial_number'],
             'camera_attributes': device_properties['camera_attributes'],
             'image_receiver_port': self.image_receiver.port,
+            'preview_config': connection_table_properties.get('preview_config'),
         }
         self.create_worker(
             'main_worker', self.worker_class, worker_initialisation_kwargs
@@ -6,14 +6,16 @@ import labscript_utils.h5_lock
 import h5py
 import labscript_utils.properties
 from zprocess import rich_print
-import zmq
 import time
 from labscript import LabscriptError
 
-from labscript_utils.ls_zprocess import Context
 from labscript_utils.shared_drive import path_to_local
-from labscript_utils.properties import set_attributes
 from labscript_devices.IMAQdxCamera.blacs_workers import IMAQdxCameraWorker
+from user_devices.preview_publisher import PreviewPublisher
+from user_devices.hdf5_filters import compression_kwargs
+from .image_storage import ImageWriter
+from .preview import PREVIEW_DEFAULTS, PreviewRate, preview_image
+from .attribute_cache import AttributeCache
 
 from ids_peak import ids_peak
 from ids_peak_ipl import ids_peak_ipl
@@ -27,6 +29,49 @@ RED = '#FF6347'
 YELLOW = '#E6DB74'
 GREEN = '#A6E22E'
 
+class FramePool(object):
+    """
+    Preallocated (n_images, height, width) block for the frames of one shot. Every finished driver buffer is copied
+    exactly once, into its slot, and the block itself goes to the HDF5 file and to the GUI (no list, no np.stack).
+
+    A new pool is allocated for every shot, the previous block may still be waiting in the preview publisher.
+    """
+    def __init__(self, n_images: int, shape, dtype):
+        """
+        :param n_images: number of exposures of the shot
+        :param shape: (height, width) of the frames with the current ROI
+        :param dtype: pixel type of the frames
+        """
+        self.frames = np.empty((int(n_images),) + tuple(shape), dtype=dtype)
+        self.count = 0
+        self.frame_event = threading.Event() # set for every new frame, for the ImageWriter
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def images(self):
+        """the frames collected so far, a view on the block"""
+        return self.frames[:self.count]
+
+    def put(self, image):
+        """Copy one frame into the next free slot and return the slot"""
+        if self.count >= len(self.frames):
+            raise LabscriptError(f"Frame pool is full ({len(self.frames)} images)")
+        if image.shape != self.frames.shape[1:] or image.dtype != self.frames.dtype:
+            if self.count:
+                raise LabscriptError(f"Frame {self.count + 1} has shape {image.shape} {image.dtype}, "
+                                     f"expected {self.frames.shape[1:]} {self.frames.dtype}")
+            # the pixel format differs from the one the pool was sized for, nothing is lost before the first frame
+            print(f"[WARNING] Frame pool reallocated for frames of shape {image.shape} {image.dtype}")
+            self.frames = np.empty((len(self.frames),) + image.shape, dtype=image.dtype)
+        slot = self.frames[self.count]
+        np.copyto(slot, image)
+        self.count += 1
+        self.frame_event.set()
+        return slot
+
+
 class IDS_Camera(object):
     def __init__(self, serial_number=None):
         # Initialize the library
@@ -80,13 +125,31 @@ class IDS_Camera(object):
         self._image_converter = ids_peak_ipl.ImageConverter()
         self._image_transformer = ids_peak_ipl.ImageTransformer()
         self.all_collected = threading.Event()
+        self.acquisition_error = None # LabscriptError that ended grab_multiple early, None if all frames were grabbed
 
         self.exception_on_failed_shot = True
 
+        # announced buffer depth: None = the minimum the driver requires, capped by max_buffer_memory (bytes)
+        self.buffer_count = None
+        self.max_buffer_memory = None
+        self.incomplete_frames = 0 # frames delivered in incomplete buffers since configure_acquisition
+
+        # incremented whenever the camera is written to, the cached attribute snapshot is stale then
+        self.attribute_generation = 0
+        self._trigger_config = None
+
     def set_attributes(self, attr_dict):
+        if attr_dict:
+            self.attribute_generation += 1
         for k, v in attr_dict.items():
             self.set_attribute(k, v)
 
+    def _set_trigger_config(self, config):
+        """Record the trigger configuration, the attribute snapshot is stale if it changed"""
+        if config != self._trigger_config:
+            self._trigger_config = config
+            self.attribute_generation += 1
+
     def _check_bounds(self, name: str, value:float, min_val:float, max_val:float, increment:float=None):
         if not (min_val <= value <= max_val):
             raise LabscriptError(f"{name} value={value} out of range [{min_val}, {max_val}]")
@@ -263,6 +326,24 @@ class IDS_Camera(object):
 
         return value
 
+    def get_volatile_attribute_names(self, names):
+        """The attributes among `names` whose value can change without the camera being written to: nodes that
+        the device does not cache, or, if the caching mode is not available, the nodes that are not writeable."""
+        no_cache = getattr(ids_peak, 'NodeCachingMode_NoCache', None)
+        volatile = []
+        for name in names:
+            try:
+                node = self.node_map.FindNode(name)
+                if no_cache is not None:
+                    is_volatile = node.CachingMode() == no_cache
+                else:
+                    is_volatile = not node.IsWriteable()
+            except Exception:
+                is_volatile = True
+            if is_volatile:
+                volatile.append(name)
+        return volatile
+
     def get_attribute_names(self, visibility_level, writeable_only=True):
         """Return a list of all attribute names of readable attributes, for the given
                visibility level. Optionally return only writeable attributes"""
@@ -283,15 +364,67 @@ class IDS_Camera(object):
         return attributes
 
     def alloc_announce_buffers(self):
-        """ Create minimum required amount of buffers to the stream."""
+        """ Announce self.buffer_count buffers to the stream (at least the minimum required amount), no more than
+        fit into self.max_buffer_memory. Buffers announced before are revoked first, the acquisition is stopped."""
         payload_size = self.node_map.FindNode("PayloadSize").Value()
-        buffer_amount = self._datastream.NumBuffersAnnouncedMinRequired()
+        min_required = self._datastream.NumBuffersAnnouncedMinRequired()
+        buffer_amount = max(min_required, self.buffer_count or 0)
+        if self.max_buffer_memory is not None:
+            fitting = int(self.max_buffer_memory // payload_size)
+            if fitting < buffer_amount:
+                rich_print(f"[WARNING] Only {max(fitting, min_required)} of {buffer_amount} buffers fit into "
+                           f"{self.max_buffer_memory / 2**20:.0f} MB", color=YELLOW)
+                buffer_amount = max(fitting, min_required)
+
+        # after pause_acquisition the old buffers are still announced
+        for buffer in self._datastream.AnnouncedBuffers():
+            self._datastream.RevokeBuffer(buffer)
+        self._buffer_list = []
 
         for _ in range(buffer_amount):
             buffer = self._datastream.AllocAndAnnounceBuffer(payload_size)
             self._buffer_list.append(buffer)
 
-        # print(f"{buffer_amount} allocated & announced buffers!")
+        if buffer_amount > min_required:
+            print(f"[INFO] {buffer_amount} buffers announced ({buffer_amount * payload_size / 2**20:.1f} MB)")
+
+    def datastream_stats(self) -> dict:
+        """Frame counters of the datastream (cumulative while it is open). Counters the transport layer does not
+        provide are left out."""
+        stats = {'announced_buffers': len(self._buffer_list), 'incomplete_frames': self.incomplete_frames}
+        if self._datastream is None:
+            return stats
+        try:
+            stats['delivered_frames'] = int(self._datastream.NumBuffersDelivered())
+            stats['underruns'] = int(self._datastream.NumUnderruns())
+        except Exception:
+            pass
+        try:
+            node_map = self._datastream.NodeMaps()[0]
+        except Exception: # the transport layer exposes no datastream node map
+            return stats
+        for name, node_name in (('dropped_frames', "StreamDroppedFrameCount"),
+                                ('lost_frames', "StreamLostFrameCount"),
+                                ('incomplete_frames_tl', "StreamIncompleteFrameCount")):
+            try:
+                if node_map.HasNode(node_name):
+                    stats[name] = int(node_map.FindNode(node_name).Value())
+            except Exception:
+                pass
+        return stats
+
+    def frame_shape(self):
+        """(height, width) and numpy dtype of the frames with the current ROI and pixel format"""
+        height = int(self.node_map.FindNode("Height").Value())
+        width = int(self.node_map.FindNode("Width").Value())
+        pixel_format = self.node_map.FindNode("PixelFormat").CurrentEntry().SymbolicValue()
+        dtype = np.uint8 if pixel_format.endswith("8") else np.uint16
+        return (height, width), dtype
+
+    def allocate_frame_pool(self, n_images: int) -> FramePool:
+        """Frame pool for n_images frames, sized from the current ROI. Call after the attributes are set."""
+        shape, dtype = self.frame_shape()
+        return FramePool(n_images, shape, dtype)
 
     def snap(self):
         """Execute Software Trigger. Only available in software trigger mode in MANUAL mode.
@@ -318,7 +451,11 @@ class IDS_Camera(object):
 
         return ipl_image
 
-    def grab(self, timeout_ms):
+    def grab(self, timeout_ms, pool: FramePool = None, transform=None):
+        """Wait for the next finished buffer and return its image. Without a pool the image is copied out of the
+        buffer, with a pool it is copied straight into the next slot of the pool and the slot is returned.
+        :param transform: instead of copying, return transform(view on the buffer), which must not keep the view
+            (e.g. a downscaled preview, or None to only discard the frame)"""
         np_image = None
         buffer = None
         while not self.stop_event.is_set():
@@ -336,34 +473,53 @@ class IDS_Camera(object):
                 continue
 
             # Image is transferred, get image from buffer and free the buffer
-            np_image = ids_peak_ipl_extension.BufferToImage(buffer).get_numpy().copy()
-            self._datastream.QueueBuffer(buffer)  # free buffer
+            if buffer.IsIncomplete():
+                self.incomplete_frames += 1
+                rich_print(f"[WARNING] Incomplete frame received", color=YELLOW)
+            try:
+                image = ids_peak_ipl_extension.BufferToImage(buffer).get_numpy() # view on the buffer memory
+                if transform is not None:
+                    np_image = transform(image)
+                else:
+                    np_image = image.copy() if pool is None else pool.put(image)
+            finally:
+                self._datastream.QueueBuffer(buffer)  # free buffer
             break
 
         return np_image
 
-    def grab_multiple(self, images, n_images:int, timeout_ms=None):
+    def grab_multiple(self, images: FramePool, n_images:int, timeout_ms=None):
+        """Collect n_images frames into the frame pool `images`"""
         # print("[DEBUG] Acquiring frames from buffers .... ")
         self.all_collected.clear()
+        self.acquisition_error = None
 
-        for i in range(n_images):
-            while True:
-                if self.stop_event.is_set():
-                    print("Abort during acquisition.")
-                    return
-                try:
-                    np_image = self.grab(timeout_ms)
-                except Exception as e:
-                    rich_print(f"[ERROR] Exception while grabbing image {i + 1}: {e}", color=RED)
-                    continue
-
-                images.append(np_image)
-                print(f"\nGot image {i + 1} of {n_images}.\n")
-                break
+        try:
+            for i in range(n_images):
+                while True:
+                    if self.stop_event.is_set():
+                        print("Abort during acquisition.")
+                        return
+                    try:
+                        np_image = self.grab(timeout_ms, images)
+                    except LabscriptError:
+                        raise
+                    except Exception as e:
+                        rich_print(f"[ERROR] Exception while grabbing image {i + 1}: {e}", color=RED)
+                        continue
+                    if np_image is None: # aborted while waiting
+                        continue
+
+                    print(f"\nGot image {i + 1} of {n_images}.\n")
+                    break
+        except LabscriptError as e: # the frame pool is full or the frame does not fit it, retrying cannot help
+            rich_print(f"[ERROR] Stopped grabbing at image {i + 1}: {e}", color=RED)
+            self.acquisition_error = e
 
         self.all_collected.set()
         self.stop_event.set()
-        print("[INFO] Finished grabbing all images.")
+        if self.acquisition_error is None:
+            print("[INFO] Finished grabbing all images.")
 
     def configure_acquisition(self):
         """Flush queue, clear all old buffers if given, allocate and announce buffers"""
@@ -375,6 +531,7 @@ class IDS_Camera(object):
             self._datastream = self.camera.DataStreams()[0].OpenDataStream()
 
         self.alloc_announce_buffers()
+        self.incomplete_frames = 0
 
         # Queue Buffers
         for buffer in self._datastream.AnnouncedBuffers():
@@ -462,6 +619,7 @@ class IDS_Camera(object):
         self.node_map.FindNode("AcquisitionFrameRate").SetValue(float(frame_rate))
 
         self.trigger_mode = 'freerun'
+        self._set_trigger_config(('freerun', frame_rate))
 
     def configure_software_trigger_mode(self):
         print("[INFO] Configure SOFTWARE")
@@ -470,6 +628,7 @@ class IDS_Camera(object):
         self.node_map.FindNode("TriggerSource").SetCurrentEntry("Software")
 
         self.trigger_mode = 'software'
+        self._set_trigger_config(('software',))
 
     def configure_hardware_trigger_mode(self, trigger_activation:str, delay:float):
         print("[INFO] Configure HARDWARE")
@@ -480,6 +639,7 @@ class IDS_Camera(object):
         self.node_map.FindNode("TriggerDelay").SetValue(delay)
 
         self.trigger_mode = 'hardware'
+        self._set_trigger_config(('hardware', trigger_activation, delay))
 
 
 class IDSWorker(IMAQdxCameraWorker):
@@ -490,10 +650,13 @@ class IDSWorker(IMAQdxCameraWorker):
         self.trigger_mode = 'software'
         self.camera.configure_software_trigger_mode()
 
-        self.image_socket = Context().socket(zmq.REQ)
-        self.image_socket.connect(
-            f'tcp://{self.parent_host}:{self.image_receiver_port}'
-        )
+        # images go to the tab from a background thread, a lagging GUI never delays the shot
+        self.preview_publisher = PreviewPublisher(self.parent_host, self.image_receiver_port, name="IDS images")
+        self.previews_dropped = 0
+        # previews are downscaled to the display and rate limited, full-resolution frames only go to the shot file
+        preview_config = dict(PREVIEW_DEFAULTS, **(getattr(self, 'preview_config', None) or {}))
+        self.preview_shape = tuple(preview_config['max_shape'])
+        self.preview_rate = PreviewRate(preview_config['max_fps'])
 
         self.attributes_to_save = None
         self.h5_filepath = None
@@ -503,6 +666,10 @@ class IDSWorker(IMAQdxCameraWorker):
         self.acquisition_thread = None
         self.continuous_thread = None
         self.acquisition_timeout = ids_peak.Timeout.INFINITE_TIMEOUT
+        self.stream_stats_start = {}
+        self.image_writer = None
+        self.attribute_cache = AttributeCache(self.camera)
+        self.attribute_storage = 'full'
 
     def get_camera(self):
         return self.interface_class(self.serial_number)
@@ -558,6 +725,7 @@ class IDSWorker(IMAQdxCameraWorker):
 
         camera_attributes = properties['camera_attributes']
         self.visibility_level = properties['visibility']
+        self.attribute_storage = properties.get('attribute_storage', 'full')
         trigger_activation = properties['trigger_activation']
         trigger_delay = properties['trigger_delay'] * 1e+6 # s -> us
         self.exception_on_failed_shot = properties['exception_on_failed_shot']
@@ -566,6 +734,12 @@ class IDSWorker(IMAQdxCameraWorker):
             self.acquisition_timeout = ids_peak.Timeout.INFINITE_TIMEOUT
         else:
             self.acquisition_timeout = ids_peak.Timeout(int(properties['acquisition_timeout'] * 1000))
+        # default: one buffer per exposure, so a burst of triggers never waits for Python to requeue a buffer
+        buffer_count = properties.get('buffer_count')
+        self.camera.buffer_count = self.n_images if buffer_count is None else buffer_count
+        max_buffer_memory_MB = properties.get('max_buffer_memory_MB')
+        self.camera.max_buffer_memory = None if max_buffer_memory_MB is None else max_buffer_memory_MB * 2**20
+        filters = compression_kwargs(properties.get('compression', 'gzip'), properties.get('compression_level'))
 
         # print("[DEBUG] Properties: ", properties)
 
@@ -573,6 +747,7 @@ class IDSWorker(IMAQdxCameraWorker):
         # them if a fresh reprogramming was requested:
         if fresh:
             self.smart_cache = {}
+            self.attribute_cache.invalidate()
 
         self.set_attributes_smart(camera_attributes)
 
@@ -581,7 +756,15 @@ class IDSWorker(IMAQdxCameraWorker):
         self.camera.stop_event.clear()
         self.camera.configure_acquisition()
         self.camera.start_acquisition()
-        self.images = []
+        self.stream_stats_start = self.camera.datastream_stats()
+        self.images = self.camera.allocate_frame_pool(self.n_images)
+
+        # frames are compressed and written while the next ones are acquired
+        names = [n.decode() if isinstance(n, bytes) else n for n in self.exposures['name']]
+        frametypes = [t.decode() if isinstance(t, bytes) else t for t in self.exposures['frametype']]
+        self.image_writer = ImageWriter(h5_file, self.image_path(), names, frametypes, self.images, filters)
+        self.image_writer.start()
+
         self.acquisition_thread = threading.Thread(
             target=self.camera.grab_multiple,
             args=(self.images, self.n_images, self.acquisition_timeout),
@@ -590,6 +773,13 @@ class IDSWorker(IMAQdxCameraWorker):
         self.acquisition_thread.start()
         return {}
 
+    def image_path(self):
+        """Group of this camera's images: images/orientation|device_name"""
+        # Use orientation for image path, device_name if orientation unspecified
+        if self.orientation is not None:
+            return 'images/' + self.orientation
+        return 'images/' + self.device_name
+
     def save_image(self, image, extension="png"):
         """ Saves image with given extension.
         :param image (ipl_image): image
@@ -617,14 +807,19 @@ class IDSWorker(IMAQdxCameraWorker):
         full_path = os.path.join(path, filename)
         return full_path
 
-    def _send_image_to_parent(self, image):
-        """Send the image to the GUI to display. This will block if the parent process
-        is lagging behind in displaying frames, in order to avoid a backlog."""
-        metadata = dict(dtype=str(image.dtype), shape=image.shape)
-        self.image_socket.send_json(metadata, zmq.SNDMORE)
-        self.image_socket.send(image, copy=False)
-        response = self.image_socket.recv()
-        assert response == b'ok', response
+    def _send_image_to_parent(self, image, force=False, binned=False):
+        """Send the image to the GUI to display, downscaled to the preview size. Never blocks: if the GUI is still
+        busy with the previous frame, the older frame is dropped and only the newest one is shown.
+        :param force: send even if the preview rate limit is reached (single snaps, the images of a shot)
+        :param binned: the image is already downscaled with preview_image"""
+        if not force and not self.preview_rate.due():
+            return
+        if not binned:
+            image = preview_image(image, self.preview_shape)
+        self.preview_publisher.publish({}, image)
+        if self.preview_publisher.dropped > self.previews_dropped:
+            self.previews_dropped = self.preview_publisher.dropped
+            print(f"[INFO] GUI is lagging behind, {self.previews_dropped} image previews dropped so far")
 
 
     def transition_to_manual(self):
@@ -636,47 +831,55 @@ class IDSWorker(IMAQdxCameraWorker):
         # wait till acquisition thread is closed
         self.camera.all_collected.wait()
 
-        # stop acquisition
+        # counters of this shot, before the buffers are revoked
+        stream_stats = self.camera.datastream_stats()
+        for name, value in self.stream_stats_start.items():
+            if name in stream_stats and name not in ('announced_buffers', 'incomplete_frames'):
+                stream_stats[name] -= value
+        lost = {k: v for k, v in stream_stats.items()
+                if k in ('dropped_frames', 'lost_frames', 'incomplete_frames', 'incomplete_frames_tl', 'underruns')
+                and v}
+        if lost:
+            rich_print(f"[WARNING] Datastream reports {lost}", color=RED)
+
+        # stop acquisition and go back to the minimum buffer depth for manual mode
         self.camera.stop_acquisition()
-
-        print(f"Saving {len(self.images)}/{self.n_images} images after shot.")
+        self.camera.buffer_count = None
+
+        # the frames are written by the image writer during the shot, only the last ones can be left
+        t0 = time.perf_counter()
+        written = self.image_writer.finish()
+        self.image_writer = None
+        print(f"Saved {written}/{self.n_images} images, "
+              f"{(time.perf_counter() - t0) * 1e3:.1f} ms after the last frame.")
         # images/orientation|device_name/label=image/frametype
         with h5py.File(self.h5_filepath, 'r+') as f:
-            # Use orientation for image path, device_name if orientation unspecified
-            if self.orientation is not None:
-                image_path = 'images/' + self.orientation
-            else:
-                image_path = 'images/' + self.device_name
-            image_group = f.require_group(image_path)
+            image_group = f.require_group(self.image_path())
             image_group.attrs['camera'] = self.device_name
 
             # Whether we failed to get all the expected exposures:
-            image_group.attrs['failed_shot'] = len(self.images) != len(self.exposures)
-
-            names = self.exposures['name']
-            frametypes = self.exposures['frametype']
-
-            exposure_names = [n.decode() if isinstance(n, bytes) else n for n in names]
-            frametypes = [f.decode() if isinstance(f, bytes) else f for f in frametypes]
-
-            # Write each image as a separate dataset
-            for idx, image in enumerate(self.images):
-                group = image_group.require_group(exposure_names[idx])
-                dset = group.create_dataset(frametypes[idx], data=image, compression='gzip')
-                self._send_image_to_parent(image)
-
-        try:
-            image_block = np.stack(self.images)
-        except ValueError:
-            print("Cannot display images in the GUI, they are not all the same shape")
-        else:
-            self._send_image_to_parent(image_block)
-
-        # Save camera attributes to the HDF5 file: fixme:
+            acquisition_error = self.camera.acquisition_error
+            image_group.attrs['failed_shot'] = len(self.images) != len(self.exposures) or acquisition_error is not None
+            if acquisition_error is not None:
+                image_group.attrs['acquisition_error'] = str(acquisition_error)
+            # why frames are missing: datastream counters of this shot
+            stream_group = image_group.require_group('datastream')
+            for name, value in stream_stats.items():
+                stream_group.attrs[name] = value
+
+        # the pool is already one (n_images, height, width) block, it is not reused after this shot
+        if len(self.images) > 0:
+            self._send_image_to_parent(self.images.images, force=True)
+
+        # Save camera attributes to the HDF5 file, only nodes that can have changed are read
         if self.visibility_level is not None:
-            self.attributes_to_save = self.get_attributes_as_dict(self.visibility_level, writeable_only=False)
-            print("attributes to save !!!!!!!!!!!!!!!!!: ", self.attributes_to_save)
-            set_attributes(image_group, self.attributes_to_save)
+            t0 = time.perf_counter()
+            static, volatile = self.attribute_cache.snapshot(self.visibility_level)
+            with h5py.File(self.h5_filepath, 'r+') as f:
+                self.attribute_cache.save(f[self.image_path()], self.h5_filepath, self.device_name,
+                                          self.attribute_storage)
+            print(f"[INFO] Saved {len(static) + len(volatile)} camera attributes "
+                  f"({self.attribute_cache.node_reads} node reads, {(time.perf_counter() - t0) * 1e3:.0f} ms)")
 
 
         self.images = None
@@ -684,8 +887,11 @@ class IDSWorker(IMAQdxCameraWorker):
         self.attributes_to_save = None
         self.h5_filepath = None
         self.stop_acquisition_timeout = None
-        self.exception_on_failed_shot = None
+        exception_on_failed_shot, self.exception_on_failed_shot = self.exception_on_failed_shot, None
+        self.camera.acquisition_error = None
 
+        if acquisition_error is not None and exception_on_failed_shot:
+            raise LabscriptError(f"Camera acquisition failed: {acquisition_error}")
         return True
 
     def abort(self):
@@ -696,6 +902,13 @@ class IDSWorker(IMAQdxCameraWorker):
             self.acquisition_thread.join()
             self.acquisition_thread = None
             self.camera.stop_acquisition()
+        self.camera.buffer_count = None
+        if self.image_writer is not None:
+            try:
+                self.image_writer.finish()
+            except Exception as e:
+                print(f"[WARNING] Image writer failed: {e}")
+            self.image_writer = None
         self.images = None
         self.n_images = None
         self.attributes_to_save = None
@@ -721,11 +934,12 @@ class IDSWorker(IMAQdxCameraWorker):
         if self.continuous_thread is not None:
             self.stop_continuous()
         self.camera.close()
+        self.preview_publisher.close()
 
     def snap(self):
         ipl_image = self.camera.snap()
         np_image = ipl_image.get_numpy()
-        self._send_image_to_parent(np_image)
+        self._send_image_to_parent(np_image, force=True)
         self.save_image(ipl_image, 'png')
 
     def start_continuous(self, fps=10):
@@ -743,8 +957,14 @@ class IDSWorker(IMAQdxCameraWorker):
         while True:
             if self.camera.stop_event.is_set():
                 break
-            np_image = self.camera.grab(self.acquisition_timeout)
-            self._send_image_to_parent(np_image)
+            # frames between two previews are only returned to the driver, the others are binned straight from it
+            if self.preview_rate.due():
+                np_image = self.camera.grab(self.acquisition_timeout,
+                                            transform=lambda image: preview_image(image, self.preview_shape))
+                if np_image is not None:
+                    self._send_image_to_parent(np_image, force=True, binned=True)
+            else:
+                self.camera.grab(self.acquisition_timeout, transform=lambda image: None)
 
         print("continuous_loop loop closed")
 
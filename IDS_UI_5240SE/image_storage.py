@@ -0,0 +1,91 @@
+"""
+Writing the camera frames of a shot into the HDF5 shot file while the shot is still running.
+
+The layout is the usual labscript one, images/<orientation or device>/<exposure name>/<frametype>, one dataset per
+exposure, so lyse's get_image keeps working. Only the attributes are left for transition_to_manual.
+"""
+import threading
+import time
+
+import labscript_utils.h5_lock
+import h5py
+import numpy as np
+
+from user_devices.hdf5_filters import compression_kwargs
+
+CHUNK_BYTES = 256 * 1024 # ~ one chunk per band of rows, small enough for the default HDF5 chunk cache
+
+
+def frame_chunks(shape, itemsize: int):
+    """Chunk shape of a frame dataset: bands of whole rows of about CHUNK_BYTES"""
+    row_bytes = int(np.prod(shape[1:])) * itemsize
+    rows = max(1, min(shape[0], CHUNK_BYTES // max(row_bytes, 1)))
+    return (rows,) + tuple(shape[1:])
+
+
+class ImageWriter(object):
+    """
+    A background thread waits for new frames in a FramePool and writes each one, straight from its slot, into its
+    own chunked and compressed dataset. Compression therefore overlaps with the acquisition of the next frames and
+    `finish` only has to write the frames that arrived after the last write.
+    """
+    def __init__(self, h5_file, image_path, exposure_names, frametypes, pool, filters=None):
+        """
+        :param h5_file: path of the shot file
+        :param image_path: group of the images of this camera, e.g. 'images/<orientation>'
+        :param exposure_names: name of each exposure, in the order of the frames
+        :param frametypes: frametype of each exposure
+        :param pool: the FramePool the frames are grabbed into
+        :param filters: create_dataset keyword arguments of the filter pipeline, see hdf5_filters.compression_kwargs
+        """
+        self.h5_file = h5_file
+        self.image_path = image_path
+        self.exposure_names = list(exposure_names)
+        self.frametypes = list(frametypes)
+        self.pool = pool
+        self.filters = compression_kwargs('gzip') if filters is None else filters
+
+        self.written = 0 # frames already in the file
+        self.write_time_s = 0.0
+        self._finishing = threading.Event()
+        self._thread = None
+        self._error = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        frame_event = self.pool.frame_event
+        try:
+            while not self._finishing.is_set():
+                frame_event.wait(timeout=0.1)
+                frame_event.clear()
+                self._write_until(self.pool.count)
+            self._write_until(self.pool.count)
+        except Exception as e:
+            self._error = e
+
+    def _write_until(self, end):
+        if end <= self.written:
+            return
+        t0 = time.perf_counter()
+        with h5py.File(self.h5_file, 'r+') as f:
+            image_group = f.require_group(self.image_path)
+            for idx in range(self.written, end):
+                image = self.pool.frames[idx]
+                group = image_group.require_group(self.exposure_names[idx])
+                group.create_dataset(self.frametypes[idx], data=image,
+                                     chunks=frame_chunks(image.shape, image.dtype.itemsize), **self.filters)
+        self.written = end
+        self.write_time_s += time.perf_counter() - t0
+
+    def finish(self, timeout=None):
+        """Write the remaining frames and stop the thread. Raises if writing failed."""
+        self._finishing.set()
+        self.pool.frame_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._error is not None:
+            raise self._error
+        return self.written
@@ -5,6 +5,8 @@ from labscript_utils import dedent
 import numpy as np
 from enum import Enum
 from user_devices.logger_config import logger
+from user_devices.hdf5_filters import check_compression
+from user_devices.IDS_UI_5240SE.attribute_cache import ATTRIBUTE_STORAGES
 
 
 class TriggerEdgeType(str, Enum):
@@ -29,7 +31,8 @@ class IDS_UICamera(TriggerableDevice):
             "connection_table_properties":[
                 "serial_number",
                 "name",
-                "orientation"
+                "orientation",
+                "preview_config",
             ],
             "device_properties":[
                 "camera_attributes",
@@ -38,12 +41,19 @@ class IDS_UICamera(TriggerableDevice):
                 "acquisition_timeout",
                 "exception_on_failed_shot",
                 "trigger_delay",
+                "buffer_count",
+                "max_buffer_memory_MB",
+                "compression",
+                "compression_level",
+                "attribute_storage",
             ]
         }
     )
     def __init__(self, name, trigger_activation_type:TriggerEdgeType=TriggerEdgeType.FALLING, serial_number=None, connection=None, parent_device=None, parentless=True,
                  exposure_time=None, frame_rate_fps=None, gain=None, roi=None, visibility_level: VisibilityLevelType=VisibilityLevelType.SIMPLE,
-                 acquisition_timeout=None, orientation=None, exception_on_failed_shot=True, trigger_delay=0.0, **kwargs):
+                 acquisition_timeout=None, orientation=None, exception_on_failed_shot=True, trigger_delay=0.0,
+                 buffer_count=None, max_buffer_memory_MB=256, compression='gzip', compression_level=None,
+                 preview_shape=(512, 640), preview_max_fps=10, attribute_storage='full', **kwargs):
         """
 
         :param name:
@@ -69,6 +79,23 @@ class IDS_UICamera(TriggerableDevice):
                 lyse dataframe as `df[orientation/name, 'failed_shot']`.
 
         :param acquisition_timeout: timeout in seconds
+        :param buffer_count: number of driver buffers announced for a shot. Default None: one per exposure, so that
+                a burst of triggers faster than the worker can requeue buffers does not drop frames. Never less than
+                the minimum the driver requires.
+        :param max_buffer_memory_MB: cap of the memory of the announced buffers, None = no cap. Datastream
+                counters (dropped, lost, incomplete frames) are saved in
+                f['images'][orientation/name]['datastream'].attrs.
+        :param compression: codec of the image datasets: 'none', 'lzf', 'gzip' or 'blosc-lz4' (needs hdf5plugin
+                on the BLACS machine, else lzf). The frames are compressed and written during the shot.
+        :param compression_level: gzip level 0..9 (default 4) or blosc level 0..9 (default 5)
+        :param preview_shape: (height, width) the images shown in the BLACS tab are binned down to fit into
+        :param preview_max_fps: maximum rate of previews in continuous mode, None = no limit
+        :param attribute_storage: how the camera attributes (see visibility_level) are saved. 'full' writes all of
+                them as attributes of f['images'][orientation/name] (visible in the lyse dataframe). 'reference'
+                writes the ones that only change when the camera is configured once per distinct content into
+                <name>_camera_attributes.h5 next to the shot files and links them as
+                f['images'][orientation/name]['camera_attributes'], only volatile ones (e.g. temperatures) are
+                written to the shot itself.
         :param kwargs:
         """
 
@@ -99,6 +126,22 @@ class IDS_UICamera(TriggerableDevice):
         self.orientation = orientation
         self.exception_on_failed_shot = exception_on_failed_shot
         self.trigger_delay = trigger_delay
+        if buffer_count is not None and (int(buffer_count) != buffer_count or buffer_count < 1):
+            raise ValueError(f"buffer_count must be a positive integer or None, got {buffer_count}")
+        self.buffer_count = None if buffer_count is None else int(buffer_count)
+        if max_buffer_memory_MB is not None and max_buffer_memory_MB <= 0:
+            raise ValueError(f"max_buffer_memory_MB must be positive or None, got {max_buffer_memory_MB}")
+        self.max_buffer_memory_MB = max_buffer_memory_MB
+        self.compression = check_compression(compression, compression_level)
+        self.compression_level = None if compression_level is None else int(compression_level)
+        if len(preview_shape) != 2 or min(preview_shape) < 1:
+            raise ValueError(f"preview_shape must be (height, width) in pixels, got {preview_shape}")
+        if preview_max_fps is not None and preview_max_fps <= 0:
+            raise ValueError(f"preview_max_fps must be positive or None, got {preview_max_fps}")
+        if attribute_storage not in ATTRIBUTE_STORAGES:
+            raise ValueError(f"Invalid attribute_storage: {attribute_storage}. Allowed values: {ATTRIBUTE_STORAGES}")
+        self.attribute_storage = attribute_storage
+        self.preview_config = {'max_shape': [int(n) for n in preview_shape], 'max_fps': preview_max_fps}
         self.exposures = []
 
         TriggerableDevice.__init__(self, name, parent_device, connection, parentless, **kwargs)
@@ -0,0 +1,50 @@
+"""
+Previews of the camera frames for the BLACS tab: downscaled to about the display size and rate limited, so that
+continuous mode does not push full-resolution frames through the socket and the Qt event loop. Full-resolution
+frames only go to the shot file.
+"""
+import math
+import time
+
+import numpy as np
+
+PREVIEW_DEFAULTS = {'max_shape': (512, 640), 'max_fps': 10.0} # (height, width) of the display area
+
+
+def bin_image(image, max_shape=PREVIEW_DEFAULTS['max_shape']):
+    """
+    Downscale the last two axes by integer binning (mean of factor x factor pixels, the incomplete edge is cut)
+    so that they fit into max_shape. Leading axes, e.g. the frames of a shot, are kept.
+    :return: the binned image in the dtype of `image`, or `image` itself if it already fits
+    """
+    height, width = image.shape[-2:]
+    factor = max(1, math.ceil(height / max_shape[0]), math.ceil(width / max_shape[1]))
+    if factor == 1:
+        return image
+    h, w = height // factor, width // factor
+    blocks = image[..., :h * factor, :w * factor].reshape(image.shape[:-2] + (h, factor, w, factor))
+    accumulator = np.uint32 if np.issubdtype(image.dtype, np.integer) else np.float64
+    binned = blocks.sum(axis=(-3, -1), dtype=accumulator) / (factor * factor)
+    return binned.astype(image.dtype)
+
+
+def preview_image(image, max_shape=PREVIEW_DEFAULTS['max_shape']):
+    """Like bin_image, but always a new array, so that it may be taken straight from a driver buffer"""
+    binned = bin_image(image, max_shape)
+    return binned.copy() if binned is image else binned
+
+
+class PreviewRate(object):
+    """Lets at most max_fps previews per second through, `skipped` counts the others"""
+    def __init__(self, max_fps=PREVIEW_DEFAULTS['max_fps']):
+        self.min_interval_s = 1.0 / max_fps if max_fps else 0.0
+        self.skipped = 0
+        self._last = -math.inf
+
+    def due(self) -> bool:
+        now = time.monotonic()
+        if now - self._last < self.min_interval_s:
+            self.skipped += 1
+            return False
+        self._last = now
+        return True
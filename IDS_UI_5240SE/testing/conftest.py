@@ -0,0 +1,7 @@
+"""
+pytest setup of the IDS camera tests, no camera is needed:
+
+cd ~/labscript-suite/userlib
+python3 -m pytest user_devices/IDS_UI_5240SE/testing
+"""
+import labscript_utils.h5_lock # before anything imports h5py
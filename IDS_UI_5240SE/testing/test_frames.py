@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from user_devices.IDS_UI_5240SE.preview import bin_image, preview_image, PreviewRate
+
+
+def frame_pool_class():
+    """FramePool lives in the worker module, which needs the IDS peak SDK"""
+    pytest.importorskip("ids_peak")
+    pytest.importorskip("labscript_devices")
+    from user_devices.IDS_UI_5240SE.blacs_workers import FramePool
+    return FramePool
+
+
+def test_bin_image_fits_into_max_shape():
+    image = np.arange(1024 * 1280, dtype=np.uint16).reshape(1024, 1280)
+    binned = bin_image(image, (512, 640))
+    assert binned.shape == (512, 640)
+    assert binned.dtype == np.uint16
+    assert binned[0, 0] == image[:2, :2].mean() // 1
+
+
+def test_bin_image_cuts_the_incomplete_edge():
+    image = np.ones((1025, 1283), dtype=np.uint8) * 200 # the mean of 9 pixels must not overflow uint8
+    binned = bin_image(image, (512, 640))
+    assert binned.shape == (341, 427) # factor 3
+    assert (binned == 200).all()
+
+
+def test_bin_image_keeps_leading_axes():
+    frames = np.zeros((4, 100, 100), dtype=np.float32)
+    frames[2] = 1.0
+    binned = bin_image(frames, (50, 50))
+    assert binned.shape == (4, 50, 50)
+    np.testing.assert_array_equal(binned.max(axis=(1, 2)), [0, 0, 1, 0])
+
+
+def test_small_image_is_not_binned():
+    image = np.zeros((100, 100), dtype=np.uint16)
+    assert bin_image(image, (512, 640)) is image
+    preview = preview_image(image, (512, 640))
+    assert preview is not image # may be taken straight from a driver buffer
+    np.testing.assert_array_equal(preview, image)
+
+
+def test_preview_rate():
+    rate = PreviewRate(max_fps=1.0)
+    assert rate.due()
+    assert not rate.due()
+    assert rate.skipped == 1
+    assert PreviewRate(max_fps=0).due() and PreviewRate(max_fps=0).due()
+
+
+def test_frame_pool_fills_slots_in_order():
+    FramePool = frame_pool_class()
+    pool = FramePool(3, (4, 5), np.uint16)
+    for i in range(3):
+        slot = pool.put(np.full((4, 5), i, dtype=np.uint16))
+        assert slot.base is pool.frames or slot.base is pool.frames.base
+    assert len(pool) == 3
+    np.testing.assert_array_equal(pool.images[:, 0, 0], [0, 1, 2])
+    assert pool.frame_event.is_set()
+
+
+def test_frame_pool_full():
+    from labscript import LabscriptError
+    FramePool = frame_pool_class()
+    pool = FramePool(1, (2, 2), np.uint8)
+    pool.put(np.zeros((2, 2), dtype=np.uint8))
+    with pytest.raises(LabscriptError):
+        pool.put(np.zeros((2, 2), dtype=np.uint8))
+
+
+def test_frame_pool_shape_change():
+    from labscript import LabscriptError
+    FramePool = frame_pool_class()
+    pool = FramePool(2, (2, 2), np.uint8)
+    # before the first frame the pool follows the pixel format of the camera
+    pool.put(np.zeros((3, 3), dtype=np.uint16))
+    assert pool.frames.shape == (2, 3, 3) and pool.frames.dtype == np.uint16
+    # afterwards a different frame is an error, the first one would be lost
+    with pytest.raises(LabscriptError):
+        pool.put(np.zeros((2, 2), dtype=np.uint16))
@@ -0,0 +1,107 @@
+"""
+Per-shot scalar results computed in the worker from the raw int16 traces, so that lyse reads a few numbers per shot
+instead of the full traces.
+
+An analysis window selects a time span of one channel, relative to the trigger, and reduces it with one operation.
+Everything is computed in ADC counts and converted to mV once per result (the analogue offset is not removed,
+like the 'mV' storage mode). Traces with a leading segment axis (rapid block mode) give one result per segment.
+"""
+import numpy as np
+
+from .trace_storage import adc_scale_mv
+
+ANALYSIS_OPERATIONS = ['mean', 'rms', 'integral', 'max', 'min', 'peak', 'peak_time', 'crossings']
+CROSSING_DIRECTIONS = ['rising', 'falling', 'rising_or_falling']
+
+
+def window_slice(start_s, stop_s, triggered_at: int, sample_interval_ns: float, n_samples: int) -> slice:
+    """
+    Samples of a window given in seconds relative to the trigger, clipped to the trace.
+    :param start_s: start of the window, None = start of the trace
+    :param stop_s: end of the window (exclusive), None = end of the trace
+    :param triggered_at: index of the trigger sample in the trace
+    """
+    dt_s = sample_interval_ns * 1e-9
+    start = 0 if start_s is None else triggered_at + int(np.ceil(start_s / dt_s - 1e-9))
+    stop = n_samples if stop_s is None else triggered_at + int(np.ceil(stop_s / dt_s - 1e-9))
+    start = min(max(start, 0), n_samples)
+    stop = min(max(stop, start), n_samples)
+    return slice(start, stop)
+
+
+def reduce_window(segment, operation: str, scale_mv: float, sample_interval_ns: float, t0_s: float = 0.0,
+                  threshold_adc: int = 0, direction: str = 'rising'):
+    """
+    Reduce the last axis of an int16 window with one operation.
+
+    :param segment: (..., samples) ADC counts of one channel
+    :param scale_mv: mV per ADC count of the channel
+    :param t0_s: time of the first sample of the window relative to the trigger
+    :param threshold_adc: threshold of 'crossings' in ADC counts
+    :param direction: direction of the counted crossings
+    :return: float (or array over the leading axes): mV for mean/rms/max/min/peak, mV*s for integral,
+        s relative to the trigger for peak_time, a count for crossings. NaN for an empty window.
+    """
+    n = segment.shape[-1]
+    if n == 0:
+        return np.full(segment.shape[:-1], np.nan) if segment.ndim > 1 else np.nan
+
+    if operation == 'mean':
+        return segment.mean(axis=-1, dtype=np.float64) * scale_mv
+    if operation == 'rms':
+        values = segment.astype(np.float64)
+        return np.sqrt(np.einsum('...i,...i->...', values, values) / n) * scale_mv
+    if operation == 'integral':
+        return segment.sum(axis=-1, dtype=np.int64) * (scale_mv * sample_interval_ns * 1e-9)
+    if operation == 'max':
+        return segment.max(axis=-1) * scale_mv
+    if operation == 'min':
+        return segment.min(axis=-1) * scale_mv
+    if operation in ('peak', 'peak_time'):
+        # the sample furthest from zero, with its sign
+        index = np.abs(segment.astype(np.int32)).argmax(axis=-1)
+        if operation == 'peak_time':
+            return t0_s + index * sample_interval_ns * 1e-9
+        return np.take_along_axis(segment, index[..., None], axis=-1)[..., 0] * scale_mv
+    if operation == 'crossings':
+        above = segment > threshold_adc
+        rising = np.count_nonzero(~above[..., :-1] & above[..., 1:], axis=-1)
+        falling = np.count_nonzero(above[..., :-1] & ~above[..., 1:], axis=-1)
+        return {'rising': rising, 'falling': falling, 'rising_or_falling': rising + falling}[direction]
+    raise ValueError(f"Invalid analysis operation: {operation}. Allowed values: {ANALYSIS_OPERATIONS}")
+
+
+def analyse_traces(windows, data_adc, channels, channel_ranges, max_adc, triggered_at: int,
+                   sample_interval_ns: float) -> dict:
+    """
+    Evaluate analysis windows on raw traces.
+
+    :param windows: list of dicts from PicoScope4000A.add_analysis_window (name, channel, operation, start, stop,
+        threshold, direction)
+    :param data_adc: (channels, samples) or (segments, channels, samples) int16 counts
+    :param channels: channel number of each row of data_adc
+    :param channel_ranges: {channel number: range enum}
+    :param max_adc: maximum ADC count of the unit
+    :param triggered_at: index of the trigger sample in every trace / segment
+    :param sample_interval_ns: interval of the stored samples
+    :return: {window name: result}, windows on channels that were not recorded are missing
+    """
+    results = {}
+    n_samples = data_adc.shape[-1]
+    rows = {ch: i for i, ch in enumerate(channels)}
+    for window in windows:
+        ch = window["channel_number"]
+        if ch not in rows:
+            print(f"[WARNING] Analysis window '{window['name']}': {window['channel']} was not recorded")
+            continue
+        scale_mv = float(adc_scale_mv(channel_ranges[ch], max_adc))
+        span = window_slice(window.get("start"), window.get("stop"), triggered_at, sample_interval_ns, n_samples)
+        threshold_adc = 0
+        if window.get("threshold") is not None:
+            threshold_adc = int(round(window["threshold"] / scale_mv))
+        results[window["name"]] = reduce_window(data_adc[..., rows[ch], span], window["operation"], scale_mv,
+                                                sample_interval_ns,
+                                                t0_s=(span.start - triggered_at) * sample_interval_ns * 1e-9,
+                                                threshold_adc=threshold_adc,
+                                                direction=window.get("direction", "rising"))
+    return results
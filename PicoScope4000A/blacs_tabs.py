@@ -15,15 +15,27 @@ import pyqtgraph as pg
 import json
 import numpy as np
 
+from user_devices.PicoScope4000A.preview import preview_times, preview_index
+
 
 class TraceReceiver(ZMQServer):
 
-    def __init__(self, trace_view, total_samples, channel_names):
+    def __init__(self, trace_view, channel_names, health_label=None, live_button=None):
         ZMQServer.__init__(self, port=None, dtype='multipart')
         self.trace_view = trace_view
-        self.total_samples = total_samples
+        self.health_label = health_label
+        self.live_button = live_button # unchecked when a shot ends the live view
         self.channel_names = channel_names
 
+        # plot items are created once and updated with setData on every shot
+        self.trace_view.setClipToView(True)
+        self.trace_view.setDownsampling(auto=True, mode='peak')
+        self.curves = {} # channel name: PlotDataItem
+        self.trigger_line = None
+        self.trigger_dot = None
+        self._times_key = None # (points, bin_size, sample_interval) of the cached time axis
+        self._times = None
+
     @inmain_decorator(wait_for_return=True)
     def handler(self, data):
         self.send([b'ok'])
@@ -32,52 +44,92 @@ class TraceReceiver(ZMQServer):
         traces = traces.reshape(md['shape'])
         sample_interval = md['sample_interval']
         triggered_at = md['triggered_at']
-        times = np.linspace(0, (self.total_samples - 1) * sample_interval, self.total_samples)
-
-        colors = [(102, 0, 204), # purple
-                  (0, 0, 204), # blue
-                  (0, 204, 204), # cian
-                  (102, 240, 0), # green
-                  (204, 204, 0), # yellow
-                  (204, 0, 0), # red
-                  (255, 51, 255), # pink
-                  (96, 96, 96)] # gray
+        # the worker sends a min/max envelope of bin_size samples per pair of points
+        bin_size = md.get('bin_size', 1)
+        times = self.time_axis(traces.shape[0], bin_size, sample_interval)
+        trigger_point = min(preview_index(triggered_at, bin_size), traces.shape[0] - 1)
 
-        self.trace_view.clear()
-
-        for i in range(len(self.channel_names)):
-            # self.plot_line(self.channel_names[i], times, traces[:,i], colors[i])
+        for i in range(min(len(self.channel_names), traces.shape[1])):
             self.plot_line(self.channel_names[i], times, traces[:, i], i)
 
-        self.trace_view.addLine(x=triggered_at * sample_interval, y=traces[triggered_at:1], pen=pg.mkPen(color='r', width=1.5, style=QtCore.Qt.DashLine)) # endless vertical line where the trigger occurred.
-        self.plot_dot_trigger(x=triggered_at * sample_interval, y=traces[triggered_at, 0]) # NOTE: Dot on first channel A
+        if md.get('live', False): # rolling window, no trigger
+            self.hide_trigger()
+            QtWidgets.QApplication.instance().sendPostedEvents()
+            return self.NO_RESPONSE
+        if self.live_button is not None and self.live_button.isChecked():
+            self.live_button.blockSignals(True)
+            self.live_button.setChecked(False)
+            self.live_button.blockSignals(False)
+
+        self.plot_trigger(x=triggered_at * sample_interval, y=traces[trigger_point, 0]) # NOTE: Dot on first channel A
+        if 'health' in md:
+            self.show_health(md['health'])
 
         QtWidgets.QApplication.instance().sendPostedEvents()
         return self.NO_RESPONSE
 
-    def plot_dot_trigger(self, x, y):
-        """Plots the dot where trigger occurred only on single given channel  """
-        self.trace_view.plot(
-            [x],
-            [y],
-            symbol='o',
-            symbolSize=6.5,
-            symbolBrush='r',
-            symbolPen=None,
-            pen=None
-        )
+    def show_health(self, health):
+        """One line summary of the acquisition health of the last shot, red if data was clipped or lost"""
+        if self.health_label is None:
+            return
+        # the over-range counters are indexed by channel number
+        overflows = {"ABCDEFGH"[ch]: n for ch, n in enumerate(health['stream_overflow_events']) if n > 0}
+        text = (f"callbacks: {health['stream_callbacks']}  "
+                f"samples/callback: {health['stream_samples_per_callback']:.0f}  "
+                f"max fetch gap: {health['stream_max_fetch_gap_s'] * 1e3:.1f} ms  "
+                f"trigger to complete: {health['stream_trigger_to_complete_s']:.3f} s  "
+                f"truncated: {health['stream_truncated_samples']}  "
+                f"over range: {overflows if overflows else 'none'}")
+        bad = overflows or health['stream_truncated_samples'] > 0
+        self.health_label.setStyleSheet("color: red" if bad else "")
+        self.health_label.setText(text)
+
+    def time_axis(self, n_points, bin_size, sample_interval):
+        """Time axis of the preview, only recomputed when the number of points or the sampling changes"""
+        key = (n_points, bin_size, sample_interval)
+        if key != self._times_key:
+            self._times = preview_times(n_points, bin_size, sample_interval)
+            self._times_key = key
+        return self._times
+
+    def plot_trigger(self, x, y):
+        """Moves the vertical line and the dot where the trigger occurred, the dot only on the first channel"""
+        if self.trigger_line is None:
+            # endless vertical line where the trigger occurred.
+            self.trigger_line = self.trace_view.addLine(x=x, pen=pg.mkPen(color='r', width=1.5, style=QtCore.Qt.DashLine))
+            self.trigger_dot = self.trace_view.plot(
+                [x],
+                [y],
+                symbol='o',
+                symbolSize=6.5,
+                symbolBrush='r',
+                symbolPen=None,
+                pen=None
+            )
+        else:
+            self.trigger_line.setValue(x)
+            self.trigger_dot.setData([x], [y])
+            self.trigger_line.setVisible(True)
+            self.trigger_dot.setVisible(True)
+
+    def hide_trigger(self):
+        """Hides the trigger markers of the last shot, until the next shot moves them"""
+        if self.trigger_line is not None:
+            self.trigger_line.setVisible(False)
+            self.trigger_dot.setVisible(False)
 
     def plot_line(self, name, time, trace, color):
-        if isinstance(color, int):
-            pen = pg.intColor(color)
-        else:
-            pen = pg.mkPen(color=color, width=1)
-        self.trace_view.plot(
-            time,
-            trace,
-            name=name,
-            pen=pen,
-        )
+        curve = self.curves.get(name)
+        if curve is None:
+            if isinstance(color, int):
+                pen = pg.intColor(color)
+            else:
+                pen = pg.mkPen(color=color, width=1)
+            curve = self.trace_view.plot(name=name, pen=pen)
+            curve.setClipToView(True)
+            curve.setDownsampling(auto=True, method='peak')
+            self.curves[name] = curve
+        curve.setData(time, trace)
 
 
 class PicoScopeTab(DeviceTab):
@@ -98,6 +150,8 @@ class PicoScopeTab(DeviceTab):
         self.trace_graph.showGrid(x=True, y=True)
         self.trace_graph.addLegend()
         layout.addWidget(self.trace_graph, stretch=1)
+        self.health_label = QtWidgets.QLabel("")
+        layout.addWidget(self.health_label)
 
         self.tabs_window = QtWidgets.QMainWindow()
         self.tabs_window.setWindowTitle("Tabs")
@@ -164,7 +218,10 @@ class PicoScopeTab(DeviceTab):
         stream_config = properties.get("stream_config", {})
         sampling_layout.addWidget(self.make_table("Stream Config", ["Parameter", "Value"], stream_config))
         self.worker_kwargs["stream_config"] = stream_config
-        total_samples = stream_config['no_post_trigger_samples']
+        block_config = properties.get("block_config", {})
+        if block_config:
+            sampling_layout.addWidget(self.make_table("Block Config", ["Parameter", "Value"], block_config))
+            self.worker_kwargs["block_config"] = block_config
 
         self.tabs.addTab(sampling_tab, "Sampling")
 
@@ -184,16 +241,21 @@ class PicoScopeTab(DeviceTab):
 
         self.attributes_button = QPushButton("Attributes")
         self.siggen_button = QPushButton("Trigger Signal Generator")
+        self.live_button = QPushButton("Live View")
+        self.live_button.setCheckable(True)
         self.attributes_button.clicked.connect(self.open_attributes)
         self.siggen_button.clicked.connect(self.siggen_trigger)
+        self.live_button.clicked.connect(self.toggle_live_view)
 
+        button_layout.addWidget(self.live_button)
         button_layout.addWidget(self.siggen_button)
         button_layout.addWidget(self.attributes_button)
         layout.addLayout(button_layout)
 
         logger.debug(self.worker_kwargs)
 
-        self.trace_receiver = TraceReceiver(trace_view=self.trace_graph, total_samples=total_samples, channel_names=self.channel_names)
+        self.trace_receiver = TraceReceiver(trace_view=self.trace_graph, channel_names=self.channel_names,
+                                            health_label=self.health_label, live_button=self.live_button)
         return
 
     def initialise_workers(self):
@@ -203,12 +265,15 @@ class PicoScopeTab(DeviceTab):
         # look up the serial number, series
         serial = device.properties["serial_number"]
         is_4000a = device.properties["is_4000a"]
+        simulated = device.properties.get("simulated", False)
         # Start a worker process
         self.create_worker(
             'main_worker',
             'user_devices.PicoScope4000A.blacs_workers.PicoScopeWorker',
             {"serial_number": serial,
              "is_4000a": is_4000a,
+             "simulated": simulated,
+             "simulation_config": device.properties.get("simulation_config") or {},
              "simple_trigger": self.worker_kwargs.get("simple_trigger", {}),
              "channels_configs": self.worker_kwargs.get("channels_configs", []),
              "channel_names": self.channel_names,
@@ -218,6 +283,7 @@ class PicoScopeTab(DeviceTab):
              "trigger_delay": self.worker_kwargs.get("trigger_delay", {}),
              "stream_config": self.worker_kwargs.get("stream_config", {}),
              "siggen_config": self.worker_kwargs.get("siggen_config", {}),
+             "live_view_config": device.properties.get("live_view_config") or {},
              "image_receiver_port": self.trace_receiver.port,
              }
         )
@@ -256,6 +322,10 @@ class PicoScopeTab(DeviceTab):
     def siggen_trigger(self, button):
         yield (self.queue_work(self.primary_worker, 'siggen_software_trigger'))
 
+    @define_state(MODE_MANUAL, queue_state_indefinitely=True, delete_stale_states=True)
+    def toggle_live_view(self, checked):
+        yield (self.queue_work(self.primary_worker, 'start_live_view' if checked else 'stop_live_view'))
+
     def open_attributes(self, button):
         self.tabs_window.show()
 
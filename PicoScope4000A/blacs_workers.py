@@ -3,7 +3,8 @@ from json.decoder import FLAGS
 from blacs.tab_base_classes import Worker
 from labscript import LabscriptError
 from user_devices.logger_config import logger
-import h5py, json, time, queue, math
+import labscript_utils.h5_lock
+import h5py, json, time, queue, math, hashlib
 import ctypes
 import numpy as np
 import matplotlib.pyplot as plt
@@ -11,13 +12,25 @@ import threading
 from zprocess import rich_print
 import labscript_utils.properties
 
-from picosdk.ps4000a import ps4000a as psa
-from picosdk.ps4000 import ps4000 as ps
-from picosdk.functions import adc2mV, assert_pico_ok, mV2adc
-from picosdk.constants import PICO_STATUS
-from labscript_utils.ls_zprocess import Context
+try:
+    from picosdk.ps4000a import ps4000a as psa
+    from picosdk.ps4000 import ps4000 as ps
+    from picosdk.functions import assert_pico_ok, mV2adc
+    from picosdk.constants import PICO_STATUS
+except ImportError:
+    # no PicoSDK on this machine: only the simulated driver is available
+    from .simulation import SimulatedPs4000a as psa, assert_pico_ok, mV2adc, PICO_STATUS
+    ps = None
+from .streaming import StreamBuffer, SegmentBuffer, RingBuffer, FetchScheduler, StreamStats, choose_driver_buffer_size, BLOCK_POLL_PERIOD_S
+from .preview import minmax_envelope, PREVIEW_BINS
+from .analysis import analyse_traces
+from .dsp import StreamDsp
+from .simulation import SimulatedPs4000a
+from .trace_storage import (adc_to_mv, trace_attributes, dataset_chunks, trace_layout, write_trace_blocks, TraceWriter,
+                            DEFAULT_CHUNK_SAMPLES)
+from user_devices.hdf5_filters import compression_kwargs
+from user_devices.preview_publisher import PreviewPublisher
 
-import zmq
 import datetime
 
 
@@ -25,7 +38,15 @@ BLUE = '#66D9EF'
 RED = '#FF0000'
 GREEN = '#008000'
 
-class PicoScope4000A(object):
+# live view in manual mode, overridden by PicoScope4000A.set_live_view in the connection table
+LIVE_VIEW_DEFAULTS = dict(sample_interval=1000, window_samples=10000, max_fps=10)
+
+class PicoScopeBase(object):
+    """
+    Acquisition shared by the ps4000a and ps4000 drivers: buffer handling, the fetching threads with their scheduler
+    and the trigger bookkeeping. The subclasses open the unit and make the raw driver calls, the _ps_* methods return
+    the PICO_STATUS of the call.
+    """
     def __init__(self, serial_number):
         self.chandle = ctypes.c_int16()
         self.status = {}
@@ -39,78 +60,89 @@ class PicoScope4000A(object):
         self.trigger_event = threading.Event()
         self.trigger_event.clear()
 
-        self.buffers = {} # in adc
-        self.complete_buffers = {} # in adc
+        self.stream_buffer = StreamBuffer() # preallocated acquisition memory, reused across shots
+        self.segment_buffer = SegmentBuffer() # preallocated rapid block memory, reused across shots
+        self.live_buffer = RingBuffer(0, 0) # rolling window of the live view
+        self.live_driver = np.zeros((0, 0), dtype=np.int16) # driver buffers of the live view, apart from the capture
+        self.live_channels = [] # channel numbers of the rows of live_buffer
+        self.acquisition_mode = None # 'stream' | 'block'
+        self.buffers = {} # in adc, rows of stream_buffer.driver
+        self.complete_buffers = {} # in adc, rows of stream_buffer.data
 
         # Preparing for data acquisition
         self.total_samples = None
-        self.next_sample = None
+        self.n_segments = 1 # memory segments the scope memory is split into, more than one after rapid block mode
         self.auto_stop_outer = None
-        self.was_called_back = None
         self.triggered_at = None
+        self.fetch_scheduler = None
+        self.stream_stats = StreamStats() # health of the last streaming capture
 
         # Open Unit
         self.open_unit(serial_number)
 
         # Unit's constants
         self.max_adc = ctypes.c_int32()
-        self.status["maximumValue"] = psa.ps4000aMaximumValue(self.chandle, ctypes.byref(self.max_adc))
+        self.status["maximumValue"] = self._ps_maximum_value(self.max_adc)
         self.channel_ranges = {} # channel voltage range in serial number per channel
+        self.analog_offsets = {} # channel analogue offset in volts per channel
         self.enabled_channels = [0,0,0,0,0,0,0,0] # store channels enable status
         self.actual_sample_interval = None
+        self.downsample_ratio = 1 # raw samples per stored sample
+        self.downsample_ratio_mode = 'none'
 
 
-    def open_unit(self, serial_number):
-        serial_number = serial_number.encode()
-        self.status["openUnit"] = psa.ps4000aOpenUnit(ctypes.byref(self.chandle), serial_number)
-        assert_pico_ok(self.status["openUnit"])
-        print("[PicoScope] PicoScope connected, chandle:", self.chandle.value)
-
-    def stop_sampling(self):
-        self.status["stopUnit"] = psa.ps4000aStop(self.chandle)
-        assert_pico_ok(self.status["stopUnit"])
-
-    def close_unit(self):
-        self.status["closeUnit"] = psa.ps4000aCloseUnit(self.chandle)
-        assert_pico_ok(self.status["closeUnit"])
-
     def run_stream(self,
                    sample_interval_ns: int,
                    max_post_trigger_samples: int,
                    downsample_ratio: int = 1,  # default no downsampling
                    downsample_ratio_mode: str = 'none',
+                   max_pre_trigger_samples: int = 0,
+                   driver_buffer_size: int = None,  # default: sized from the sample interval
+                   spill_dir: str = None,  # default: capture in RAM, else memory-mapped in this directory
                    ):
 
-        # allocate and register working buffers
-        self.total_samples = max_post_trigger_samples
-        buffer_size = 1000
-        for ch, enabled in enumerate(self.enabled_channels):
-            if enabled == 1:
-                self.buffers[ch] = np.zeros(shape=buffer_size, dtype=np.int16) # in adc
+        # allocate (or reuse) and register working buffers. With hardware downsampling the driver delivers
+        # one value (a max/min pair in aggregate mode) per downsample_ratio samples.
+        self.acquisition_mode = 'stream'
+        self.reset_segments()
+        self.downsample_ratio = max(int(downsample_ratio), 1) if downsample_ratio_mode != 'none' else 1
+        self.downsample_ratio_mode = downsample_ratio_mode if self.downsample_ratio > 1 else 'none'
+        aggregate = self.downsample_ratio_mode == 'aggregate'
+        pre_trigger_samples = math.ceil(max_pre_trigger_samples / self.downsample_ratio)
+        self.total_samples = pre_trigger_samples + math.ceil(max_post_trigger_samples / self.downsample_ratio)
+        channels = [ch for ch, enabled in enumerate(self.enabled_channels) if enabled == 1]
+        buffer_size = driver_buffer_size or choose_driver_buffer_size(sample_interval_ns * self.downsample_ratio,
+                                                                      self.total_samples)
+        self.complete_buffers = {} # views of the previous capture, which may be replaced
+        self.stream_buffer.allocate(channels, self.total_samples, buffer_size, pre_trigger_samples, aggregate,
+                                    spill_dir)
+        self.buffers = self.stream_buffer.driver_rows()
+        self.complete_buffers = self.stream_buffer.rows()
+        min_buffers = self.stream_buffer.driver_min_rows()
+        for ch, buffer in self.buffers.items():
+            if aggregate:
+                self.set_data_buffers(channel=ch,
+                                      buffer_max=buffer,
+                                      buffer_min=min_buffers[ch],
+                                      bufferLth=buffer_size,
+                                      mode=self.downsample_ratio_mode)
+            else:
                 self.set_data_buffer(channel=ch,
-                                     buffer=self.buffers[ch],
+                                     buffer=buffer,
                                      bufferLth=buffer_size,
-                                     mode=downsample_ratio_mode)
-        # allocate complete buffers
-        for ch, enabled in enumerate(self.enabled_channels):
-            if enabled == 1:
-                self.complete_buffers[ch] = np.zeros(shape=self.total_samples, dtype=np.int16) # in adc
+                                     mode=self.downsample_ratio_mode)
 
         # parameters
-        max_pre_trigger_samples = 0
         stop_auto = 0 # do not stop after all samples fetched
         c_sample_interval = ctypes.c_int32(sample_interval_ns)
-        time_units = psa.PS4000A_TIME_UNITS['PS4000A_NS']  # Nanoseconds
-        c_downsample_ratio_mode = _get_ratio_mode(downsample_ratio_mode)
+        c_downsample_ratio_mode = _get_ratio_mode(self.downsample_ratio_mode)
         overview_buffer_size = buffer_size
 
-        self.status["runStreaming"] = psa.ps4000aRunStreaming(self.chandle,
-                                                             ctypes.byref(c_sample_interval),
-                                                             time_units,
+        self.status["runStreaming"] = self._ps_run_streaming(c_sample_interval,
                                                              max_pre_trigger_samples,
                                                              max_post_trigger_samples,
                                                              stop_auto,
-                                                             downsample_ratio,
+                                                             self.downsample_ratio,
                                                              c_downsample_ratio_mode,
                                                              overview_buffer_size)
 
@@ -120,55 +152,371 @@ class PicoScope4000A(object):
         print(f"[INFO] sample interval: {sample_interval_ns}ns -> {self.actual_sample_interval}ns")
 
         # callback
-        self.next_sample = 0
+        stream_buffer = self.stream_buffer
+        scheduler = FetchScheduler(self.actual_sample_interval * self.downsample_ratio, buffer_size)
+        self.fetch_scheduler = scheduler
         self.auto_stop_outer = False
-        self.was_called_back = False
+        stats = self.stream_stats
+        stats.reset()
 
         def streaming_callback(handle, noOfSamples, startIndex, overflow, triggerAt, triggered, autoStop, param):
-            self.was_called_back = True
-
-            if triggered != 0 and not self.trigger_event.is_set():
+            scheduler.delivered += noOfSamples
+            if overflow:
+                new_channels = [ch for ch in range(8) if overflow & (1 << ch) and stats.overflow_events[ch] == 0]
+                if new_channels:
+                    print(f"[WARNING] Over range on channel(s) {new_channels}, the data is clipped")
+            stats.callback(noOfSamples, overflow)
+
+            if not self.trigger_event.is_set():
+                if triggered == 0:
+                    stream_buffer.record_history(startIndex, noOfSamples) # O(noOfSamples), no allocation
+                    return
+                # splice the pre-trigger history in front, the trigger point is at index pre_trigger_samples
                 self.trigger_event.set()
-                self.triggered_at = triggerAt
-                print(f"\n [INFO] Was Triggered at {self.triggered_at}")
+                stats.triggered()
+                complete_overflow = stream_buffer.start_capture(startIndex, triggerAt, noOfSamples)
+                self.triggered_at = stream_buffer.pre_trigger_samples
+                print(f"\n [INFO] Was Triggered at {triggerAt} "
+                      f"({stream_buffer.pre_trigger_valid}/{stream_buffer.pre_trigger_samples} pre-trigger samples)")
+            else:
+                complete_overflow = stream_buffer.append(startIndex, noOfSamples)
+
+            if complete_overflow > 0:
+                print(f"[WARNING] Truncating buffer by {complete_overflow} samples to fit total_samples={self.total_samples} \n")
+
+            if autoStop:
+                self.auto_stop_outer = True
 
-            if self.trigger_event.is_set():
-                dest_end = self.next_sample + noOfSamples
-                source_end = startIndex + noOfSamples
 
-                if dest_end > self.total_samples:
-                    complete_overflow = dest_end - self.total_samples
-                    dest_end = self.total_samples
-                    source_end -= complete_overflow
-                    print(f"[WARNING] Truncating buffer by {complete_overflow} samples to fit total_samples={self.total_samples} \n")
+        c_func_ptr = self._ps_streaming_ready_type(streaming_callback)
 
-                for ch_, enabled_ in enumerate(self.enabled_channels):
-                    if enabled_ == 1:
-                        self.complete_buffers[ch_][self.next_sample:dest_end] = self.buffers[ch_][startIndex:source_end]
+        def fetching():
+            scheduler.start()
+            while not self.stop_sampling_event.is_set():
+                self.status["getStreamingLastestValues"] = self._ps_get_streaming_latest_values(c_func_ptr)
+                wait_s = scheduler.poll_done()
+                if stream_buffer.is_complete or self.auto_stop_outer:
+                    break # all samples are there, no further poll
+                # wakes up immediately if the sampling is stopped from outside
+                self.stop_sampling_event.wait(wait_s)
+
+            stats.completed()
+            self.stop_sampling_event.set() # now the writing can start
+            print("[WARNING] Fetching is finished ... No more data is being collected")
+            self.stop_sampling()
 
-                self.next_sample += noOfSamples
+        # start fetching data in different thread to not block buffered mode
+        self.fetching_thread = threading.Thread(target=fetching)
+        self.fetching_thread.start()
+        print("[INFO] Waiting for trigger ...")
 
-                if autoStop:
-                    self.auto_stop_outer = True
+    def run_live(self, sample_interval_ns: int, window_samples: int, frame_period_s: float, on_frame,
+                 driver_buffer_size: int = None):
+        """
+        Untriggered, endless streaming for the live view in manual mode. Only the newest window_samples per channel
+        are kept, in a fixed-size RingBuffer, so the memory stays constant however long the view runs.
+        Runs until stop_sampling_event is set.
 
+        :param frame_period_s: on_frame is called at most once per frame period
+        :param on_frame: called with the RingBuffer from the fetching thread, between two driver polls
+        """
+        self.acquisition_mode = 'live'
+        self.reset_segments()
+        self.downsample_ratio = 1
+        self.downsample_ratio_mode = 'none'
+        channels = [ch for ch, enabled in enumerate(self.enabled_channels) if enabled == 1]
+        buffer_size = driver_buffer_size or choose_driver_buffer_size(sample_interval_ns, window_samples)
+        self.complete_buffers = {}
+        # own driver buffers, the window is the ring buffer: the capture memory (and its spill file) of the
+        # stream_buffer stays allocated for the next shot
+        if self.live_driver.shape != (len(channels), int(buffer_size)):
+            self.live_driver = np.zeros((len(channels), int(buffer_size)), dtype=np.int16)
+        if self.live_buffer.buffer.shape != (len(channels), int(window_samples)):
+            self.live_buffer = RingBuffer(len(channels), int(window_samples))
+        self.live_buffer.clear()
+        self.live_channels = channels
+        self.buffers = {ch: self.live_driver[i] for i, ch in enumerate(channels)}
+        for ch, buffer in self.buffers.items():
+            self.set_data_buffer(channel=ch, buffer=buffer, bufferLth=buffer_size)
+        self.disable_trigger()
+
+        c_sample_interval = ctypes.c_int32(sample_interval_ns)
+        self.status["runStreaming"] = self._ps_run_streaming(c_sample_interval,
+                                                             0, # no pre-trigger samples
+                                                             buffer_size,
+                                                             0, # no auto stop, runs until stopped
+                                                             1,
+                                                             _get_ratio_mode('none'),
+                                                             buffer_size)
+        assert_pico_ok(self.status["runStreaming"])
+        self.actual_sample_interval = c_sample_interval.value
+        print(f"[INFO] Live view: sample interval {self.actual_sample_interval}ns, {window_samples} samples")
+
+        driver = self.live_driver
+        live = self.live_buffer
+        scheduler = FetchScheduler(self.actual_sample_interval, buffer_size)
+        self.fetch_scheduler = scheduler
 
-        c_func_ptr = psa.StreamingReadyType(streaming_callback)
+        def live_callback(handle, noOfSamples, startIndex, overflow, triggerAt, triggered, autoStop, param):
+            scheduler.delivered += noOfSamples
+            live.write(driver[:, startIndex:startIndex + noOfSamples]) # O(noOfSamples), no allocation
+
+        c_func_ptr = self._ps_streaming_ready_type(live_callback)
 
         def fetching():
-            while self.next_sample < self.total_samples and not self.auto_stop_outer and not self.stop_sampling_event.is_set():
-                self.was_called_back = False
-                self.status["getStreamingLastestValues"] = psa.ps4000aGetStreamingLatestValues(self.chandle, c_func_ptr, None)
-                if not self.was_called_back:
-                    time.sleep(0.001)
+            scheduler.start()
+            next_frame = time.perf_counter()
+            while not self.stop_sampling_event.is_set():
+                self.status["getStreamingLastestValues"] = self._ps_get_streaming_latest_values(c_func_ptr)
+                wait_s = scheduler.poll_done()
+                now = time.perf_counter()
+                if now >= next_frame and live.count > 0:
+                    next_frame = now + frame_period_s
+                    try:
+                        on_frame(live)
+                    except Exception as e:
+                        print(f"[WARNING] Live view frame failed: {e}")
+                self.stop_sampling_event.wait(wait_s)
+            self.stop_sampling()
+            print("[INFO] Live view stopped")
+
+        self.fetching_thread = threading.Thread(target=fetching, daemon=True)
+        self.fetching_thread.start()
+
+    #######################################################################
+    ########################### Rapid block ###############################
+    #######################################################################
+    def _timebase_interval(self, timebase: int, n_samples: int):
+        """Sample interval of the timebase in ns, None if the timebase is not available (too fast for the model or
+        for the enabled channels)"""
+        c_interval_ns = ctypes.c_float()
+        c_max_samples = ctypes.c_int32()
+        status = self._ps_get_timebase2(timebase, n_samples, c_interval_ns, c_max_samples)
+        return c_interval_ns.value if status == PICO_STATUS["PICO_OK"] else None
+
+    def get_timebase(self, sample_interval_ns: float, n_samples: int = 1) -> int:
+        """
+        Timebase with the sample interval closest to sample_interval_ns. The mapping differs between models (e.g.
+        (timebase + 1) * 12.5 ns on the 4824, 2^timebase * 12.5 ns up to timebase 2 on the 4224/4424, (timebase + 1) * 100 ns
+        on the 4262), so the intervals are asked from the driver. They grow with the timebase: the first timebase
+        reaching the interval is bracketed by doubling, then bisected.
+        """
+        def reaches(timebase):
+            interval = self._timebase_interval(timebase, n_samples)
+            return interval is not None and interval >= sample_interval_ns
+
+        high = 1
+        while not reaches(high):
+            if high >= 2 ** 31:
+                raise LabscriptError(f"No timebase of the scope reaches a sample interval of {sample_interval_ns}ns")
+            high *= 2
+        low = high // 2 # does not reach, unless high == 1
+        if reaches(low):
+            high = low
+        while high - low > 1:
+            middle = (low + high) // 2
+            if reaches(middle):
+                high = middle
+            else:
+                low = middle
+        if high == 0:
+            return 0
+        # the timebase just below may be closer
+        below = self._timebase_interval(high - 1, n_samples)
+        above = self._timebase_interval(high, n_samples)
+        if below is not None and sample_interval_ns - below < above - sample_interval_ns:
+            return high - 1
+        return high
+
+    def run_block(self,
+                  sample_interval_ns: int,
+                  max_pre_trigger_samples: int,
+                  max_post_trigger_samples: int,
+                  n_segments: int = 1,
+                  ):
+        """
+        Rapid block mode: split the scope memory into n_segments and capture one trigger per segment at the full
+        hardware rate. When all segments are captured, all of them are read with a single GetValuesBulk into
+        segment_buffer.data (segments x channels x samples).
+        """
+        self.acquisition_mode = 'block'
+        self.downsample_ratio = 1
+        self.downsample_ratio_mode = 'none'
+        n_samples = max_pre_trigger_samples + max_post_trigger_samples
+        self.total_samples = n_samples
+        timebase = self.get_timebase(sample_interval_ns, n_samples)
+
+        c_max_samples = ctypes.c_int32()
+        self.status["memorySegments"] = self._ps_memory_segments(n_segments, c_max_samples)
+        assert_pico_ok(self.status["memorySegments"])
+        if n_samples > c_max_samples.value:
+            raise LabscriptError(f"{n_samples} samples per segment exceed the segment memory of "
+                                 f"{c_max_samples.value} samples with {n_segments} segments")
+
+        self.status["setNoOfCaptures"] = self._ps_set_no_of_captures(n_segments)
+        assert_pico_ok(self.status["setNoOfCaptures"])
+        self.n_segments = n_segments
+
+        c_interval_ns = ctypes.c_float()
+        c_returned_max_samples = ctypes.c_int32()
+        self.status["getTimebase2"] = self._ps_get_timebase2(timebase, n_samples, c_interval_ns, c_returned_max_samples)
+        assert_pico_ok(self.status["getTimebase2"])
+        self.actual_sample_interval = c_interval_ns.value
+        print(f"[INFO] block sample interval: {sample_interval_ns}ns -> {self.actual_sample_interval}ns (timebase {timebase})")
+
+        channels = [ch for ch, enabled in enumerate(self.enabled_channels) if enabled == 1]
+        self.segment_buffer.allocate(n_segments, channels, n_samples)
+        self.triggered_at = max_pre_trigger_samples
+
+        self.status["runBlock"] = self._ps_run_block(max_pre_trigger_samples, max_post_trigger_samples, timebase)
+        assert_pico_ok(self.status["runBlock"])
+
+        def fetching():
+            ready = ctypes.c_int16(0)
+            while not self.stop_sampling_event.is_set():
+                self.status["isReady"] = self._ps_is_ready(ready)
+                if ready.value != 0:
+                    break
+                self.stop_sampling_event.wait(BLOCK_POLL_PERIOD_S)
+
+            if ready.value != 0:
+                self.trigger_event.set()
+                self.get_values_bulk()
+            else:
+                print("[WARNING] Block capture aborted before all segments were captured")
 
             self.stop_sampling_event.set() # now the writing can start
-            print("[WARNING] Fetching is finished ... No more data is being collected")
             self.stop_sampling()
 
-        # start fetching data in different thread to not block buffered mode
         self.fetching_thread = threading.Thread(target=fetching)
         self.fetching_thread.start()
-        print("[INFO] Waiting for trigger ...")
+        print(f"[INFO] Waiting for {n_segments} trigger(s) ...")
+
+    def reset_segments(self):
+        """After rapid block mode, give the whole scope memory back to one segment and one capture for streaming."""
+        if self.n_segments == 1:
+            return
+        self.status["setNoOfCaptures"] = self._ps_set_no_of_captures(1)
+        assert_pico_ok(self.status["setNoOfCaptures"])
+        c_max_samples = ctypes.c_int32()
+        self.status["memorySegments"] = self._ps_memory_segments(1, c_max_samples)
+        assert_pico_ok(self.status["memorySegments"])
+        self.n_segments = 1
+
+    def get_values_bulk(self):
+        """Register every (segment, channel) row of the segment buffer and read all segments at once."""
+        data = self.segment_buffer.data
+        n_segments, _, n_samples = data.shape
+        for segment in range(n_segments):
+            for i, ch in enumerate(self.segment_buffer.channels):
+                self.set_data_buffer_bulk(channel=ch, buffer=data[segment, i], bufferLth=n_samples, waveform=segment)
+
+        c_no_of_samples = ctypes.c_uint32(n_samples)
+        overflow = (ctypes.c_int16 * n_segments)()
+        self.status["getValuesBulk"] = self._ps_get_values_bulk(c_no_of_samples, n_segments, overflow)
+        assert_pico_ok(self.status["getValuesBulk"])
+
+        self.segment_buffer.samples = c_no_of_samples.value
+        self.segment_buffer.overflow = list(overflow)
+
+    @property
+    def trace_sample_interval(self):
+        """Interval between two stored samples in ns: the sample interval times the downsample ratio"""
+        return self.actual_sample_interval * self.downsample_ratio
+
+    def adc2mv_1d(self, data_adc, ch):
+        channel_range = self.channel_ranges[ch]
+        data_mv = adc_to_mv(data_adc, channel_range, self.max_adc.value)
+        return data_mv
+
+    def adc2mv(self, data_adc, channels, axis=0):
+        """Convert (channels, samples) ADC counts to mV in one vectorised operation. `axis` enumerates the channels."""
+        channel_ranges = [self.channel_ranges[ch] for ch in channels]
+        return adc_to_mv(data_adc, channel_ranges, self.max_adc.value, axis=axis)
+
+    def trace_attributes(self, channels, units):
+        """Scale/offset attributes to store with traces of the given channels."""
+        return trace_attributes([self.channel_ranges[ch] for ch in channels],
+                                self.max_adc.value,
+                                [self.analog_offsets.get(ch, 0.0) for ch in channels],
+                                units)
+
+
+class PicoScope4000A(PicoScopeBase):
+    def __init__(self, serial_number, driver=None):
+        """
+        :param serial_number: serial number of the scope, None opens the first scope found
+        :param driver: ps4000a driver to use, default picosdk's. A simulation.SimulatedPs4000a runs without a scope.
+        """
+        self.psa = psa if driver is None else driver
+        super().__init__(serial_number)
+
+    def open_unit(self, serial_number):
+        serial_number = None if serial_number is None else serial_number.encode()
+        self.status["openUnit"] = self.psa.ps4000aOpenUnit(ctypes.byref(self.chandle), serial_number)
+        assert_pico_ok(self.status["openUnit"])
+        print("[PicoScope] PicoScope connected, chandle:", self.chandle.value)
+
+    def stop_sampling(self):
+        self.status["stopUnit"] = self.psa.ps4000aStop(self.chandle)
+        assert_pico_ok(self.status["stopUnit"])
+
+    def close_unit(self):
+        self.status["closeUnit"] = self.psa.ps4000aCloseUnit(self.chandle)
+        assert_pico_ok(self.status["closeUnit"])
+
+    def _ps_maximum_value(self, c_max_adc):
+        return self.psa.ps4000aMaximumValue(self.chandle, ctypes.byref(c_max_adc))
+
+    def _ps_run_streaming(self, c_sample_interval, max_pre_trigger_samples, max_post_trigger_samples, auto_stop,
+                          downsample_ratio, downsample_ratio_mode, overview_buffer_size):
+        return self.psa.ps4000aRunStreaming(self.chandle,
+                                            ctypes.byref(c_sample_interval),
+                                            self.psa.PS4000A_TIME_UNITS['PS4000A_NS'],
+                                            max_pre_trigger_samples,
+                                            max_post_trigger_samples,
+                                            auto_stop,
+                                            downsample_ratio,
+                                            downsample_ratio_mode,
+                                            overview_buffer_size)
+
+    def _ps_streaming_ready_type(self, callback):
+        return self.psa.StreamingReadyType(callback)
+
+    def _ps_get_streaming_latest_values(self, c_func_ptr):
+        return self.psa.ps4000aGetStreamingLatestValues(self.chandle, c_func_ptr, None)
+
+    def disable_trigger(self):
+        """Free-running acquisition: disables the simple trigger and clears the advanced trigger conditions"""
+        self.status["setSimpleTrigger"] = self.psa.ps4000aSetSimpleTrigger(self.chandle, 0, 0, 0, 0, 0, 0)
+        assert_pico_ok(self.status["setSimpleTrigger"])
+        self.status["setTriggerChannelConditions"] = self.psa.ps4000aSetTriggerChannelConditions(self.chandle, None, 0,
+                                                                                                 _get_info("clear"))
+        assert_pico_ok(self.status["setTriggerChannelConditions"])
+
+    #######################################################################
+    ########################### Rapid block ###############################
+    #######################################################################
+    def _ps_memory_segments(self, n_segments, c_max_samples):
+        return self.psa.ps4000aMemorySegments(self.chandle, n_segments, ctypes.byref(c_max_samples))
+
+    def _ps_set_no_of_captures(self, n_captures):
+        return self.psa.ps4000aSetNoOfCaptures(self.chandle, n_captures)
+
+    def _ps_get_timebase2(self, timebase, n_samples, c_interval_ns, c_max_samples):
+        return self.psa.ps4000aGetTimebase2(self.chandle, timebase, n_samples, ctypes.byref(c_interval_ns),
+                                            ctypes.byref(c_max_samples), 0)
+
+    def _ps_run_block(self, max_pre_trigger_samples, max_post_trigger_samples, timebase):
+        return self.psa.ps4000aRunBlock(self.chandle, max_pre_trigger_samples, max_post_trigger_samples, timebase,
+                                        None, 0, None, None)
+
+    def _ps_is_ready(self, c_ready):
+        return self.psa.ps4000aIsReady(self.chandle, ctypes.byref(c_ready))
+
+    def _ps_get_values_bulk(self, c_no_of_samples, n_segments, c_overflow):
+        return self.psa.ps4000aGetValuesBulk(self.chandle, ctypes.byref(c_no_of_samples), 0, n_segments - 1, 1, 0,
+                                             ctypes.byref(c_overflow))
 
     def set_data_buffer(self, channel: int, buffer, bufferLth: int, segmentIndex: int=0, mode: str='none'):
         """
@@ -185,15 +533,37 @@ class PicoScope4000A(object):
         # parameters
         ptr = buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_int16))
         c_mode = _get_ratio_mode(mode)
-        self.status[f"setDataBuffer_{channel}"] = psa.ps4000aSetDataBuffer(self.chandle, channel, ptr, bufferLth,
-                                                                          segmentIndex, c_mode)
+        self.status[f"setDataBuffer_{channel}"] = self.psa.ps4000aSetDataBuffer(self.chandle, channel, ptr, bufferLth,
+                                                                               segmentIndex, c_mode)
         assert_pico_ok(self.status[f"setDataBuffer_{channel}"])
 
+    def set_data_buffer_bulk(self, channel: int, buffer, bufferLth: int, waveform: int):
+        """
+        Register the buffer of one segment of a rapid block capture, for GetValuesBulk.
+
+        :param waveform: the memory segment the buffer receives
+        """
+        self.set_data_buffer(channel=channel, buffer=buffer, bufferLth=bufferLth, segmentIndex=waveform)
+
+    def set_data_buffers(self, channel: int, buffer_max, buffer_min, bufferLth: int, segmentIndex: int=0,
+                         mode: str='aggregate'):
+        """
+        Register a max and a min buffer for the channel, needed by the 'aggregate' downsampling mode.
+
+        :param channel: the channel for which you want to set the buffers
+        :param buffer_max: receives the maximum of each aggregated block of samples, in ADC counts
+        :param buffer_min: receives the minimum of each aggregated block of samples, in ADC counts
+        :param bufferLth: the size of each buffer array
+        :param segmentIndex: the number of the memory segment to be retrieved. (=0, streaming)
+        :param mode: downsampling mode, 'aggregate'
+        """
+        ptr_max = buffer_max.ctypes.data_as(ctypes.POINTER(ctypes.c_int16))
+        ptr_min = buffer_min.ctypes.data_as(ctypes.POINTER(ctypes.c_int16))
+        c_mode = _get_ratio_mode(mode)
+        self.status[f"setDataBuffers_{channel}"] = self.psa.ps4000aSetDataBuffers(self.chandle, channel, ptr_max, ptr_min,
+                                                                                 bufferLth, segmentIndex, c_mode)
+        assert_pico_ok(self.status[f"setDataBuffers_{channel}"])
 
-    def adc2mv_1d(self, data_adc, ch):
-        channel_range = self.channel_ranges[ch]
-        data_mv = adc2mV(data_adc, channel_range, self.max_adc)
-        return data_mv
 
     def set_simple_edge_trigger(self,
                                 source: str,
@@ -209,13 +579,13 @@ class PicoScope4000A(object):
         threshold_adc = mV2adc(threshold, ch_range_v, self.max_adc)
         int_direction = _get_direction(direction)
 
-        self.status["setSimpleTrigger"] = psa.ps4000aSetSimpleTrigger(self.chandle,
-                                                                     enable,
-                                                                     ch_num,
-                                                                     threshold_adc,
-                                                                     int_direction,
-                                                                     delay,
-                                                                     auto_trigger_ms)
+        self.status["setSimpleTrigger"] = self.psa.ps4000aSetSimpleTrigger(self.chandle,
+                                                                          enable,
+                                                                          ch_num,
+                                                                          threshold_adc,
+                                                                          int_direction,
+                                                                          delay,
+                                                                          auto_trigger_ms)
         assert_pico_ok(self.status["setSimpleTrigger"])
 
         # print(f"[DEBUG] the simple level trigger is set. status: {self.status["setSimpleTrigger"]}")
@@ -231,17 +601,18 @@ class PicoScope4000A(object):
 
         c_analogue_offset = ctypes.c_float(analogue_offset)
 
-        self.status[f"setCh{channel}"] = psa.ps4000aSetChannel(self.chandle,
-                                                              ch_num,
-                                                              enabled,
-                                                              int_coupling,
-                                                              int_range,
-                                                              c_analogue_offset)
+        self.status[f"setCh{channel}"] = self.psa.ps4000aSetChannel(self.chandle,
+                                                                   ch_num,
+                                                                   enabled,
+                                                                   int_coupling,
+                                                                   int_range,
+                                                                   c_analogue_offset)
 
         assert_pico_ok(self.status[f"setCh{channel}"])
 
         # save channel attributes: ranges, enable/disable
         self.channel_ranges[ch_num] = int_range
+        self.analog_offsets[ch_num] = analogue_offset
         if enabled == 1:
             self.enabled_channels[ch_num] = 1
 
@@ -258,8 +629,8 @@ class PicoScope4000A(object):
         """
         max_v = ctypes.c_float()
         min_v = ctypes.c_float()
-        self.status["getAnalogueOffset"] = psa.ps4000aGetAnalogueOffset(self.chandle, ch_range, coupling,
-                                                                       ctypes.byref(max_v), ctypes.byref(min_v))
+        self.status["getAnalogueOffset"] = self.psa.ps4000aGetAnalogueOffset(self.chandle, ch_range, coupling,
+                                                                            ctypes.byref(max_v), ctypes.byref(min_v))
         assert_pico_ok(self.status["getAnalogueOffset"])
         return max_v.value, min_v.value
 
@@ -308,11 +679,11 @@ class PicoScope4000A(object):
         triggersource_int = _get_siggen_trigger_source(trigger_source)
         triggertype_int = _get_siggen_trigger_type(trigger_type)
 
-        self.status["SetSigGenBuiltIn"] = psa.ps4000aSetSigGenBuiltIn(self.chandle, offset_voltage, pk2pk, wavetype_int,
-                                                                     start_frequency, stop_frequency,
-                                                                     increment, dwell_time, sweep_type, operation, shots,
-                                                                     sweeps, triggertype_int,
-                                                                     triggersource_int, ext_in_threshold)
+        self.status["SetSigGenBuiltIn"] = self.psa.ps4000aSetSigGenBuiltIn(self.chandle, offset_voltage, pk2pk, wavetype_int,
+                                                                          start_frequency, stop_frequency,
+                                                                          increment, dwell_time, sweep_type, operation, shots,
+                                                                          sweeps, triggertype_int,
+                                                                          triggersource_int, ext_in_threshold)
         assert_pico_ok(self.status["SetSigGenBuiltIn"])
 
     def siggen_software_control(self, state):
@@ -322,7 +693,7 @@ class PicoScope4000A(object):
         :param state: sets the trigger gate high or low when the trigger type is set to either SIGGEN_GATE_HIGH or SIGGEN_GATE_LOW. Ignored for other trigger types
         :return:
         """
-        self.status["sigGenSoftwareControl"] = psa.ps4000aSigGenSoftwareControl(self.chandle, state)
+        self.status["sigGenSoftwareControl"] = self.psa.ps4000aSigGenSoftwareControl(self.chandle, state)
         print("sigGenSoftwareControl executed.")
 
     #######################################################################
@@ -337,15 +708,15 @@ class PicoScope4000A(object):
         ps_conditions = []
         for source in sources:
             source_int = _get_channel_number(source)
-            state = psa.PS4000A_TRIGGER_STATE["PS4000A_TRUE"]
-            ps_conditions.append(psa.PS4000A_CONDITION(source_int, state))
+            state = self.psa.PS4000A_TRIGGER_STATE["PS4000A_TRUE"]
+            ps_conditions.append(self.psa.PS4000A_CONDITION(source_int, state))
         n_conditions = len(ps_conditions)
 
         # create ctypes array
-        cond_array = (psa.PS4000A_CONDITION * n_conditions)(*ps_conditions)
+        cond_array = (self.psa.PS4000A_CONDITION * n_conditions)(*ps_conditions)
         info_int = _get_info(info)
 
-        self.status["setTriggerChannelConditions"] = psa.ps4000aSetTriggerChannelConditions(
+        self.status["setTriggerChannelConditions"] = self.psa.ps4000aSetTriggerChannelConditions(
             self.chandle,
             ctypes.byref(cond_array),
             n_conditions,
@@ -358,12 +729,12 @@ class PicoScope4000A(object):
         for direction in directions:
             source_int = _get_channel_number(direction["source"])
             direction_int = _get_direction(direction["direction"])
-            ps_directions.append(psa.PS4000A_DIRECTION(source_int, direction_int))
+            ps_directions.append(self.psa.PS4000A_DIRECTION(source_int, direction_int))
 
         n_directions = len(ps_directions)
-        dir_array = (psa.PS4000A_DIRECTION * n_directions)(*ps_directions)
+        dir_array = (self.psa.PS4000A_DIRECTION * n_directions)(*ps_directions)
 
-        self.status["setTriggerChannelDirections"] = psa.ps4000aSetTriggerChannelDirections(
+        self.status["setTriggerChannelDirections"] = self.psa.ps4000aSetTriggerChannelDirections(
             self.chandle,
             ctypes.byref(dir_array),
             n_directions
@@ -381,7 +752,7 @@ class PicoScope4000A(object):
             upper_hysteresis_adc = mV2adc(prop["upper_hysteresis"], ch_range, self.max_adc)
             lower_hysteresis_adc = mV2adc(prop["lower_hysteresis"], ch_range, self.max_adc)
 
-            ps_properties.append(psa.PS4000A_TRIGGER_CHANNEL_PROPERTIES(
+            ps_properties.append(self.psa.PS4000A_TRIGGER_CHANNEL_PROPERTIES(
                 threshold_upper_adc,
                 upper_hysteresis_adc,
                 threshold_lower_adc,
@@ -391,11 +762,11 @@ class PicoScope4000A(object):
             ))
 
         n_properties = len(ps_properties)
-        prop_array = (psa.PS4000A_TRIGGER_CHANNEL_PROPERTIES * n_properties)(*ps_properties)
+        prop_array = (self.psa.PS4000A_TRIGGER_CHANNEL_PROPERTIES * n_properties)(*ps_properties)
 
         auto_trigger_ms = 0  # the time in milliseconds, If 0, waits indefinitely for a trigger
 
-        self.status["setTriggerChannelProperties"] = psa.ps4000aSetTriggerChannelProperties(
+        self.status["setTriggerChannelProperties"] = self.psa.ps4000aSetTriggerChannelProperties(
             self.chandle,
             ctypes.byref(prop_array),
             n_properties,
@@ -406,45 +777,11 @@ class PicoScope4000A(object):
 
     def set_trigger_delay(self, delay):
         """delay in sample periods"""
-        self.status["setTriggerDelay"] = psa.ps4000aSetTriggerDelay(self.chandle, delay)
+        self.status["setTriggerDelay"] = self.psa.ps4000aSetTriggerDelay(self.chandle, delay)
         assert_pico_ok(self.status["setTriggerDelay"])
 
 
-class PicoScope4000(object):
-    def __init__(self, serial_number):
-        self.chandle = ctypes.c_int16()
-        self.status = {}
-
-        # Data Acquisition
-        self.fetching_thread = None
-        self.stop_sampling_event = threading.Event() # indicates the moment the fetching stopped, and the writing can begin
-        self.stop_sampling_event.clear()
-
-        # Triggering
-        self.trigger_event = threading.Event()
-        self.trigger_event.clear()
-
-        self.buffers = {} # in adc
-        self.complete_buffers = {} # in adc
-
-        # Preparing for data acquisition
-        self.total_samples = None
-        self.next_sample = None
-        self.auto_stop_outer = None
-        self.was_called_back = None
-        self.triggered_at = None
-
-        # Open Unit
-        self.open_unit(serial_number)
-
-        # Unit's constants
-        self.max_adc = ctypes.c_int32()
-        self.status["maximumValue"] = ps.ps4000MaximumValue(self.chandle, ctypes.byref(self.max_adc))
-        self.channel_ranges = {} # channel voltage range in serial number per channel
-        self.enabled_channels = [0,0,0,0,0,0,0,0] # store channels enable status
-        self.actual_sample_interval = None
-
-
+class PicoScope4000(PicoScopeBase):
     def open_unit(self, serial_number):
         serial_number = serial_number.encode()
         self.status["openUnit"] = ps.ps4000OpenUnitEx(ctypes.byref(self.chandle), serial_number)
@@ -459,127 +796,98 @@ class PicoScope4000(object):
         self.status["closeUnit"] = ps.ps4000CloseUnit(self.chandle)
         assert_pico_ok(self.status["closeUnit"])
 
-    def run_stream(self,
-                   sample_interval_ns: int,
-                   max_post_trigger_samples: int,
-                   downsample_ratio: int = 1,  # default no downsampling
-                   downsample_ratio_mode: str = 'none',
-                   ):
-
-        # allocate and register working buffers
-        self.total_samples = max_post_trigger_samples
-        buffer_size = 1000
-        for ch, enabled in enumerate(self.enabled_channels):
-            if enabled == 1:
-                self.buffers[ch] = np.zeros(shape=buffer_size, dtype=np.int16) # in adc
-                self.set_data_buffer(channel=ch,
-                                     buffer=self.buffers[ch],
-                                     bufferLth=buffer_size,
-                                     mode=downsample_ratio_mode)
-        # allocate complete buffers
-        for ch, enabled in enumerate(self.enabled_channels):
-            if enabled == 1:
-                self.complete_buffers[ch] = np.zeros(shape=self.total_samples, dtype=np.int16) # in adc
-
-        # parameters
-        max_pre_trigger_samples = 0
-        stop_auto = 0 # do not stop after all samples fetched
-        c_sample_interval = ctypes.c_int32(sample_interval_ns)
-        time_units = ps.PS4000_TIME_UNITS['PS4000_NS']  # Nanoseconds
-        c_downsample_ratio_mode = _get_ratio_mode(downsample_ratio_mode)
-        overview_buffer_size = buffer_size
-
-        self.status["runStreaming"] = ps.ps4000RunStreaming(self.chandle,
-                                                             ctypes.byref(c_sample_interval),
-                                                             time_units,
-                                                             max_pre_trigger_samples,
-                                                             max_post_trigger_samples,
-                                                             stop_auto,
-                                                             downsample_ratio,
-                                                             c_downsample_ratio_mode,
-                                                             overview_buffer_size)
-
-        assert_pico_ok(self.status["runStreaming"])
-
-        self.actual_sample_interval = c_sample_interval.value
-        print(f"[INFO] sample interval: {sample_interval_ns}ns -> {self.actual_sample_interval}ns")
-
-        # callback
-        self.next_sample = 0
-        self.auto_stop_outer = False
-        self.was_called_back = False
-        self.was_triggered = False
-
-        def streaming_callback(handle, noOfSamples, startIndex, overflow, triggerAt, triggered, autoStop, param):
-            self.was_called_back = True
-
-            if triggered != 0 and not self.trigger_event.is_set():
-                self.trigger_event.set()
-                self.triggered_at = triggerAt
-                print(f"\n [INFO] Was Triggered at {self.triggered_at}")
-
-            if self.trigger_event.is_set():
-                dest_end = self.next_sample + noOfSamples
-                source_end = startIndex + noOfSamples
-
-                if dest_end > self.total_samples:
-                    complete_overflow = dest_end - self.total_samples
-                    dest_end = self.total_samples
-                    source_end -= complete_overflow
-                    print(f"[WARNING] Truncating buffer by {complete_overflow} samples to fit total_samples={self.total_samples} \n")
-
-                for ch_, enabled_ in enumerate(self.enabled_channels):
-                    if enabled_ == 1:
-                        self.complete_buffers[ch_][self.next_sample:dest_end] = self.buffers[ch_][startIndex:source_end]
+    def _ps_maximum_value(self, c_max_adc):
+        return ps.ps4000MaximumValue(self.chandle, ctypes.byref(c_max_adc))
+
+    def _ps_run_streaming(self, c_sample_interval, max_pre_trigger_samples, max_post_trigger_samples, auto_stop,
+                          downsample_ratio, downsample_ratio_mode, overview_buffer_size):
+        return ps.ps4000RunStreaming(self.chandle,
+                                     ctypes.byref(c_sample_interval),
+                                     ps.PS4000_TIME_UNITS['PS4000_NS'],
+                                     max_pre_trigger_samples,
+                                     max_post_trigger_samples,
+                                     auto_stop,
+                                     downsample_ratio,
+                                     downsample_ratio_mode,
+                                     overview_buffer_size)
+
+    def _ps_streaming_ready_type(self, callback):
+        return ps.StreamingReadyType(callback)
+
+    def _ps_get_streaming_latest_values(self, c_func_ptr):
+        return ps.ps4000GetStreamingLatestValues(self.chandle, c_func_ptr, None)
+
+    def disable_trigger(self):
+        """Free-running acquisition: disables the simple trigger"""
+        self.status["setSimpleTrigger"] = ps.ps4000SetSimpleTrigger(self.chandle, 0, 0, 0, 0, 0, 0)
+        assert_pico_ok(self.status["setSimpleTrigger"])
 
-                self.next_sample += noOfSamples
+    #######################################################################
+    ########################### Rapid block ###############################
+    #######################################################################
+    def _ps_memory_segments(self, n_segments, c_max_samples):
+        return ps.ps4000MemorySegments(self.chandle, n_segments, ctypes.byref(c_max_samples))
 
-                if autoStop:
-                    self.auto_stop_outer = True
+    def _ps_set_no_of_captures(self, n_captures):
+        return ps.ps4000SetNoOfCaptures(self.chandle, n_captures)
 
+    def _ps_get_timebase2(self, timebase, n_samples, c_interval_ns, c_max_samples):
+        return ps.ps4000GetTimebase2(self.chandle, timebase, n_samples, ctypes.byref(c_interval_ns), 1,
+                                     ctypes.byref(c_max_samples), 0)
 
-        c_func_ptr = ps.StreamingReadyType(streaming_callback)
+    def _ps_run_block(self, max_pre_trigger_samples, max_post_trigger_samples, timebase):
+        return ps.ps4000RunBlock(self.chandle, max_pre_trigger_samples, max_post_trigger_samples, timebase, 1,
+                                 None, 0, None, None)
 
-        def fetching():
-            while self.next_sample < self.total_samples and not self.auto_stop_outer and not self.stop_sampling_event.is_set():
-                self.was_called_back = False
-                self.status["getStreamingLastestValues"] = ps.ps4000GetStreamingLatestValues(self.chandle, c_func_ptr, None)
-                if not self.was_called_back:
-                    time.sleep(0.001)
+    def _ps_is_ready(self, c_ready):
+        return ps.ps4000IsReady(self.chandle, ctypes.byref(c_ready))
 
-            self.stop_sampling_event.set() # now the writing can start
-            print("[WARNING] Fetching is finished ... No more data is being collected")
-            self.stop_sampling()
-
-        # start fetching data in different thread to not block buffered mode
-        self.fetching_thread = threading.Thread(target=fetching)
-        self.fetching_thread.start()
-        print("[INFO] Waiting for trigger ...")
+    def _ps_get_values_bulk(self, c_no_of_samples, n_segments, c_overflow):
+        return ps.ps4000GetValuesBulk(self.chandle, ctypes.byref(c_no_of_samples), 0, n_segments - 1,
+                                      ctypes.byref(c_overflow))
 
-    def set_data_buffer(self, channel: int, buffer, bufferLth: int, segmentIndex: int=0, mode: str='none'):
+    def set_data_buffer(self, channel: int, buffer, bufferLth: int, mode: str='none'):
         """
         You need to allocate the buffer before calling this function.
         If only one buffer needed --> downsampling mode is not 'aggregate'
+        The ps4000 driver takes no mode here, the mode is given to RunStreaming.
 
         :param channel: the channel for which you want to set the buffers
         :param buffer: buffer to receive the data value. Each value is ADC count scaled to vRange.
         :param bufferLth: the size of the buffer array.
-        :param segmentIndex: the number of the memory segment to be retrieved. (=0, streaming)
-        :param mode: downsampling mode [0:PS4000A_RATIO_MODE_NONE, 2: PS4000A_RATIO_MODE_DECIMATE, 4: PS4000A_RATIO_MODE_AVERAGE]
-        :return:
         """
-        # parameters
         ptr = buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_int16))
-        c_mode = _get_ratio_mode(mode)
-        self.status[f"setDataBuffer_{channel}"] = ps.ps4000SetDataBuffer(self.chandle, channel, ptr, bufferLth,
-                                                                          segmentIndex, c_mode)
+        self.status[f"setDataBuffer_{channel}"] = ps.ps4000SetDataBuffer(self.chandle, channel, ptr, bufferLth)
         assert_pico_ok(self.status[f"setDataBuffer_{channel}"])
 
+    def set_data_buffer_bulk(self, channel: int, buffer, bufferLth: int, waveform: int):
+        """
+        Register the buffer of one segment of a rapid block capture, for GetValuesBulk.
+
+        :param waveform: the memory segment the buffer receives
+        """
+        ptr = buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_int16))
+        self.status[f"setDataBufferBulk_{channel}"] = ps.ps4000SetDataBufferBulk(self.chandle, channel, ptr, bufferLth,
+                                                                                  waveform)
+        assert_pico_ok(self.status[f"setDataBufferBulk_{channel}"])
+
+    def set_data_buffers(self, channel: int, buffer_max, buffer_min, bufferLth: int, segmentIndex: int=0,
+                         mode: str='aggregate'):
+        """
+        Register a max and a min buffer for the channel, needed by the 'aggregate' downsampling mode.
+        The ps4000 driver takes neither a segment index nor a mode here, the mode is given to RunStreaming.
+
+        :param channel: the channel for which you want to set the buffers
+        :param buffer_max: receives the maximum of each aggregated block of samples, in ADC counts
+        :param buffer_min: receives the minimum of each aggregated block of samples, in ADC counts
+        :param bufferLth: the size of each buffer array
+        """
+        ptr_max = buffer_max.ctypes.data_as(ctypes.POINTER(ctypes.c_int16))
+        ptr_min = buffer_min.ctypes.data_as(ctypes.POINTER(ctypes.c_int16))
+        self.status[f"setDataBuffers_{channel}"] = ps.ps4000SetDataBuffers(self.chandle, channel, ptr_max, ptr_min,
+                                                                            bufferLth)
+        assert_pico_ok(self.status[f"setDataBuffers_{channel}"])
 
-    def adc2mv_1d(self, data_adc, ch):
-        channel_range = self.channel_ranges[ch]
-        data_mv = adc2mV(data_adc, channel_range, self.max_adc)
-        return data_mv
 
     def set_simple_edge_trigger(self,
                                 source: str,
@@ -628,6 +936,7 @@ class PicoScope4000(object):
 
         # save channel attributes: ranges, enable/disable
         self.channel_ranges[ch_num] = int_range
+        self.analog_offsets[ch_num] = analogue_offset
         if enabled == 1:
             self.enabled_channels[ch_num] = 1
 
@@ -713,20 +1022,40 @@ class PicoScopeWorker(Worker):
     interface_class = None
 
     def init(self):
-        self.interface_class = PicoScope4000A if self.is_4000a else PicoScope4000
-        self.pico = self.interface_class(self.serial_number)
+        if self.simulated:
+            # hardware-free: the 4000A interface on top of the simulated driver
+            self.interface_class = PicoScope4000A
+            self.pico = PicoScope4000A(self.serial_number, driver=SimulatedPs4000a(**self.simulation_config))
+            rich_print("[PicoScope] Using the simulated driver, no data is taken from a scope", color=RED)
+        else:
+            if ps is None:
+                raise LabscriptError("picosdk is not installed. Install it or set simulated=True in the connection table.")
+            self.interface_class = PicoScope4000A if self.is_4000a else PicoScope4000
+            self.pico = self.interface_class(self.serial_number)
+
+        self._init_state()
+
+        # previews go to the tab from a background thread, a lagging GUI never delays the shot
+        self.preview_publisher = PreviewPublisher(self.parent_host, self.image_receiver_port, name="PicoScope traces")
+        self.previews_dropped = 0
+
+        self.live_view_running = False
+        self._live_frame = None # (channels, window) chronological copy of the live ring buffer
 
+
+    def _init_state(self):
+        """Per-shot state of the worker, also used to set up a worker without BLACS (testing/stream_benchmark.py)"""
         self.h5_file = None
         self.device_name = None
+        self.storage_config = {}
+        self.analysis_windows = [] # scalar results computed from the traces of every shot
+        self.trace_writer = None # writes the traces while acquiring, if enabled
+        self.dsp_config = {}
+        self.stream_dsp = None # decimates / demodulates the traces while acquiring, if configured
+        self.smart_cache = {} # hash of the configuration last sent to the scope, per group of driver calls
 
         self.stop_writing_flag = False
 
-        self.image_socket = Context().socket(zmq.REQ)
-        self.image_socket.connect(
-            f'tcp://{self.parent_host}:{self.image_receiver_port}'
-        )
-
-
     def shutdown(self):
         # stop fetching thread
         if hasattr(self.pico, "stop_sampling_event"):
@@ -738,14 +1067,29 @@ class PicoScopeWorker(Worker):
         self.pico.stop_sampling()
         self.pico.close_unit()
 
+        self.preview_publisher.close()
+
         # stop writing
         self.stop_writing_flag = True
+        if self.trace_writer is not None:
+            self.trace_writer.finish()
+            self.trace_writer = None
+        if self.stream_dsp is not None:
+            self.stream_dsp.finish()
+            self.stream_dsp = None
+
+        # drop the views of the capture, then delete the spill file of a memory-mapped capture
+        self.pico.complete_buffers = {}
+        self.pico.stream_buffer.release()
 
     def program_manual(self, front_panel_values):
         pass
 
     def transition_to_buffered(self, device_name, h5_file, initial_values, fresh):
         rich_print(f"---------- Begin transition to Buffered: ----------", color=BLUE)
+        self.stop_live_view() # the shot needs the scope
+        self.pico.fetch_scheduler = None # of the live view, or of the last shot
+        self.pico.triggered_at = None
         self.h5_file = h5_file
         self.device_name = device_name
 
@@ -761,13 +1105,78 @@ class PicoScopeWorker(Worker):
         trigger_properties_config = properties["trigger_properties_config"]
         trigger_delay_config = properties["trigger_delay_config"]
         stream_config = properties["stream_config"]
+        block_config = properties.get("block_config", {})
         self.siggen_config = properties["siggen_config"]
+        self.storage_config = properties.get("storage_config", {})
+        self.dsp_config = properties.get("dsp_config", {})
+        self.analysis_windows = [dict(window, channel_number=_get_channel_number(window["channel"]))
+                                 for window in properties.get("analysis_windows", [])]
+
+        # Only reprogram what differs from what was last programmed in, or everything if a fresh
+        # reprogramming was requested. Every driver call is a USB round trip.
+        if fresh:
+            self.smart_cache = {}
+        skipped = []
+
+        self._configure_channels(skipped)
+
+        trigger_config = dict(simple=simple_trigger, conditions=trigger_conditions_config,
+                              directions=trigger_directions_config, properties=trigger_properties_config,
+                              delay=trigger_delay_config)
+        trigger_digest = self._config_changed("trigger", trigger_config)
+        if trigger_digest is None:
+            skipped.append("trigger")
+        else:
+            self._configure_trigger(simple_trigger, trigger_conditions_config, trigger_directions_config,
+                                    trigger_properties_config, trigger_delay_config)
+            self.smart_cache["trigger"] = trigger_digest
+
+        if skipped:
+            print(f"[INFO] Unchanged, not reprogrammed: {', '.join(skipped)}")
+
+        # Configure rapid block mode or streaming mode and start the capture
+        if block_config:
+            self.pico.run_block(
+                block_config["sample_interval"],
+                block_config["no_pre_trigger_samples"],
+                block_config["no_post_trigger_samples"],
+                block_config["n_segments"],
+            )
+        elif stream_config:
+            self.pico.run_stream(
+                stream_config["sample_interval"],
+                stream_config["no_post_trigger_samples"],
+                stream_config["downsample_ratio"],
+                stream_config["downsample_ratio_mode"],
+                stream_config.get("no_pre_trigger_samples", 0),
+                spill_dir=self.storage_config.get("spill_dir"),
+            )
+            store_raw = self.dsp_config.get("store_raw", True)
+            if store_raw and self.storage_config.get("write_during_acquisition", False):
+                self._start_trace_writer()
+            if self.dsp_config:
+                self.stream_dsp = StreamDsp(self.pico.stream_buffer, self.pico.trace_sample_interval,
+                                            self.dsp_config["decimation"], self.dsp_config.get("taps_per_phase", 16),
+                                            self.dsp_config.get("lockin_frequency"))
+                self.stream_dsp.start()
+
+        return {}
 
-        # Configure channels
+    def _configure_channels(self, skipped):
+        """Program the channels whose configuration differs from what was last sent to the scope"""
         for ch in self.channels_configs:
+            key = f"channel_{ch['channel']}"
+            digest = self._config_changed(key, ch)
+            if digest is None:
+                skipped.append(key)
+                continue
             self.pico.set_channel(ch["channel"], ch["coupling"], ch["range"], ch["enabled"], ch["analog_offset"])
+            self.smart_cache[key] = digest
+            self.smart_cache.pop("trigger", None) # the thresholds are converted with the channel ranges
 
-        # Configure trigger
+    def _configure_trigger(self, simple_trigger, trigger_conditions_config, trigger_directions_config,
+                           trigger_properties_config, trigger_delay_config):
+        """Send the simple and advanced trigger settings of the shot to the scope"""
         if simple_trigger:
             self.pico.set_simple_edge_trigger(
                                               simple_trigger["source"],
@@ -791,16 +1200,32 @@ class PicoScopeWorker(Worker):
         if trigger_delay_config is not None and "delay" in trigger_delay_config:
             self.pico.set_trigger_delay(trigger_delay_config["delay"])
 
-        # Configure streaming mode and start streaming
-        if stream_config:
-            self.pico.run_stream(
-                stream_config["sample_interval"],
-                stream_config["no_post_trigger_samples"],
-                stream_config["downsample_ratio"],
-                stream_config["downsample_ratio_mode"],
-            )
-
-        return {}
+    def _config_changed(self, key, config):
+        """Hash of config if it differs from the one last sent to the scope under key, else None"""
+        digest = hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+        return None if self.smart_cache.get(key) == digest else digest
+
+    def _start_trace_writer(self):
+        """Create the traces dataset and start appending chunks to it while the capture runs."""
+        stream_buffer = self.pico.stream_buffer
+        if self.storage_config.get("units", "mV") == "adc":
+            dtype, convert = np.int16, None
+        else:
+            channels = list(stream_buffer.channels)
+            dtype, convert = np.float32, lambda block: self.pico.adc2mv(block, channels)
+
+        self.trace_writer = TraceWriter(self.h5_file, self.device_name, stream_buffer, dtype=dtype, convert=convert,
+                                        chunk_samples=self.storage_config.get("chunk_samples", DEFAULT_CHUNK_SAMPLES),
+                                        chunk_channels=self.storage_config.get("chunk_channels"),
+                                        filters=self._trace_filters(),
+                                        layout=self.storage_config.get("layout", "samples_channels"))
+        self.trace_writer.start()
+
+    def _trace_filters(self):
+        """h5py filter pipeline for the traces dataset as configured by set_trace_storage"""
+        return compression_kwargs(self.storage_config.get("compression", "gzip"),
+                                  self.storage_config.get("compression_level"),
+                                  self.storage_config.get("shuffle", False))
 
     def transition_to_manual(self):
         rich_print(f"---------- Begin transition to Manual: ----------", color=BLUE)
@@ -808,34 +1233,18 @@ class PicoScopeWorker(Worker):
         # wait until all samples are collected, blocking the shot exit
 
         self.pico.stop_sampling_event.wait()
+        if self.pico.fetching_thread is not None:
+            self.pico.fetching_thread.join()
 
-        channels = sorted(self.pico.complete_buffers.keys()) # keys [0..8]
-
-        # Prepare data
-        data_list = []
-        for ch in channels:
-            buf_adc = self.pico.complete_buffers[ch]
-            buf_mv = self.pico.adc2mv_1d(buf_adc.astype(np.int32), ch)
-            data_list.append(buf_mv)
-
-        data_array = np.column_stack(data_list) # combine horizontally
-        self._send_traces_to_parent(data_array)
-
-        # Write data
-        with h5py.File(self.h5_file, "r+") as f:
-            group = f.require_group('/data/traces')
-            # dataset per device
-            dataset_name = self.device_name
-            ds = group.create_dataset(dataset_name, data=data_array, dtype=np.float32, compression='gzip')
-            ds.attrs["num_channels"] = len(channels)
-            ds.attrs["channel_names"] = np.array(self.channel_names, dtype=h5py.string_dtype())
-            ds.attrs["sample_interval"] = float(self.pico.actual_sample_interval)
-            ds.attrs["triggered_at"] = int(self.pico.triggered_at)
-            ds.attrs["units"] = "mV"
-
-        print(f"[INFO] Saved {data_array.shape[0]} samples × {data_array.shape[1]} channels")
+        if self.pico.acquisition_mode == 'block':
+            self._save_segments()
+        elif self.pico.acquisition_mode == 'stream' and self.pico.triggered_at is not None:
+            self._save_stream()
+        else:
+            self._save_not_triggered()
 
-        # configure the signal generator to use in manual mode
+        # configure the signal generator to use in manual mode. Always re-armed, not cached: one driver call, and
+        # whether the driver keeps the generator running across the stop of a capture is not documented
         if len(self.siggen_config) > 0:
             self.pico.gen_signal( int(self.siggen_config["offset_voltage"] * 1e6),
                     int(self.siggen_config["pk2pk"] * 1e6),
@@ -858,17 +1267,209 @@ class PicoScopeWorker(Worker):
 
         return True
 
-    def _send_traces_to_parent(self, traces):
-        """Send the traces to the GUI to display. This will block if the parent process
-        is lagging behind, in order to avoid a backlog."""
-        metadata = dict(dtype=str(traces.dtype), shape=traces.shape,
-                        sample_interval=self.pico.actual_sample_interval, triggered_at=self.pico.triggered_at)
-        self.image_socket.send_json(metadata, zmq.SNDMORE)
-        self.image_socket.send(traces, copy=False)
-        response = self.image_socket.recv()
-        assert response == b'ok', response
+    def _save_stream(self):
+        """Write the streaming capture to /data/traces/<device> as (samples, channels), or (channels, samples) in the
+        'channels_samples' layout. With aggregate
+        downsampling <device> holds the maxima and <device>_min the minima of every downsampling interval."""
+        stream_buffer = self.pico.stream_buffer
+        channels = stream_buffer.channels # channel numbers [0..8], one row each
+        # only the samples of this shot: the capture array is reused, beyond samples_ready it holds an older shot
+        n_samples = stream_buffer.samples_ready
+        data_adc = stream_buffer.max_data[:, :n_samples] # (channels, samples) in adc
+        min_adc = stream_buffer.min_data[:, :n_samples] if stream_buffer.aggregate else None
+        if n_samples < stream_buffer.total_samples:
+            rich_print(f"[WARNING] Capture ended early: {n_samples} of {stream_buffer.total_samples} samples",
+                       color=RED)
+        units = self.storage_config.get("units", "mV")
+
+        # Only the tail is left to write if the traces were written during the acquisition
+        if self.trace_writer is not None:
+            self.trace_writer.finish()
+            print(f"[INFO] Traces written during acquisition in {self.trace_writer.write_time_s:.3f}s")
+            self.trace_writer = None
+
+        # acquisition health of this shot, stored with the traces and shown in the tab
+        scheduler = self.pico.fetch_scheduler
+        health = self.pico.stream_stats.report(scheduler.report() if scheduler is not None else None,
+                                               self.pico.stream_buffer.truncated)
+        if health["stream_overflow_events"].any() or health["stream_truncated_samples"] > 0:
+            rich_print(f"[WARNING] Over range events per channel: {health['stream_overflow_events'].tolist()}, "
+                       f"truncated samples: {health['stream_truncated_samples']}", color=RED)
+
+        # Only a min/max envelope goes to the GUI, the full resolution only to the file
+        self._send_traces_to_parent(data_adc, channels, health, min_adc)
+        # converted (and transposed for the samples_channels layout) one chunk at a time, never the whole capture
+        if units == "adc":
+            dtype, convert = np.int16, None
+        else:
+            dtype, convert = np.float32, lambda block: self.pico.adc2mv(block, channels)
+        layout = self.storage_config.get("layout", "samples_channels")
+        chunk_samples = self.storage_config.get("chunk_samples", DEFAULT_CHUNK_SAMPLES)
+        shape, chunks = trace_layout(n_samples, len(channels), layout, chunk_samples,
+                                     self.storage_config.get("chunk_channels"))
+
+        # Write data
+        store_raw = self.dsp_config.get("store_raw", True)
+        with h5py.File(self.h5_file, "r+") as f:
+            group = f.require_group('/data/traces')
+            # dataset per device
+            dataset_name = self.device_name
+            datasets = []
+            if dataset_name in group:
+                datasets.append(group[dataset_name])
+            elif store_raw:
+                ds = group.create_dataset(dataset_name, shape=shape, dtype=dtype, chunks=chunks, **self._trace_filters())
+                write_trace_blocks(ds, data_adc, 0, n_samples, chunk_samples, convert, layout)
+                datasets.append(ds)
+            if min_adc is not None and store_raw:
+                ds = datasets[0]
+                ds_min = group.create_dataset(f"{dataset_name}_min", shape=ds.shape, dtype=dtype, chunks=ds.chunks,
+                                              **self._trace_filters())
+                write_trace_blocks(ds_min, min_adc, 0, n_samples, chunk_samples, convert, layout)
+                ds_min.attrs["derived_from"] = dataset_name
+                datasets.append(ds_min)
+            self._save_results(f, data_adc, channels)
+            if self.stream_dsp is not None:
+                self._save_dsp(group, channels, health)
+            for ds in datasets:
+                ds.attrs["num_channels"] = len(channels)
+                ds.attrs["channel_names"] = np.array(self.channel_names, dtype=h5py.string_dtype())
+                ds.attrs["layout"] = layout
+                ds.attrs["sample_interval"] = float(self.pico.trace_sample_interval) # of the stored samples
+                ds.attrs["downsample_ratio"] = int(self.pico.downsample_ratio)
+                ds.attrs["downsample_ratio_mode"] = self.pico.downsample_ratio_mode
+                ds.attrs["triggered_at"] = int(self.pico.triggered_at)
+                ds.attrs["pre_trigger_samples"] = int(stream_buffer.pre_trigger_samples)
+                ds.attrs["pre_trigger_samples_valid"] = int(stream_buffer.pre_trigger_valid)
+                ds.attrs["samples_requested"] = int(stream_buffer.total_samples)
+                ds.attrs["samples_valid"] = int(n_samples) # = the stored length
+                for key, value in self.pico.trace_attributes(channels, units).items():
+                    ds.attrs[key] = value
+                for key, value in health.items():
+                    ds.attrs[key] = value
+
+        if store_raw:
+            print(f"[INFO] Saved {n_samples} samples × {len(channels)} channels"
+                  + (f" from the spill file {stream_buffer.spill_file}" if stream_buffer.spill_file else ""))
+
+    def _save_not_triggered(self):
+        """The streaming capture stopped before the trigger: no traces are stored, the traces group records
+        <device>_triggered = False"""
+        rich_print("[WARNING] The scope was not triggered, no traces saved", color=RED)
+        if self.trace_writer is not None:
+            self.trace_writer.finish()
+            self.trace_writer = None
+        if self.stream_dsp is not None:
+            self.stream_dsp.finish()
+            self.stream_dsp = None
+        with h5py.File(self.h5_file, "r+") as f:
+            group = f.require_group('/data/traces')
+            if self.device_name in group: # created empty by the trace writer
+                del group[self.device_name]
+            group.attrs[f"{self.device_name}_triggered"] = False
+
+    def _save_dsp(self, group, channels, health):
+        """Write the outputs of the DSP stage next to the traces: <device>_decimated and, with a lock-in reference,
+        <device>_lockin_i and <device>_lockin_q, in mV at the decimated rate and in the layout of the traces"""
+        dsp, self.stream_dsp = self.stream_dsp, None
+        dsp.finish()
+        n = dsp.n_out
+        outputs = {"decimated": dsp.decimated}
+        if dsp.lockin is not None:
+            outputs.update(lockin_i=dsp.i, lockin_q=dsp.q)
+        # index of the trigger in the decimated traces
+        triggered_at = int(round((self.pico.triggered_at - dsp.decimator.time_offset_samples) / dsp.decimation))
+        layout = self.storage_config.get("layout", "samples_channels")
+        _, chunks = trace_layout(n, len(channels), layout, self.storage_config.get("chunk_samples", DEFAULT_CHUNK_SAMPLES),
+                                 self.storage_config.get("chunk_channels"))
+        for suffix, data in outputs.items():
+            data_mv = self.pico.adc2mv(data[:, :n], channels)
+            ds = group.create_dataset(f"{self.device_name}_{suffix}",
+                                      data=data_mv if layout == "channels_samples" else data_mv.T,
+                                      chunks=chunks if n > 0 else None, **(self._trace_filters() if n > 0 else {}))
+            ds.attrs["num_channels"] = len(channels)
+            ds.attrs["channel_names"] = np.array(self.channel_names, dtype=h5py.string_dtype())
+            ds.attrs["layout"] = layout
+            ds.attrs["units"] = "mV"
+            ds.attrs["sample_interval"] = float(dsp.sample_interval)
+            ds.attrs["time_offset"] = float(dsp.time_offset) # of sample 0 relative to sample 0 of the raw trace, ns
+            ds.attrs["decimation"] = dsp.decimation
+            ds.attrs["derived_from"] = self.device_name
+            ds.attrs["triggered_at"] = triggered_at
+            if dsp.lockin is not None:
+                ds.attrs["lockin_frequency"] = float(dsp.lockin_frequency_hz)
+            for key, value in health.items():
+                ds.attrs[key] = value
+        print(f"[INFO] DSP stage: {n} samples × {len(channels)} channels ({', '.join(outputs)}), "
+              f"{dsp.process_time_s:.3f}s processing")
+
+    def _save_segments(self):
+        """Write a rapid block capture to /data/traces/<device> as (segments, channels, samples)"""
+        segment_buffer = self.pico.segment_buffer
+        channels = segment_buffer.channels
+        data_adc = segment_buffer.data[:, :, :segment_buffer.samples] # (segments, channels, samples) in adc
+        units = self.storage_config.get("units", "mV")
+        if segment_buffer.samples == 0:
+            print("[WARNING] No segments were retrieved, nothing to save")
+            return
+
+        # the GUI shows the first segment
+        self._send_traces_to_parent(data_adc[0], channels)
+        data_array = data_adc if units == "adc" else self.pico.adc2mv(data_adc, channels, axis=1)
+
+        n_segments, n_channels, n_samples = data_array.shape
+        chunk_samples, chunk_channels = dataset_chunks(n_samples, n_channels,
+                                                       self.storage_config.get("chunk_samples", DEFAULT_CHUNK_SAMPLES),
+                                                       self.storage_config.get("chunk_channels"))
+        with h5py.File(self.h5_file, "r+") as f:
+            group = f.require_group('/data/traces')
+            ds = group.create_dataset(self.device_name, data=data_array, chunks=(1, chunk_channels, chunk_samples),
+                                      **self._trace_filters())
+            ds.attrs["num_channels"] = n_channels
+            ds.attrs["channel_names"] = np.array(self.channel_names, dtype=h5py.string_dtype())
+            ds.attrs["sample_interval"] = float(self.pico.actual_sample_interval)
+            ds.attrs["triggered_at"] = int(self.pico.triggered_at)
+            ds.attrs["pre_trigger_samples"] = int(self.pico.triggered_at)
+            ds.attrs["n_segments"] = n_segments
+            ds.attrs["segment_overflow"] = np.asarray(segment_buffer.overflow, dtype=np.int16)
+            for key, value in self.pico.trace_attributes(channels, units).items():
+                ds.attrs[key] = value
+            self._save_results(f, data_adc, channels)
+
+        print(f"[INFO] Saved {n_segments} segments × {n_channels} channels × {n_samples} samples")
+
+    def _save_results(self, f, data_adc, channels):
+        """Evaluate the analysis windows on the raw traces and store the results as attributes of /results/<device>"""
+        if not self.analysis_windows:
+            return
+        t0 = time.perf_counter()
+        results = analyse_traces(self.analysis_windows, data_adc, channels, self.pico.channel_ranges,
+                                 self.pico.max_adc.value, int(self.pico.triggered_at),
+                                 float(self.pico.trace_sample_interval))
+        group = f.require_group(f'/results/{self.device_name}')
+        for name, value in results.items():
+            group.attrs[name] = value
+        print(f"[INFO] {len(results)} analysis results in {(time.perf_counter() - t0) * 1e3:.1f} ms")
+
+    def _send_traces_to_parent(self, data_adc, channels, health=None, min_adc=None):
+        """Send a min/max envelope of the (channels, samples) ADC traces to the GUI to display, as (points, channels)
+        in mV. Never blocks: if the GUI is still busy with the previous preview, the older one is dropped.
+        min_adc holds the minima of aggregate downsampling, data_adc then holds the maxima."""
+        envelope, bin_size = minmax_envelope(data_adc, PREVIEW_BINS, min_adc)
+        # the scale is positive, so the envelope of the counts converts to the envelope in mV
+        traces = self.pico.adc2mv(envelope, channels).T
+        metadata = dict(sample_interval=self.pico.trace_sample_interval, triggered_at=self.pico.triggered_at,
+                        bin_size=bin_size, n_samples=data_adc.shape[-1])
+        if health is not None:
+            metadata["health"] = {key: value.tolist() if isinstance(value, np.ndarray) else value
+                                  for key, value in health.items()}
+        self.preview_publisher.publish(metadata, traces)
+        if self.preview_publisher.dropped > self.previews_dropped:
+            self.previews_dropped = self.preview_publisher.dropped
+            print(f"[INFO] GUI is lagging behind, {self.previews_dropped} trace previews dropped so far")
 
     def abort_transition_to_buffered(self):
+        self.pico.stop_sampling_event.set() # ends a capture that is still waiting for its trigger
         return self.transition_to_manual()
 
     def abort_buffered(self):
@@ -877,6 +1478,43 @@ class PicoScopeWorker(Worker):
     def siggen_software_trigger(self):
         self.pico.siggen_software_control(0)
 
+    def start_live_view(self):
+        """Untriggered rolling view of the channels in manual mode, runs until stop_live_view or the next shot"""
+        if self.live_view_running:
+            return True
+        config = dict(LIVE_VIEW_DEFAULTS, **(self.live_view_config or {}))
+        self._configure_channels([])
+        self.smart_cache.pop("trigger", None) # the live view disables the trigger, the next shot sets it again
+        self.pico.fetch_scheduler = None # of the last shot
+        self.pico.triggered_at = None
+        self.pico.stop_sampling_event.clear()
+        self.pico.run_live(config["sample_interval"], config["window_samples"], 1.0 / config["max_fps"],
+                           self._send_live_frame)
+        self.live_view_running = True
+        return True
+
+    def stop_live_view(self):
+        """Stop the live view and wait until the scope has stopped streaming"""
+        if not self.live_view_running:
+            return True
+        self.pico.stop_sampling_event.set()
+        self.pico.fetching_thread.join()
+        self.pico.stop_sampling_event.clear()
+        self.live_view_running = False
+        return True
+
+    def _send_live_frame(self, live):
+        """Publish the rolling window of the live view, called from the fetching thread at the capped frame rate"""
+        if self._live_frame is None or self._live_frame.shape != live.buffer.shape:
+            self._live_frame = np.zeros_like(live.buffer)
+        n = live.read_into(self._live_frame)
+        window = self._live_frame[:, self._live_frame.shape[1] - n:]
+        envelope, bin_size = minmax_envelope(window, PREVIEW_BINS)
+        traces = self.pico.adc2mv(envelope, self.pico.live_channels).T
+        metadata = dict(sample_interval=self.pico.actual_sample_interval, triggered_at=0, bin_size=bin_size,
+                        n_samples=n, live=True)
+        self.preview_publisher.publish(metadata, traces)
+
 
 #######################################################################
 ####################### Helpers #######################################
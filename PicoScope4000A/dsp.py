@@ -0,0 +1,177 @@
+"""
+Software DSP stage for streaming captures: a stateful polyphase FIR decimator and a digital lock-in (IQ demodulator)
+that process the capture incrementally while it is acquired, so that reduced-rate traces can be stored instead of,
+or next to, the raw ones.
+
+All filters work on (channels, samples) blocks and keep their state between blocks, so the output does not depend
+on how the stream was cut into blocks by the driver callbacks.
+"""
+import math
+import threading
+import time
+import numpy as np
+
+
+def design_lowpass(decimation: int, taps_per_phase: int = 16, cutoff: float = 0.8, beta: float = 8.0):
+    """
+    Kaiser-windowed sinc anti-alias filter for decimation by `decimation`, normalised to unit DC gain.
+    :param taps_per_phase: filter length in output samples, the filter has taps_per_phase * decimation taps
+    :param cutoff: -6 dB frequency as a fraction of the output Nyquist frequency
+    :param beta: Kaiser window parameter, 8 gives about 80 dB stop band attenuation
+    """
+    n_taps = int(taps_per_phase) * int(decimation)
+    n = np.arange(n_taps) - (n_taps - 1) / 2
+    taps = np.sinc(n * cutoff / decimation) * np.kaiser(n_taps, beta)
+    return taps / taps.sum()
+
+
+class PolyphaseDecimator(object):
+    """
+    FIR low-pass filter and decimation by an integer factor, evaluated in polyphase form: only every
+    `decimation`-th output is computed, as taps_per_phase matrix-vector products over frames of `decimation` samples.
+
+    Output k is the filter response at input sample k * decimation + decimation - 1, i.e. it is centred on input
+    sample k * decimation + `time_offset_samples` (the filter delay is compensated in this offset, not in the data).
+    """
+    def __init__(self, n_channels: int, decimation: int, taps=None, dtype=np.float32):
+        self.decimation = int(decimation)
+        taps = design_lowpass(self.decimation) if taps is None else np.asarray(taps, dtype=np.float64)
+        n_phases = int(math.ceil(len(taps) / self.decimation))
+        taps = np.concatenate([taps, np.zeros(n_phases * self.decimation - len(taps))])
+        self.n_taps = len(taps)
+        # phase q weights frame k - q; within a frame the newest sample comes last, so the taps are reversed
+        self.phases = taps.reshape(n_phases, self.decimation)[:, ::-1].astype(dtype)
+        self.n_channels = int(n_channels)
+        self.dtype = dtype
+        self.time_offset_samples = self.decimation - 1 - (self.n_taps - 1) / 2
+        self.reset()
+
+    def reset(self):
+        # the last n_phases - 1 complete frames and the incomplete frame; zeros before the start of the stream
+        self._tail = np.zeros((self.n_channels, (len(self.phases) - 1) * self.decimation), dtype=self.dtype)
+
+    def process(self, block):
+        """Filter a (channels, n) block, returns the (channels, m) outputs that became complete with it"""
+        d = self.decimation
+        n_history = len(self.phases) - 1
+        x = np.concatenate([self._tail, np.asarray(block, dtype=self.dtype)], axis=1)
+        n_frames = x.shape[1] // d
+        m = n_frames - n_history
+        if m <= 0:
+            self._tail = x
+            return np.zeros((self.n_channels, 0), dtype=self.dtype)
+        frames = x[:, :n_frames * d].reshape(self.n_channels, n_frames, d)
+        out = frames[:, n_history:n_history + m] @ self.phases[0]
+        for q in range(1, len(self.phases)):
+            out += frames[:, n_history - q:n_history - q + m] @ self.phases[q]
+        self._tail = x[:, m * d:]
+        return out
+
+
+class LockIn(object):
+    """
+    Digital lock-in: mixes every channel with cos/sin of a reference frequency and low-passes and decimates both
+    products with a PolyphaseDecimator. The reference phase runs on from block to block (phase 0 at the first
+    sample of the stream). I and Q are scaled by 2, so that hypot(I, Q) is the amplitude of the signal component at
+    the reference frequency and arctan2(Q, I) its phase relative to the reference.
+    """
+    def __init__(self, n_channels: int, decimation: int, frequency_hz: float, sample_interval_ns: float, taps=None):
+        self.n_channels = int(n_channels)
+        self.omega = 2 * math.pi * float(frequency_hz) * float(sample_interval_ns) * 1e-9 # rad per sample
+        self.decimator = PolyphaseDecimator(2 * self.n_channels, decimation, taps)
+        self.n_in = 0 # input samples processed, for the phase of the reference
+
+    def reset(self):
+        self.decimator.reset()
+        self.n_in = 0
+
+    def process(self, block):
+        """Demodulate a (channels, n) block, returns the (channels, m) I and Q outputs that became complete"""
+        n = block.shape[1]
+        phase = np.mod((self.n_in + np.arange(n, dtype=np.float64)) * self.omega, 2 * math.pi)
+        self.n_in += n
+        block = np.asarray(block, dtype=np.float32)
+        mixed = np.concatenate([block * (2 * np.cos(phase)).astype(np.float32),
+                                block * (-2 * np.sin(phase)).astype(np.float32)], axis=0)
+        out = self.decimator.process(mixed)
+        return out[:self.n_channels], out[self.n_channels:]
+
+
+class StreamDsp(object):
+    """
+    Runs the DSP stage on a StreamBuffer while it fills: a background thread waits for new samples (like
+    trace_storage.TraceWriter) and feeds them to the decimator and the lock-in, block by block. The reduced-rate
+    outputs are collected in preallocated arrays, in ADC counts (float32) like the input.
+    """
+    def __init__(self, stream_buffer, sample_interval_ns: float, decimation: int, taps_per_phase: int = 16,
+                 lockin_frequency_hz: float = None):
+        self.stream_buffer = stream_buffer
+        self.sample_interval_ns = float(sample_interval_ns)
+        self.decimation = int(decimation)
+        n_channels = len(stream_buffer.channels)
+        taps = design_lowpass(self.decimation, taps_per_phase)
+        self.decimator = PolyphaseDecimator(n_channels, self.decimation, taps)
+        self.lockin = None
+        if lockin_frequency_hz is not None:
+            self.lockin = LockIn(n_channels, self.decimation, lockin_frequency_hz, sample_interval_ns, taps)
+        self.lockin_frequency_hz = lockin_frequency_hz
+
+        n_out = stream_buffer.total_samples // self.decimation + 1
+        self.decimated = np.zeros((n_channels, n_out), dtype=np.float32)
+        self.i = np.zeros((n_channels, n_out), dtype=np.float32) if self.lockin else None
+        self.q = np.zeros((n_channels, n_out), dtype=np.float32) if self.lockin else None
+        self.n_out = 0
+        self.processed = 0 # input samples consumed
+        self.process_time_s = 0.0
+        self._finishing = threading.Event()
+        self._thread = None
+        self._error = None
+
+    @property
+    def sample_interval(self) -> float:
+        """interval of the output samples in ns"""
+        return self.sample_interval_ns * self.decimation
+
+    @property
+    def time_offset(self) -> float:
+        """time of output sample 0 relative to input sample 0 in ns"""
+        return self.decimator.time_offset_samples * self.sample_interval_ns
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        stream_buffer = self.stream_buffer
+        try:
+            while not self._finishing.is_set():
+                self._process_until(stream_buffer.wait_for_samples(self.processed + 1, timeout=0.1))
+            self._process_until(self.stream_buffer.samples_ready) # tail
+        except Exception as e:
+            self._error = e
+
+    def _process_until(self, end):
+        if end <= self.processed:
+            return
+        t0 = time.perf_counter()
+        block = self.stream_buffer.max_data[:, self.processed:end]
+        out = self.decimator.process(block)
+        m = min(out.shape[1], self.decimated.shape[1] - self.n_out)
+        self.decimated[:, self.n_out:self.n_out + m] = out[:, :m]
+        if self.lockin is not None:
+            i, q = self.lockin.process(block)
+            self.i[:, self.n_out:self.n_out + m] = i[:, :m]
+            self.q[:, self.n_out:self.n_out + m] = q[:, :m]
+        self.n_out += m
+        self.processed = end
+        self.process_time_s += time.perf_counter() - t0
+
+    def finish(self, timeout=None):
+        """Process the remaining samples and stop the thread. Raises if processing failed."""
+        self._finishing.set()
+        self.stream_buffer.wake()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._error is not None:
+            raise self._error
+        return self.n_out
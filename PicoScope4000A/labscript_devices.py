@@ -1,6 +1,8 @@
 from labscript import Device, AnalogOut, AnalogIn
 from labscript import LabscriptError, set_passed_properties
 from user_devices.logger_config import logger
+from user_devices.hdf5_filters import check_compression
+from user_devices.PicoScope4000A.analysis import ANALYSIS_OPERATIONS, CROSSING_DIRECTIONS
 import numpy as np
 import json
 
@@ -40,6 +42,8 @@ class PicoScope4000A(Device):
 
     @set_passed_properties({"connection_table_properties": ["serial_number",
                                                             "is_4000a",
+                                                            "simulated",
+                                                            "simulation_config",
                                                   "siggen_config",
                                                   "simple_trigger_config",
                                                   "trigger_conditions_config",
@@ -47,6 +51,9 @@ class PicoScope4000A(Device):
                                                   "trigger_properties_config",
                                                   "trigger_delay_config",
                                                   "stream_config",
+                                                  "block_config",
+                                                  "storage_config",
+                                                  "live_view_config",
                                                   ],# use in BLACS_tab
                             "device_properties":[
                                 "siggen_config",
@@ -56,9 +63,19 @@ class PicoScope4000A(Device):
                                 "trigger_properties_config",
                                 "trigger_delay_config",
                                 "stream_config",
+                                "block_config",
+                                "storage_config",
+                                "analysis_windows",
+                                "dsp_config",
                             ]})
 
-    def __init__(self, name, serial_number=None, is_4000a=True, **kwargs):
+    def __init__(self, name, serial_number=None, is_4000a=True, simulated=False, simulation_config=None, **kwargs):
+        """
+        :param serial_number: serial number of the scope, None opens the first scope found
+        :param is_4000a: 4000A series (ps4000a driver) or 4000 series (ps4000 driver)
+        :param simulated: use the simulated ps4000a driver instead of a scope, e.g. on machines without hardware
+        :param simulation_config: keyword arguments of simulation.SimulatedPs4000a (pulse timing, noise, ...)
+        """
         super().__init__(name, parent_device=None, connection='None', **kwargs)
         self.BLACS_connection = serial_number # i dont know but why not
         self.serial_number = serial_number # if None, opens the first scope found
@@ -70,7 +87,14 @@ class PicoScope4000A(Device):
         self.trigger_properties_config = []
         self.trigger_delay_config = {}
         self.stream_config =  {}
+        self.block_config = {}
+        self.storage_config = {}
+        self.analysis_windows = []
+        self.live_view_config = {}
+        self.dsp_config = {}
         self.is_4000a = is_4000a
+        self.simulated = bool(simulated)
+        self.simulation_config = dict(simulation_config or {})
 
     def add_device(self, device):
         Device.add_device(self, device)
@@ -139,14 +163,170 @@ class PicoScope4000A(Device):
                             no_post_trigger_samples:int,
                             downsample_ratio:int=1, # default no downsampling
                             downsample_ratio_mode:str='none', # default no downsampling
+                            no_pre_trigger_samples:int=0,
                             ):
+        """
+        :param sampling_rate: in Hz
+        :param no_post_trigger_samples: samples per channel recorded from the trigger on
+        :param downsample_ratio: hardware downsampling ratio, raw samples per stored sample. The sample counts are
+            counted in raw samples.
+        :param downsample_ratio_mode: 'none', 'aggregate', 'decimate', 'average'. 'aggregate' stores the max of every
+            downsample_ratio samples in the trace and the min in a second dataset <device>_min.
+        :param no_pre_trigger_samples: samples per channel before the trigger to keep in front of the trace.
+            The trigger point is then at index no_pre_trigger_samples of the stored trace (attribute 'triggered_at').
+        """
+        if int(no_pre_trigger_samples) < 0:
+            raise ValueError(f"Invalid 'no_pre_trigger_samples' value: {no_pre_trigger_samples}. Expected >= 0.")
+        allowed_modes = ['none', 'aggregate', 'decimate', 'average']
+        if downsample_ratio_mode not in allowed_modes:
+            raise ValueError(f"Invalid 'downsample_ratio_mode' value: {downsample_ratio_mode}. Expected one of {allowed_modes}")
+        if int(downsample_ratio) < 1:
+            raise ValueError(f"Invalid 'downsample_ratio' value: {downsample_ratio}. Expected >= 1.")
         sample_interval_ns = int(1 / sampling_rate * 1e9) #todo math.round
 
         self.stream_config.update(dict(sample_interval=sample_interval_ns,
                                        no_post_trigger_samples=int(no_post_trigger_samples),
+                                       no_pre_trigger_samples=int(no_pre_trigger_samples),
                                        downsample_ratio=downsample_ratio,
                                        downsample_ratio_mode=downsample_ratio_mode))
 
+    def set_block_sampling(self,
+                           sampling_rate:float | int, #in Hz
+                           no_post_trigger_samples:int,
+                           no_pre_trigger_samples:int=0,
+                           n_segments:int=1,
+                           ):
+        """
+        Rapid block mode instead of streaming: the scope memory is split into n_segments, every trigger fills one
+        segment at the full hardware rate and all segments are read at once after the last trigger.
+        The traces are stored as (segments, channels, samples) with the trigger at index no_pre_trigger_samples.
+        Takes precedence over set_stream_sampling.
+        :param sampling_rate: in Hz. The sample interval is rounded to the timebase of the scope (multiples of 12.5ns)
+        :param no_post_trigger_samples: samples per channel and segment from the trigger on
+        :param no_pre_trigger_samples: samples per channel and segment before the trigger
+        :param n_segments: number of triggers (segments) captured per shot
+        """
+        if int(no_post_trigger_samples) < 1:
+            raise ValueError(f"Invalid 'no_post_trigger_samples' value: {no_post_trigger_samples}. Expected >= 1.")
+        if int(no_pre_trigger_samples) < 0:
+            raise ValueError(f"Invalid 'no_pre_trigger_samples' value: {no_pre_trigger_samples}. Expected >= 0.")
+        if int(n_segments) < 1:
+            raise ValueError(f"Invalid 'n_segments' value: {n_segments}. Expected >= 1.")
+        sample_interval_ns = int(1 / sampling_rate * 1e9)
+
+        self.block_config.update(dict(sample_interval=sample_interval_ns,
+                                      no_post_trigger_samples=int(no_post_trigger_samples),
+                                      no_pre_trigger_samples=int(no_pre_trigger_samples),
+                                      n_segments=int(n_segments)))
+
+    def set_stream_dsp(self, decimation:int, taps_per_phase:int=16, lockin_frequency:float=None, store_raw:bool=True):
+        """
+        Software DSP stage of streaming captures, run in the worker while the scope acquires: an anti-alias FIR
+        filter with decimation, stored as /data/traces/<device>_decimated, and optionally a digital lock-in at a
+        reference frequency, stored as <device>_lockin_i and <device>_lockin_q (amplitude = hypot(I, Q)).
+        :param decimation: input samples per output sample
+        :param taps_per_phase: filter length in output samples, longer = steeper anti-alias filter
+        :param lockin_frequency: reference frequency of the lock-in in Hz, None = no lock-in
+        :param store_raw: also store the raw traces in /data/traces/<device>
+        """
+        if int(decimation) < 1:
+            raise ValueError(f"Invalid 'decimation' value: {decimation}. Expected >= 1.")
+        if int(taps_per_phase) < 1:
+            raise ValueError(f"Invalid 'taps_per_phase' value: {taps_per_phase}. Expected >= 1.")
+        if lockin_frequency is not None and lockin_frequency <= 0:
+            raise ValueError(f"Invalid 'lockin_frequency' value: {lockin_frequency}. Expected > 0.")
+        self.dsp_config.update(dict(decimation=int(decimation),
+                                    taps_per_phase=int(taps_per_phase),
+                                    lockin_frequency=None if lockin_frequency is None else float(lockin_frequency),
+                                    store_raw=bool(store_raw)))
+
+    def set_trace_storage(self, units:str='mV', write_during_acquisition:bool=False, chunk_samples:int=65536,
+                          chunk_channels:int=None, compression:str='gzip', compression_level:int=None,
+                          shuffle:bool=False, spill_dir:str=None, layout:str='samples_channels'):
+        """
+        How the traces are stored in the HDF5 shot file under /data/traces/<device>.
+        :param units: 'mV' stores float32 millivolts, 'adc' stores the raw int16 counts (half the size, no conversion
+            at the end of the shot). Raw traces carry the per-channel attributes 'channel_ranges', 'max_adc',
+            'analog_offsets_v' and 'scale_mv'; use trace_storage.adc_to_mv / traces_to_mv to convert them.
+        :param write_during_acquisition: append the traces chunk by chunk to the shot file while the scope is still
+            acquiring, so that only the last chunk and the attributes are left to write at the end of the shot.
+        :param chunk_samples: number of samples per HDF5 chunk (and per write during the acquisition)
+        :param chunk_channels: number of channels per HDF5 chunk, default all channels
+        :param compression: 'none', 'lzf', 'gzip' or 'blosc-lz4' (needs hdf5plugin on the BLACS machine, else lzf)
+        :param compression_level: gzip level 0..9 (default 4) or blosc level 0..9 (default 5)
+        :param shuffle: apply the byte-shuffle filter before compressing
+        :param layout: 'samples_channels' stores one (samples, channels) dataset, 'channels_samples' one
+            (channels, samples) dataset chunked one channel at a time (unless chunk_channels is given), so that reading
+            a single channel (trace_storage.read_channel) does not read and decompress the others
+        :param spill_dir: directory on a local disk of the BLACS machine. The streaming capture is then memory-mapped
+            to a scratch file there instead of held in RAM, for captures larger than the host memory. The file is
+            reused across shots and deleted when the worker shuts down.
+        """
+        allowed_units = ['mV', 'adc']
+        if units not in allowed_units:
+            raise ValueError(f"Invalid 'units' value: {units}. Expected one of {allowed_units}")
+        if int(chunk_samples) < 1:
+            raise ValueError(f"Invalid 'chunk_samples' value: {chunk_samples}. Expected a positive integer.")
+        if chunk_channels is not None and not 1 <= int(chunk_channels) <= 8:
+            raise ValueError(f"Invalid 'chunk_channels' value: {chunk_channels}. Expected 1..8.")
+        allowed_layouts = ['samples_channels', 'channels_samples']
+        if layout not in allowed_layouts:
+            raise ValueError(f"Invalid 'layout' value: {layout}. Expected one of {allowed_layouts}")
+        compression = check_compression(compression, compression_level)
+        self.storage_config.update(dict(units=units,
+                                        write_during_acquisition=bool(write_during_acquisition),
+                                        chunk_samples=int(chunk_samples),
+                                        chunk_channels=None if chunk_channels is None else int(chunk_channels),
+                                        compression=compression,
+                                        compression_level=None if compression_level is None else int(compression_level),
+                                        shuffle=bool(shuffle),
+                                        spill_dir=None if spill_dir is None else str(spill_dir),
+                                        layout=layout))
+
+    def set_live_view(self, sampling_rate:float=1e6, window_s:float=0.01, max_fps:float=10):
+        """
+        Untriggered rolling view shown by the 'Live View' button of the BLACS tab in manual mode.
+        :param sampling_rate: in Hz
+        :param window_s: length of the rolling window shown
+        :param max_fps: maximum number of updates per second sent to the GUI
+        """
+        if sampling_rate <= 0 or window_s <= 0 or max_fps <= 0:
+            raise ValueError("Invalid live view: sampling_rate, window_s and max_fps must be > 0.")
+        sample_interval_ns = int(1 / sampling_rate * 1e9)
+        self.live_view_config.update(dict(sample_interval=sample_interval_ns,
+                                          window_samples=max(int(round(window_s * sampling_rate)), 1),
+                                          max_fps=float(max_fps)))
+
+    def add_analysis_window(self, name:str, channel:str, operation:str, start_s:float=None, stop_s:float=None,
+                            threshold_mV:float=None, direction:str='rising'):
+        """
+        A scalar result computed by the worker from the raw trace of one channel and saved to /results/<device>/<name>,
+        readable in lyse with run.get_result('<device>', '<name>'). In rapid block mode there is one value per segment.
+        :param name: name of the result
+        :param channel: 'channel_A' .. 'channel_H'
+        :param operation: 'mean', 'rms', 'max', 'min' (mV), 'peak' (sample furthest from zero, mV),
+            'integral' (mV*s), 'peak_time' (s after the trigger) or 'crossings' (number of threshold crossings)
+        :param start_s: start of the window in seconds after the trigger (negative = before), None = start of the trace
+        :param stop_s: end of the window in seconds after the trigger, None = end of the trace
+        :param threshold_mV: threshold of 'crossings'
+        :param direction: crossings counted by 'crossings': 'rising', 'falling' or 'rising_or_falling'
+        """
+        allowed_channels = ['channel_A', 'channel_B', 'channel_C', 'channel_D', 'channel_E', 'channel_F', 'channel_G', 'channel_H']
+        if channel not in allowed_channels:
+            raise ValueError(f"Invalid 'channel' value: {channel}. Expected one of {allowed_channels}")
+        if operation not in ANALYSIS_OPERATIONS:
+            raise ValueError(f"Invalid 'operation' value: {operation}. Expected one of {ANALYSIS_OPERATIONS}")
+        if operation == 'crossings' and threshold_mV is None:
+            raise ValueError(f"Analysis window '{name}': 'crossings' needs a threshold_mV.")
+        if direction not in CROSSING_DIRECTIONS:
+            raise ValueError(f"Invalid 'direction' value: {direction}. Expected one of {CROSSING_DIRECTIONS}")
+        if start_s is not None and stop_s is not None and stop_s <= start_s:
+            raise ValueError(f"Analysis window '{name}': stop_s {stop_s} must be after start_s {start_s}.")
+        if name in [window['name'] for window in self.analysis_windows]:
+            raise LabscriptError(f"Analysis window '{name}' is already defined for {self.name}.")
+        self.analysis_windows.append(dict(name=name, channel=channel, operation=operation, start=start_s, stop=stop_s,
+                                          threshold=threshold_mV, direction=direction))
+
     def signal_generator_config(self,
                                 offset_voltage:int, # in volts
                                 pk2pk:int, # in volts
@@ -309,6 +489,8 @@ class PicoScope4000A(Device):
 
         if self.stream_config is not None:
             group.create_dataset('stream_config', data=np.bytes_(json.dumps(self.stream_config)))
+        if self.block_config:
+            group.create_dataset('block_config', data=np.bytes_(json.dumps(self.block_config)))
 
         # ------------------------------------------- Save siggen configuration -------------------------------------------
         if self.siggen_config is not None:
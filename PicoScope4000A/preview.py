@@ -0,0 +1,52 @@
+import math
+import numpy as np
+
+PREVIEW_BINS = 2048 # about the width of a screen in pixels, each bin is drawn as a min and a max point
+
+
+def minmax_envelope(data, max_bins: int = PREVIEW_BINS, data_min=None):
+    """
+    Decimate traces to a min/max envelope for display. Every bin of `bin_size` consecutive samples is replaced by its
+    minimum and maximum, interleaved, so that a line plot of the result covers the same vertical extent as the full
+    trace (spikes are never lost, unlike plain decimation).
+
+    :param data: (..., samples) array, e.g. (channels, samples)
+    :param max_bins: maximum number of bins, the result has at most 2 * max_bins points
+    :param data_min: optional array like `data` holding the minima, e.g. from aggregate downsampling where `data`
+        holds the maxima. The minima of the bins are then taken from it.
+    :return: (envelope, bin_size). envelope is (..., 2 * bins) with min at even and max at odd indices.
+        If the trace is not longer than 2 * max_bins (and there is no data_min), the data itself is returned with
+        bin_size 1.
+    """
+    n_samples = data.shape[-1]
+    if data_min is None:
+        if n_samples <= 2 * max_bins:
+            return data, 1
+        data_min = data
+
+    bin_size = max(2, int(math.ceil(n_samples / max_bins))) # bin_size 1 would mean plain samples to preview_times
+    n_full = n_samples // bin_size * bin_size
+    bins_shape = data.shape[:-1] + (n_full // bin_size, bin_size)
+    lo = data_min[..., :n_full].reshape(bins_shape).min(axis=-1)
+    hi = data[..., :n_full].reshape(bins_shape).max(axis=-1)
+    if n_full < n_samples: # incomplete last bin
+        lo = np.concatenate([lo, data_min[..., n_full:].min(axis=-1, keepdims=True)], axis=-1)
+        hi = np.concatenate([hi, data[..., n_full:].max(axis=-1, keepdims=True)], axis=-1)
+
+    envelope = np.empty(lo.shape[:-1] + (2 * lo.shape[-1],), dtype=data.dtype)
+    envelope[..., 0::2] = lo
+    envelope[..., 1::2] = hi
+    return envelope, bin_size
+
+
+def preview_times(n_points: int, bin_size: int, sample_interval: float) -> np.ndarray:
+    """Time axis of a preview from minmax_envelope: the min of a bin at its start, the max at its centre."""
+    k = np.arange(n_points)
+    if bin_size <= 1:
+        return k * sample_interval
+    return ((k // 2) * bin_size + (k % 2) * (bin_size / 2)) * sample_interval
+
+
+def preview_index(sample_index: int, bin_size: int) -> int:
+    """Index of the preview point that contains the given sample of the full trace."""
+    return sample_index if bin_size <= 1 else 2 * (sample_index // bin_size)
@@ -0,0 +1,446 @@
+"""
+Simulated ps4000a driver, a drop-in replacement for `picosdk.ps4000a.ps4000a` to run the acquisition pipeline
+without a scope (CI, benchmarks, development).
+
+It implements the functions and constants used by blacs_workers.PicoScope4000A with the same ctypes calling
+conventions and status codes. Samples are produced in real time at the sample interval set by RunStreaming / RunBlock
+and handed out in transfer packets like the USB driver does, so the callback cadence, driver buffer wrap-around,
+overview buffer overruns, triggers, auto-stop and over-range flags behave like the hardware.
+The synthetic waveform is a noisy baseline with a train of exponentially decaying pulses per channel; the first pulse
+arrives `first_pulse_s` after the start of the capture, so an edge trigger on it fires like the experiment's signal.
+"""
+import ctypes
+import math
+import time
+import numpy as np
+
+from .trace_storage import CHANNEL_RANGES_MV
+
+PICO_STATUS = {
+    "PICO_OK": 0x00,
+    "PICO_INVALID_HANDLE": 0x0C,
+    "PICO_INVALID_CHANNEL": 0x0E,
+    "PICO_NO_SAMPLES_AVAILABLE": 0x25,
+    "PICO_BUSY": 0x27,
+    "PICO_NOT_USED": 0x40,
+}
+PICO_OK = PICO_STATUS["PICO_OK"]
+
+MAX_ADC = 32767
+RATIO_MODE = {"none": 0, "aggregate": 1, "decimate": 2, "average": 4} # PS4000A_RATIO_MODE
+TIMEBASE_NS = 12.5 # sample interval = (timebase + 1) * 12.5 ns
+MEMORY_SAMPLES = 256 * 2 ** 20 # sample memory of the PicoScope 4824, shared by the enabled channels
+
+
+class PicoSimulationError(Exception):
+    pass
+
+
+def assert_pico_ok(status):
+    """Same contract as picosdk.functions.assert_pico_ok"""
+    if status != PICO_OK:
+        raise PicoSimulationError(f"PicoSDK returned '{status}'")
+
+
+def mV2adc(millivolts, range_index, max_adc):
+    """Same contract as picosdk.functions.mV2adc: max_adc is a ctypes integer"""
+    return round(millivolts * max_adc.value / CHANNEL_RANGES_MV[range_index])
+
+
+def _deref(ref):
+    """The ctypes object behind ctypes.byref(obj)"""
+    return getattr(ref, "_obj", ref)
+
+
+class _Channel(object):
+    def __init__(self, enabled=0, coupling=1, range_index=8, analogue_offset=0.0):
+        self.enabled = enabled
+        self.coupling = coupling
+        self.range_index = range_index
+        self.analogue_offset = analogue_offset
+
+
+class SimulatedPs4000a(object):
+    """
+    One simulated PicoScope 4000A. Use an instance wherever blacs_workers uses `psa`.
+
+    :param first_pulse_s: time from the start of the capture to the first pulse (the trigger event)
+    :param pulse_period_s: time between two pulses
+    :param pulse_decay_s: decay time of a pulse
+    :param pulse_amplitude: pulse height as a fraction of the channel's full scale
+    :param noise: rms noise as a fraction of the channel's full scale
+    :param transfer_period_s: samples become available in packets of this duration
+    :param seed: seed of the noise generator
+    """
+
+    # constants and structures of picosdk.ps4000a used by the worker
+    PS4000A_TIME_UNITS = {"PS4000A_FS": 0, "PS4000A_PS": 1, "PS4000A_NS": 2,
+                          "PS4000A_US": 3, "PS4000A_MS": 4, "PS4000A_S": 5}
+    PS4000A_THRESHOLD_DIRECTION = {
+        "PS4000A_ABOVE": 0, "PS4000A_INSIDE": 0,
+        "PS4000A_BELOW": 1, "PS4000A_OUTSIDE": 1,
+        "PS4000A_RISING": 2, "PS4000A_ENTER": 2, "PS4000A_NONE": 2,
+        "PS4000A_FALLING": 3, "PS4000A_EXIT": 3,
+        "PS4000A_RISING_OR_FALLING": 4, "PS4000A_ENTER_OR_EXIT": 4,
+        "PS4000A_ABOVE_LOWER": 5, "PS4000A_BELOW_LOWER": 6,
+        "PS4000A_RISING_LOWER": 7, "PS4000A_FALLING_LOWER": 8,
+        "PS4000A_POSITIVE_RUNT": 9, "PS4000A_NEGATIVE_RUNT": 10,
+    }
+    PS4000A_TRIGGER_STATE = {"PS4000A_DONT_CARE": 0, "PS4000A_TRUE": 1, "PS4000A_FALSE": 2}
+
+    class PS4000A_CONDITION(ctypes.Structure):
+        _pack_ = 1
+        _fields_ = [("source", ctypes.c_int32), ("condition", ctypes.c_int32)]
+
+    class PS4000A_DIRECTION(ctypes.Structure):
+        _pack_ = 1
+        _fields_ = [("channel", ctypes.c_int32), ("direction", ctypes.c_int32)]
+
+    class PS4000A_TRIGGER_CHANNEL_PROPERTIES(ctypes.Structure):
+        _pack_ = 1
+        _fields_ = [("thresholdUpper", ctypes.c_int16),
+                    ("thresholdUpperHysteresis", ctypes.c_uint16),
+                    ("thresholdLower", ctypes.c_int16),
+                    ("thresholdLowerHysteresis", ctypes.c_uint16),
+                    ("channel", ctypes.c_int32),
+                    ("thresholdMode", ctypes.c_int32)]
+
+    StreamingReadyType = ctypes.CFUNCTYPE(None, ctypes.c_int16, ctypes.c_int32, ctypes.c_uint32, ctypes.c_int16,
+                                          ctypes.c_uint32, ctypes.c_int16, ctypes.c_int16, ctypes.c_void_p)
+
+    def __init__(self, first_pulse_s=0.05, pulse_period_s=0.001, pulse_decay_s=2e-5, pulse_amplitude=0.6,
+                 noise=0.005, transfer_period_s=0.001, seed=0):
+        self.first_pulse_s = float(first_pulse_s)
+        self.pulse_period_s = float(pulse_period_s)
+        self.pulse_decay_s = float(pulse_decay_s)
+        self.pulse_amplitude = float(pulse_amplitude)
+        self.noise = float(noise)
+        self.transfer_period_s = float(transfer_period_s)
+        self.rng = np.random.default_rng(seed)
+
+        self.handle = 0
+        self.channels = {ch: _Channel() for ch in range(8)}
+        self.data_buffers = {} # (channel, segment): int16 array registered with SetDataBuffer
+        self.min_buffers = {} # (channel, segment): int16 array of the minima registered with SetDataBuffers
+        self.simple_trigger = None # (source, threshold_adc, direction, delay, auto_trigger_ms)
+        self.trigger_delay = 0
+        self.n_segments = 1
+        self.n_captures = 1
+
+        # capture state
+        self.running = False
+        self.mode = None # 'stream' | 'block'
+        self.sample_interval_s = None
+        self.downsample_ratio = 1 # raw samples per sample handed out
+        self.downsample_ratio_mode = RATIO_MODE["none"]
+        self.start_time = None
+        self.produced = 0 # samples handed out since the start of the capture
+        self.write_pos = 0 # next index in the registered buffers
+        self.trigger_sample = None # absolute index of the trigger sample, once found
+        self.trigger_reported = False
+        self._last_trigger_value = None # last sample of the trigger source, for edges across two packets
+        self.post_trigger_samples = 0
+        self.auto_stop = False
+        self.auto_stopped = False
+        self.overview_buffer_size = 0
+        self.lost_samples = 0 # samples overwritten in the overview buffer before they were fetched
+        self.block_ready_time = None
+        self.block = None # (pre, post)
+
+    #######################################################################
+    ############################# Unit ####################################
+    #######################################################################
+    def ps4000aOpenUnit(self, handle_ref, serial):
+        _deref(handle_ref).value = 1
+        self.handle = 1
+        return PICO_OK
+
+    def ps4000aCloseUnit(self, handle):
+        self.running = False
+        self.handle = 0
+        return PICO_OK
+
+    def ps4000aMaximumValue(self, handle, value_ref):
+        _deref(value_ref).value = MAX_ADC
+        return PICO_OK
+
+    def ps4000aStop(self, handle):
+        self.running = False
+        return PICO_OK
+
+    def ps4000aGetAnalogueOffset(self, handle, range_index, coupling, max_ref, min_ref):
+        limit = 0.25 if range_index <= 5 else 2.5 if range_index <= 8 else 25.0
+        _deref(max_ref).value = limit
+        _deref(min_ref).value = -limit
+        return PICO_OK
+
+    def ps4000aSetChannel(self, handle, channel, enabled, coupling, range_index, analogue_offset):
+        if not 0 <= channel < 8:
+            return PICO_STATUS["PICO_INVALID_CHANNEL"]
+        offset = analogue_offset.value if hasattr(analogue_offset, "value") else analogue_offset
+        self.channels[channel] = _Channel(enabled, coupling, range_index, float(offset))
+        return PICO_OK
+
+    def ps4000aSetDataBuffer(self, handle, channel, buffer_ptr, buffer_length, segment_index, mode):
+        self.data_buffers[(channel, segment_index)] = np.ctypeslib.as_array(buffer_ptr, shape=(int(buffer_length),))
+        return PICO_OK
+
+    def ps4000aSetDataBuffers(self, handle, channel, buffer_max_ptr, buffer_min_ptr, buffer_length, segment_index,
+                              mode):
+        self.data_buffers[(channel, segment_index)] = np.ctypeslib.as_array(buffer_max_ptr,
+                                                                            shape=(int(buffer_length),))
+        self.min_buffers[(channel, segment_index)] = np.ctypeslib.as_array(buffer_min_ptr,
+                                                                           shape=(int(buffer_length),))
+        return PICO_OK
+
+    #######################################################################
+    ############################# Triggers ################################
+    #######################################################################
+    def ps4000aSetSimpleTrigger(self, handle, enable, source, threshold, direction, delay, auto_trigger_ms):
+        self.simple_trigger = (source, threshold, direction, delay, auto_trigger_ms) if enable else None
+        return PICO_OK
+
+    def ps4000aSetTriggerChannelConditions(self, handle, conditions_ref, n_conditions, info):
+        return PICO_OK # advanced triggers fire on the first pulse
+
+    def ps4000aSetTriggerChannelDirections(self, handle, directions_ref, n_directions):
+        return PICO_OK
+
+    def ps4000aSetTriggerChannelProperties(self, handle, properties_ref, n_properties, aux_enable, auto_trigger_ms):
+        return PICO_OK
+
+    def ps4000aSetTriggerDelay(self, handle, delay):
+        self.trigger_delay = int(delay)
+        return PICO_OK
+
+    def ps4000aSetSigGenBuiltIn(self, handle, *args):
+        return PICO_OK
+
+    def ps4000aSigGenSoftwareControl(self, handle, state):
+        return PICO_OK
+
+    #######################################################################
+    ############################ Streaming ################################
+    #######################################################################
+    def ps4000aRunStreaming(self, handle, sample_interval_ref, time_units, max_pre_trigger_samples,
+                            max_post_trigger_samples, auto_stop, downsample_ratio, downsample_ratio_mode,
+                            overview_buffer_size):
+        c_interval = _deref(sample_interval_ref)
+        unit_s = 10.0 ** (3 * int(time_units) - 15)
+        interval_ns = c_interval.value * unit_s * 1e9
+        # the hardware can only sample at multiples of the timebase
+        actual_ns = max(1, round(interval_ns / TIMEBASE_NS)) * TIMEBASE_NS
+        c_interval.value = int(round(actual_ns * 1e-9 / unit_s))
+
+        self.mode = 'stream'
+        self.sample_interval_s = actual_ns * 1e-9
+        self.downsample_ratio_mode = int(downsample_ratio_mode)
+        self.downsample_ratio = max(int(downsample_ratio), 1) if self.downsample_ratio_mode else 1
+        self.post_trigger_samples = int(max_post_trigger_samples)
+        self.auto_stop = bool(auto_stop)
+        self.auto_stopped = False
+        self.overview_buffer_size = int(overview_buffer_size)
+        self._start()
+        return PICO_OK
+
+    def ps4000aGetStreamingLatestValues(self, handle, callback, param):
+        if self.mode != 'stream' or self.auto_stopped:
+            return PICO_OK
+        if not self.running:
+            return PICO_STATUS["PICO_BUSY"]
+
+        available = self._available_samples()
+        if available <= 0:
+            return PICO_OK
+
+        # the driver keeps at most one overview buffer of samples; older ones are lost
+        if available > self.overview_buffer_size:
+            lost = available - self.overview_buffer_size
+            self.lost_samples += lost
+            self.produced += lost
+            available = self.overview_buffer_size
+
+        buffer_length = min((len(buf) for (ch, seg), buf in self.data_buffers.items() if seg == 0), default=0)
+        if buffer_length == 0:
+            return PICO_STATUS["PICO_NOT_USED"] # no buffers registered
+        if self.write_pos >= buffer_length:
+            self.write_pos = 0
+        start = self.write_pos
+        n = min(available, buffer_length - start)
+
+        if self.trigger_sample is not None and self.auto_stop:
+            n = min(n, self.trigger_sample + self.post_trigger_samples - self.produced)
+
+        ratio = self.downsample_ratio
+        block, overflow = self._generate(self.produced * ratio, n * ratio)
+        block, block_min = self._downsample(block)
+        for i, ch in enumerate(self._enabled()):
+            buffer = self.data_buffers.get((ch, 0))
+            if buffer is not None:
+                buffer[start:start + n] = block[i]
+            buffer = self.min_buffers.get((ch, 0))
+            if buffer is not None and block_min is not None:
+                buffer[start:start + n] = block_min[i]
+
+        if self.trigger_sample is None:
+            index = self._find_trigger(block)
+            if index is not None:
+                self.trigger_sample = self.produced + index
+        triggered, trigger_at = 0, 0
+        if not self.trigger_reported and self.trigger_sample is not None and self.trigger_sample < self.produced + n:
+            triggered, trigger_at = 1, self.trigger_sample - self.produced
+            self.trigger_reported = True
+
+        self.produced += n
+        self.write_pos = start + n
+        auto_stop = 0
+        if (self.auto_stop and self.trigger_sample is not None
+                and self.produced >= self.trigger_sample + self.post_trigger_samples):
+            auto_stop = 1
+            self.auto_stopped = True
+
+        callback(handle, n, start, overflow, trigger_at, triggered, auto_stop, param)
+        return PICO_OK
+
+    #######################################################################
+    ########################### Rapid block ###############################
+    #######################################################################
+    def ps4000aMemorySegments(self, handle, n_segments, max_samples_ref):
+        self.n_segments = int(n_segments)
+        n_enabled = max(len(self._enabled()), 1)
+        _deref(max_samples_ref).value = MEMORY_SAMPLES // self.n_segments // n_enabled
+        return PICO_OK
+
+    def ps4000aSetNoOfCaptures(self, handle, n_captures):
+        if n_captures > self.n_segments:
+            return PICO_STATUS["PICO_NOT_USED"]
+        self.n_captures = int(n_captures)
+        return PICO_OK
+
+    def ps4000aGetTimebase2(self, handle, timebase, n_samples, interval_ref, max_samples_ref, segment_index):
+        _deref(interval_ref).value = (timebase + 1) * TIMEBASE_NS
+        _deref(max_samples_ref).value = MEMORY_SAMPLES // max(self.n_segments, 1)
+        return PICO_OK
+
+    def ps4000aRunBlock(self, handle, pre_trigger_samples, post_trigger_samples, timebase, time_indisposed_ref,
+                        segment_index, ready_callback, param):
+        self.mode = 'block'
+        self.sample_interval_s = (timebase + 1) * TIMEBASE_NS * 1e-9
+        self.downsample_ratio = 1
+        self.downsample_ratio_mode = RATIO_MODE["none"]
+        self.block = (int(pre_trigger_samples), int(post_trigger_samples))
+        self._start()
+        # one pulse per segment, the last segment is complete after its post-trigger samples
+        self.block_ready_time = (self.start_time + self.first_pulse_s + (self.n_captures - 1) * self.pulse_period_s
+                                 + post_trigger_samples * self.sample_interval_s)
+        return PICO_OK
+
+    def ps4000aIsReady(self, handle, ready_ref):
+        ready = self.mode == 'block' and time.perf_counter() >= self.block_ready_time
+        _deref(ready_ref).value = 1 if ready else 0
+        return PICO_OK
+
+    def ps4000aGetValuesBulk(self, handle, n_samples_ref, from_segment, to_segment, downsample_ratio,
+                             downsample_ratio_mode, overflow_ref):
+        pre, post = self.block
+        n = min(int(_deref(n_samples_ref).value), pre + post)
+        overflow = _deref(overflow_ref)
+        # every segment is centred on a pulse, like a capture triggered on it
+        first = int(round(self.first_pulse_s / self.sample_interval_s)) - pre
+        period = self.pulse_period_s / self.sample_interval_s
+        for segment in range(from_segment, to_segment + 1):
+            block, flags = self._generate(first + int(round(segment * period)), n)
+            for i, ch in enumerate(self._enabled()):
+                buffer = self.data_buffers.get((ch, segment))
+                if buffer is not None:
+                    buffer[:n] = block[i]
+            overflow[segment - from_segment] = flags
+        _deref(n_samples_ref).value = n
+        self.running = False
+        return PICO_OK
+
+    #######################################################################
+    ############################# Helpers #################################
+    #######################################################################
+    def _start(self):
+        self.running = True
+        self.start_time = time.perf_counter()
+        self.produced = 0
+        self.write_pos = 0
+        self.trigger_sample = None
+        self.trigger_reported = False
+        self._last_trigger_value = None
+        self.lost_samples = 0
+
+    def _enabled(self):
+        return [ch for ch in range(8) if self.channels[ch].enabled]
+
+    def _available_samples(self) -> int:
+        """Samples acquired since the start and not handed out yet, in whole transfer packets"""
+        elapsed = time.perf_counter() - self.start_time
+        if self.transfer_period_s > 0:
+            elapsed = math.floor(elapsed / self.transfer_period_s) * self.transfer_period_s
+        return int(elapsed / (self.sample_interval_s * self.downsample_ratio)) - self.produced
+
+    def _downsample(self, block):
+        """Reduce (channels, n * ratio) raw samples to n per channel like the driver: (max or value, min or None)"""
+        ratio = self.downsample_ratio
+        if ratio == 1:
+            return block, None
+        groups = block.reshape(block.shape[0], -1, ratio)
+        if self.downsample_ratio_mode == RATIO_MODE["aggregate"]:
+            return groups.max(axis=-1), groups.min(axis=-1)
+        if self.downsample_ratio_mode == RATIO_MODE["average"]:
+            return groups.mean(axis=-1).round().astype(np.int16), None
+        return np.ascontiguousarray(groups[..., 0]), None # decimate
+
+    def _generate(self, first_sample: int, n: int):
+        """(enabled channels, n) int16 samples from absolute sample index first_sample, and the over-range bit mask"""
+        channels = self._enabled()
+        t = (first_sample + np.arange(n)) * self.sample_interval_s - self.first_pulse_s
+        block = np.empty((len(channels), n), dtype=np.int16)
+        overflow = 0
+        for i, ch in enumerate(channels):
+            # channel ch lags by ch pulse decay times, so the channels are distinguishable
+            phase = np.mod(t - ch * self.pulse_decay_s, self.pulse_period_s)
+            pulses = np.where(t >= ch * self.pulse_decay_s, np.exp(-phase / self.pulse_decay_s), 0.0)
+            signal = (self.pulse_amplitude * pulses + self.rng.normal(0.0, self.noise, n)) * MAX_ADC
+            if np.any(np.abs(signal) > MAX_ADC):
+                overflow |= 1 << ch
+            block[i] = np.clip(signal, -MAX_ADC, MAX_ADC)
+        return block, overflow
+
+    def _find_trigger(self, block):
+        """Index of the trigger relative to the start of a freshly generated block (may lie beyond it), or None"""
+        n = block.shape[1]
+        if self.simple_trigger is None:
+            # advanced triggers: fire on the first pulse
+            interval_s = self.sample_interval_s * self.downsample_ratio
+            index = int(math.ceil(self.first_pulse_s / interval_s)) + self.trigger_delay - self.produced
+            return max(index, 0) if index < n else None
+
+        source, threshold, direction, delay, auto_trigger_ms = self.simple_trigger
+        channels = self._enabled()
+        if source in channels:
+            trace = block[channels.index(source)].astype(np.int32)
+            previous = np.empty_like(trace)
+            previous[1:] = trace[:-1]
+            previous[0] = trace[0] if self._last_trigger_value is None else self._last_trigger_value
+            self._last_trigger_value = trace[-1]
+            if direction in (0, 5): # above
+                hits = np.flatnonzero(trace > threshold)
+            elif direction in (1, 6): # below
+                hits = np.flatnonzero(trace < threshold)
+            elif direction in (3, 8): # falling
+                hits = np.flatnonzero((previous >= threshold) & (trace < threshold))
+            elif direction == 4: # rising or falling
+                hits = np.flatnonzero((previous < threshold) != (trace < threshold))
+            else: # rising
+                hits = np.flatnonzero((previous < threshold) & (trace >= threshold))
+            if hits.size > 0:
+                return int(hits[0]) + int(delay) + self.trigger_delay
+
+        elapsed_ms = (self.produced + n) * self.sample_interval_s * self.downsample_ratio * 1e3
+        if auto_trigger_ms > 0 and elapsed_ms >= auto_trigger_ms:
+            return n - 1
+        return None
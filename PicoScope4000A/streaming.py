@@ -0,0 +1,421 @@
+import math
+import os
+import tempfile
+import time
+import threading
+import numpy as np
+
+CALLBACK_PERIOD_S = 0.05 # expected time between two callbacks of GetStreamingLatestValues
+BUFFER_HEADROOM = 4 # driver buffer holds this many callback periods before the driver overflows
+MIN_DRIVER_BUFFER_SIZE = 1000 # in samples per channel
+MAX_DRIVER_BUFFER_SIZE = 1 << 24 # in samples per channel (32 MB per channel)
+BLOCK_POLL_PERIOD_S = 0.005 # IsReady poll period while waiting for a block capture
+
+
+def choose_driver_buffer_size(sample_interval_ns: int, total_samples: int,
+                              callback_period_s: float = CALLBACK_PERIOD_S,
+                              headroom: int = BUFFER_HEADROOM) -> int:
+    """
+    Size the buffers registered with the driver (and the driver's overview buffer) so that they can hold
+    `headroom` callback periods of data at the given sample interval.
+
+    :param sample_interval_ns: requested sample interval in ns
+    :param total_samples: number of samples of the complete capture per channel
+    :param callback_period_s: expected time between two streaming callbacks in seconds
+    :param headroom: number of callback periods the buffer must hold
+    :return: buffer size in samples per channel
+    """
+    samples_per_period = callback_period_s * 1e9 / max(int(sample_interval_ns), 1)
+    buffer_size = int(math.ceil(samples_per_period * headroom))
+    # there is no point in a driver buffer larger than the whole capture
+    upper = max(MIN_DRIVER_BUFFER_SIZE, min(int(total_samples), MAX_DRIVER_BUFFER_SIZE))
+    return max(MIN_DRIVER_BUFFER_SIZE, min(buffer_size, upper))
+
+
+class RingBuffer(object):
+    """
+    Fixed-size circular (channels x size) history. A write costs at most two slice copies of the written block,
+    independent of the length of the history, and never allocates.
+    """
+    def __init__(self, n_channels: int, size: int, dtype=np.int16):
+        self.buffer = np.zeros((n_channels, size), dtype=dtype)
+        self.size = int(size)
+        self.head = 0 # next write position
+        self.count = 0 # number of valid samples
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+
+    def write(self, block):
+        """Append a (channels x n) block, keeping only the newest `size` samples."""
+        n = block.shape[1]
+        if self.size == 0 or n == 0:
+            return
+        if n >= self.size:
+            block = block[:, n - self.size:]
+            n = self.size
+        end = self.head + n
+        if end <= self.size:
+            self.buffer[:, self.head:end] = block
+        else:
+            first = self.size - self.head
+            self.buffer[:, self.head:] = block[:, :first]
+            self.buffer[:, :n - first] = block[:, first:]
+        self.head = end % self.size
+        self.count = min(self.count + n, self.size)
+
+    def read_into(self, out) -> int:
+        """
+        Copy the history in chronological order into the end of `out` (channels x m), the newest sample last.
+        :return: number of samples copied, min(count, m)
+        """
+        n = min(self.count, out.shape[1])
+        if n == 0:
+            return 0
+        start = (self.head - n) % self.size
+        dest = out[:, out.shape[1] - n:]
+        if start + n <= self.size:
+            dest[:] = self.buffer[:, start:start + n]
+        else:
+            first = self.size - start
+            dest[:, :first] = self.buffer[:, start:]
+            dest[:, first:] = self.buffer[:, :n - first]
+        return n
+
+
+class StreamBuffer(object):
+    """
+    Acquisition memory of one streaming capture.
+
+    The destination `data` is a single preallocated (channels x samples) int16 array, the buffers registered
+    with the driver are the rows of a second (channels x driver_buffer_size) array. Both are reused across shots
+    as long as the channels and sizes do not change, so no memory is allocated per shot, and a callback moves the
+    new samples of all channels with a single 2-D slice copy.
+
+    In 'aggregate' downsampling mode the driver delivers a max and a min value per channel and the arrays hold
+    2 x channels rows: the max rows first (`max_data`), then the min rows (`min_data`).
+
+    With a `spill_dir`, `data` is a numpy.memmap of a scratch file instead of RAM, so captures larger than the host
+    memory only occupy page cache that the OS can write back and evict. The callback writes into it unchanged.
+    """
+    def __init__(self):
+        self.data = None # (channels, total_samples) in adc
+        self.driver = None # (channels, driver_buffer_size) in adc, registered with the driver
+        self.channels = [] # channel numbers, row i of data belongs to channels[i]
+        self.aggregate = False # max and min rows per channel
+        self.total_samples = 0
+        self.next_sample = 0
+        self.truncated = 0 # samples dropped because they did not fit into total_samples
+        # notified whenever new samples were appended, for any number of consumers like TraceWriter and StreamDsp
+        self.data_condition = threading.Condition()
+        self.pre_trigger_samples = 0 # leading samples of `data` taken before the trigger
+        self.pre_trigger_valid = 0 # how many of them were actually recorded before the trigger
+        self.history = RingBuffer(0, 0) # pre-trigger history, recorded until the trigger occurs
+        self.spill_dir = None
+        self.spill_file = None # path of the memory-mapped capture, None if `data` is in RAM
+        self.stale_spill_files = [] # spill files that could not be deleted yet, retried at every release
+
+    def allocate(self, channels, total_samples: int, driver_buffer_size: int, pre_trigger_samples: int = 0,
+                 aggregate: bool = False, spill_dir: str = None):
+        """
+        Prepare the buffers for a new capture, reallocating only if the shape changed.
+        :param total_samples: pre- plus post-trigger samples per channel
+        :param pre_trigger_samples: samples before the trigger to splice in front of the post-trigger data
+        :param aggregate: keep a max and a min row per channel
+        :param spill_dir: directory on a local disk for a memory-mapped capture, None keeps it in RAM
+        """
+        n_rows = len(channels) * (2 if aggregate else 1)
+        shape = (n_rows, int(total_samples))
+        if self.data is None or self.data.shape != shape or self.spill_dir != spill_dir:
+            self.release()
+            self.data = self._new_data(shape, spill_dir)
+        driver_shape = (n_rows, int(driver_buffer_size))
+        if self.driver is None or self.driver.shape != driver_shape:
+            self.driver = np.zeros(driver_shape, dtype=np.int16)
+        if self.history.buffer.shape != (n_rows, int(pre_trigger_samples)):
+            self.history = RingBuffer(n_rows, int(pre_trigger_samples))
+
+        self.channels = list(channels)
+        self.aggregate = bool(aggregate)
+        self.pre_trigger_samples = int(pre_trigger_samples)
+        self.total_samples = int(total_samples)
+        self.reset()
+
+    def _new_data(self, shape, spill_dir):
+        self.spill_dir = spill_dir
+        if spill_dir is None:
+            return np.zeros(shape, dtype=np.int16)
+        os.makedirs(spill_dir, exist_ok=True)
+        fd, self.spill_file = tempfile.mkstemp(prefix="picoscope_capture_", suffix=".int16", dir=spill_dir)
+        os.close(fd)
+        return np.memmap(self.spill_file, dtype=np.int16, mode='w+', shape=shape)
+
+    def release(self):
+        """
+        Free the capture memory and delete the spill file, if any. The caller drops its views of `data` (rows(),
+        max_data, ...) first: Windows cannot delete a file that is still mapped. A spill file that cannot be deleted
+        is kept in stale_spill_files and deleted by a later release.
+        """
+        data, self.data = self.data, None
+        if isinstance(data, np.memmap):
+            data.flush()
+            mapping = data._mmap
+            del data
+            try:
+                mapping.close() # unmap now rather than at garbage collection
+            except BufferError: # a view of the capture is still alive and keeps the file mapped
+                print(f"[WARNING] The spill file {self.spill_file} is still mapped by a view of the capture")
+        else:
+            del data
+        if self.spill_file is not None:
+            self.stale_spill_files.append(self.spill_file)
+            self.spill_file = None
+        for path in list(self.stale_spill_files):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"[WARNING] Could not delete the spill file {path}, retrying at the next release: {e}")
+                continue
+            self.stale_spill_files.remove(path)
+
+    def reset(self):
+        self.next_sample = 0
+        self.truncated = 0
+        self.pre_trigger_valid = 0
+        self.history.clear()
+
+    @property
+    def samples_ready(self) -> int:
+        """number of valid samples at the start of `data`"""
+        return min(self.next_sample, self.total_samples)
+
+    @property
+    def driver_buffer_size(self) -> int:
+        return 0 if self.driver is None else self.driver.shape[1]
+
+    @property
+    def is_complete(self) -> bool:
+        return self.next_sample >= self.total_samples
+
+    @property
+    def max_data(self):
+        """(channels, samples) view of the samples, or of the max values in aggregate mode"""
+        return self.data[:len(self.channels)]
+
+    @property
+    def min_data(self):
+        """(channels, samples) view of the min values in aggregate mode, else None"""
+        return self.data[len(self.channels):] if self.aggregate else None
+
+    def driver_rows(self) -> dict:
+        """{channel: row of the driver buffer} to register with SetDataBuffer (the max buffer in aggregate mode)"""
+        return {ch: self.driver[i] for i, ch in enumerate(self.channels)}
+
+    def driver_min_rows(self) -> dict:
+        """{channel: min row of the driver buffer} to register with SetDataBuffers in aggregate mode"""
+        n = len(self.channels)
+        return {ch: self.driver[n + i] for i, ch in enumerate(self.channels)} if self.aggregate else {}
+
+    def rows(self) -> dict:
+        """{channel: row of the complete capture}, views into `data` (no copy)"""
+        return {ch: self.data[i] for i, ch in enumerate(self.channels)}
+
+    def record_history(self, start_index: int, no_of_samples: int):
+        """Before the trigger: keep the newest samples of the driver buffers as pre-trigger history."""
+        if self.pre_trigger_samples > 0:
+            self.history.write(self.driver[:, start_index:start_index + no_of_samples])
+
+    def start_capture(self, start_index: int, trigger_at: int, no_of_samples: int) -> int:
+        """
+        The callback that contains the trigger: splice the pre-trigger history in front of the capture and append
+        the samples from the trigger point on. The trigger sample ends up at index `pre_trigger_samples` of `data`.
+        :param trigger_at: index of the trigger relative to start_index
+        :return: the number of samples that did not fit into the capture
+        """
+        self.record_history(start_index, trigger_at)
+        pre = self.pre_trigger_samples
+        self.pre_trigger_valid = self.history.read_into(self.data[:, :pre])
+        self.data[:, :pre - self.pre_trigger_valid] = 0 # trigger came before the history was full
+        self.next_sample = pre
+        return self.append(start_index + trigger_at, no_of_samples - trigger_at)
+
+    def wait_for_samples(self, n: int, timeout: float = None) -> int:
+        """
+        Block a consumer thread until samples_ready >= n, new samples arrive, wake() is called or the timeout
+        expires. Every waiting consumer is woken, none takes the wakeup of another.
+        :return: samples_ready
+        """
+        with self.data_condition:
+            if self.samples_ready < n:
+                self.data_condition.wait(timeout)
+        return self.samples_ready
+
+    def wake(self):
+        """Wake all consumers waiting in wait_for_samples, e.g. to let them finish"""
+        with self.data_condition:
+            self.data_condition.notify_all()
+
+    def append(self, start_index: int, no_of_samples: int) -> int:
+        """
+        Move `no_of_samples` samples starting at `start_index` of the driver buffers to the end of the capture.
+        :return: the number of samples that did not fit into the capture
+        """
+        dest_end = min(self.next_sample + no_of_samples, self.total_samples)
+        n_copy = max(dest_end - self.next_sample, 0)
+        if n_copy > 0:
+            self.data[:, self.next_sample:dest_end] = self.driver[:, start_index:start_index + n_copy]
+        self.next_sample += no_of_samples
+        with self.data_condition:
+            self.data_condition.notify_all()
+        truncated = no_of_samples - n_copy
+        self.truncated += truncated
+        return truncated
+
+
+class FetchScheduler(object):
+    """
+    Chooses how long the fetching thread waits between two calls of GetStreamingLatestValues.
+
+    The period starts at `target_fill` of the time the driver needs to fill its buffer at the configured sample
+    interval and is then corrected after every poll from the fill level actually delivered: polls that found no data
+    stretch the period, polls that found the buffer fuller than targeted shorten it. The statistics tell how well
+    the fetching kept up with the driver.
+    """
+    def __init__(self, sample_interval_ns: int, driver_buffer_size: int, target_fill: float = 0.25,
+                 min_period_s: float = 0.0002, max_period_s: float = CALLBACK_PERIOD_S):
+        self.driver_buffer_size = int(driver_buffer_size)
+        self.buffer_time_s = self.driver_buffer_size * sample_interval_ns * 1e-9 # time to fill the driver buffer
+        self.target_fill = target_fill
+        self.min_period_s = min_period_s
+        self.max_period_s = max(min_period_s, min(max_period_s, self.buffer_time_s / 2))
+        self.period_s = self._clamp(self.buffer_time_s * target_fill)
+
+        self.delivered = 0 # samples delivered by callbacks since the last poll
+        self.polls = 0
+        self.empty_polls = 0
+        self.late_polls = 0 # polls that found the driver buffer (almost) full
+        self.max_fill = 0.0
+        self.max_gap_s = 0.0 # longest time between two polls that delivered data
+        self._last_data_time = None
+
+    def _clamp(self, period_s):
+        return min(max(period_s, self.min_period_s), self.max_period_s)
+
+    def start(self):
+        self._last_data_time = time.perf_counter()
+
+    def poll_done(self) -> float:
+        """Record the outcome of one poll and return how long to wait before the next one, in seconds."""
+        now = time.perf_counter()
+        delivered, self.delivered = self.delivered, 0
+        self.polls += 1
+
+        if delivered == 0:
+            self.empty_polls += 1
+            self.period_s = self._clamp(self.period_s * 1.5)
+            return self.period_s
+
+        if self._last_data_time is not None:
+            self.max_gap_s = max(self.max_gap_s, now - self._last_data_time)
+        self._last_data_time = now
+
+        fill = delivered / self.driver_buffer_size
+        self.max_fill = max(self.max_fill, fill)
+        if fill >= 0.9:
+            self.late_polls += 1
+        # proportional correction towards the target fill level, at most a factor 2 per poll
+        correction = min(max(self.target_fill / fill, 0.5), 2.0)
+        self.period_s = self._clamp(self.period_s * correction)
+        return self.period_s
+
+    def report(self) -> dict:
+        return dict(polls=self.polls,
+                    empty_polls=self.empty_polls,
+                    late_polls=self.late_polls,
+                    max_fill=round(self.max_fill, 3),
+                    max_gap_s=self.max_gap_s,
+                    final_period_s=self.period_s)
+
+
+class SegmentBuffer(object):
+    """
+    Preallocated (segments x channels x samples) memory of a rapid block capture, reused across shots.
+    Every (segment, channel) row is registered with the driver, so GetValuesBulk writes the whole capture in place.
+    """
+    def __init__(self):
+        self.data = None # (segments, channels, samples) in adc
+        self.channels = []
+        self.samples = 0 # samples per segment actually retrieved
+        self.overflow = [] # per segment overflow bit mask (bit n = channel n over range)
+
+    def allocate(self, n_segments: int, channels, n_samples: int):
+        shape = (int(n_segments), len(channels), int(n_samples))
+        if self.data is None or self.data.shape != shape:
+            self.data = np.zeros(shape, dtype=np.int16)
+        self.channels = list(channels)
+        self.samples = 0
+        self.overflow = [0] * int(n_segments)
+
+    @property
+    def n_segments(self) -> int:
+        return 0 if self.data is None else self.data.shape[0]
+
+
+class StreamStats(object):
+    """
+    Health counters of one streaming capture, updated from the streaming callback and stored with the traces:
+    callbacks, samples per callback, per-channel over-range events, fetch gaps, trigger to completion time
+    and truncation.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.callbacks = 0
+        self.samples = 0
+        self.max_samples_per_callback = 0
+        self.overflow_events = np.zeros(8, dtype=np.int64) # callbacks with the over-range bit set, per channel
+        self.start_time = time.perf_counter()
+        self.trigger_time = None
+        self.complete_time = None
+
+    def callback(self, no_of_samples: int, overflow: int):
+        self.callbacks += 1
+        self.samples += no_of_samples
+        if no_of_samples > self.max_samples_per_callback:
+            self.max_samples_per_callback = no_of_samples
+        if overflow:
+            for ch in range(8):
+                if overflow & (1 << ch):
+                    self.overflow_events[ch] += 1
+
+    def triggered(self):
+        self.trigger_time = time.perf_counter()
+
+    def completed(self):
+        self.complete_time = time.perf_counter()
+
+    @property
+    def trigger_to_complete_s(self) -> float:
+        if self.trigger_time is None or self.complete_time is None:
+            return float('nan')
+        return self.complete_time - self.trigger_time
+
+    def report(self, scheduler_report: dict = None, truncated: int = 0) -> dict:
+        """Flat dict of the counters, the keys are the attribute names of the traces dataset"""
+        scheduler_report = scheduler_report or {}
+        return dict(stream_callbacks=self.callbacks,
+                    stream_samples_per_callback=self.samples / self.callbacks if self.callbacks else 0.0,
+                    stream_max_samples_per_callback=self.max_samples_per_callback,
+                    stream_overflow_events=self.overflow_events.copy(),
+                    stream_max_fetch_gap_s=float(scheduler_report.get('max_gap_s', 0.0)),
+                    stream_late_polls=int(scheduler_report.get('late_polls', 0)),
+                    stream_fetch_polls=int(scheduler_report.get('polls', 0)),
+                    stream_empty_polls=int(scheduler_report.get('empty_polls', 0)),
+                    stream_max_buffer_fill=float(scheduler_report.get('max_fill', 0.0)),
+                    stream_fetch_period_s=float(scheduler_report.get('final_period_s', 0.0)),
+                    stream_trigger_to_complete_s=self.trigger_to_complete_s,
+                    stream_truncated_samples=int(truncated))
@@ -0,0 +1,105 @@
+"""
+Write speed and compression ratio of the trace storage options on synthetic PicoScope traces.
+
+cd ~/labscript-suite/userlib
+python3 -m user_devices.PicoScope4000A.testing.compression_benchmark --samples 2000000 --channels 8 --json result.json
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+from user_devices.hdf5_filters import compression_kwargs, hdf5plugin
+from user_devices.PicoScope4000A.trace_storage import dataset_chunks, DEFAULT_CHUNK_SAMPLES
+
+OPTIONS = [
+    dict(compression='none'),
+    dict(compression='lzf'),
+    dict(compression='lzf', shuffle=True),
+    dict(compression='gzip', compression_level=1),
+    dict(compression='gzip', compression_level=1, shuffle=True),
+    dict(compression='gzip', compression_level=4),
+    dict(compression='gzip', compression_level=4, shuffle=True),
+    dict(compression='blosc-lz4'),
+    dict(compression='blosc-lz4', shuffle=True),
+]
+
+
+def synthetic_traces(n_samples, n_channels, seed=0):
+    """(samples, channels) int16 traces: noisy baseline with a train of decaying pulses, like our ion signals."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_samples)
+    traces = np.empty((n_samples, n_channels), dtype=np.int16)
+    for ch in range(n_channels):
+        pulses = np.zeros(n_samples)
+        period = 5000 + 1000 * ch
+        pulses[::period] = 8000
+        kernel = np.exp(-np.arange(2000) / 300.0)
+        signal = np.convolve(pulses, kernel)[:n_samples] + 500 * np.sin(2 * np.pi * t / (20000 + 3000 * ch))
+        traces[:, ch] = np.clip(signal + rng.normal(0, 40, n_samples), -32767, 32767).astype(np.int16)
+    return traces
+
+
+def run_option(path, data, option, chunk_samples, repeats):
+    filters = compression_kwargs(option['compression'], option.get('compression_level'), option.get('shuffle', False))
+    chunks = dataset_chunks(data.shape[0], data.shape[1], chunk_samples)
+    write_times = []
+    for _ in range(repeats):
+        with h5py.File(path, 'w') as f:
+            t0 = time.perf_counter()
+            ds = f.create_dataset('traces', data=data, chunks=chunks, **filters)
+            f.flush()
+            write_times.append(time.perf_counter() - t0)
+            stored = ds.id.get_storage_size()
+
+    t0 = time.perf_counter()
+    with h5py.File(path, 'r') as f:
+        f['traces'][()]
+    read_time = time.perf_counter() - t0
+
+    size_mb = data.nbytes / 1e6
+    write_time = min(write_times)
+    return dict(option=option,
+                write_mb_s=size_mb / write_time,
+                read_mb_s=size_mb / read_time,
+                compression_ratio=data.nbytes / max(stored, 1),
+                stored_mb=stored / 1e6)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', type=int, default=2_000_000)
+    parser.add_argument('--channels', type=int, default=8)
+    parser.add_argument('--chunk-samples', type=int, default=DEFAULT_CHUNK_SAMPLES)
+    parser.add_argument('--units', choices=['adc', 'mV'], default='adc')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    data = synthetic_traces(args.samples, args.channels)
+    if args.units == 'mV':
+        data = (data * np.float32(5000 / 32512)).astype(np.float32)
+    if hdf5plugin is None:
+        print("hdf5plugin not installed: blosc-lz4 falls back to lzf")
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.h5')
+        for option in OPTIONS:
+            result = run_option(path, data, option, args.chunk_samples, args.repeats)
+            results.append(result)
+            print(f"{json.dumps(option):70s} write {result['write_mb_s']:8.1f} MB/s  "
+                  f"read {result['read_mb_s']:8.1f} MB/s  ratio {result['compression_ratio']:5.2f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(dict(samples=args.samples, channels=args.channels, units=args.units,
+                           chunk_samples=args.chunk_samples, results=results), f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
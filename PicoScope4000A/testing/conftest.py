@@ -0,0 +1,7 @@
+"""
+pytest setup of the PicoScope tests. They run against the simulated driver, no scope is needed:
+
+cd ~/labscript-suite/userlib
+python3 -m pytest user_devices/PicoScope4000A/testing
+"""
+import labscript_utils.h5_lock # before anything imports h5py
@@ -0,0 +1,209 @@
+"""
+Streaming throughput benchmark of the PicoScope pipeline: run_stream, the fetching thread and the end-of-shot write
+of PicoScopeWorker.transition_to_manual, across channel counts, sample intervals and driver buffer sizes.
+
+Runs against the simulated driver by default, or against a real unit with --serial (trigger on channel A,
+auto trigger after 1 ms so that no signal is needed). The simulated waveform is noise free, so every stored sample is
+checked against it: a capture with a missing or repeated sample fails the benchmark. test_stream_benchmark.py runs
+short cases of it under pytest.
+
+cd ~/labscript-suite/userlib
+python3 -m user_devices.PicoScope4000A.testing.stream_benchmark --channels 1 4 8 --intervals-ns 1000 200 --json result.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import labscript_utils.h5_lock # before h5py
+import h5py
+import numpy as np
+
+from user_devices.PicoScope4000A.blacs_workers import PicoScope4000A, PicoScopeWorker
+from user_devices.PicoScope4000A.simulation import SimulatedPs4000a
+from user_devices.PicoScope4000A.trace_storage import adc_to_mv, traces_to_mv
+from user_devices.preview_publisher import PreviewPublisher
+
+CHANNEL_NAMES = [f"channel_{c}" for c in "ABCDEFGH"]
+RANGE_V = 5
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, None if it cannot be determined"""
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / 1e6
+    except ImportError:
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1e6 if sys.platform == "darwin" else peak / 1e3 # bytes on macOS, kB on Linux
+    except ImportError:
+        return None
+
+
+class CallbackProbe(object):
+    """Times every callback that moves samples into the StreamBuffer, by wrapping append on the instance."""
+    def __init__(self, stream_buffer):
+        self.times = []
+        self.samples = []
+        self.copy_s = []
+        append = stream_buffer.append
+
+        def timed_append(start_index, no_of_samples):
+            t0 = time.perf_counter()
+            truncated = append(start_index, no_of_samples)
+            self.copy_s.append(time.perf_counter() - t0)
+            self.times.append(t0)
+            self.samples.append(no_of_samples)
+            return truncated
+
+        stream_buffer.append = timed_append
+
+    def report(self) -> dict:
+        gaps = np.diff(self.times) if len(self.times) > 1 else np.zeros(1)
+        copy_s = np.asarray(self.copy_s) if self.copy_s else np.zeros(1)
+        return dict(callbacks=len(self.times),
+                    samples_per_callback=float(np.mean(self.samples)) if self.samples else 0.0,
+                    callback_gap_ms={f"p{p}": float(np.percentile(gaps, p) * 1e3) for p in (50, 90, 99, 100)},
+                    callback_copy_us={f"p{p}": float(np.percentile(copy_s, p) * 1e6) for p in (50, 90, 99, 100)})
+
+
+def make_worker(pico, h5_file, device_name, storage_config):
+    """A PicoScopeWorker without the BLACS process around it, enough for transition_to_manual"""
+    worker = PicoScopeWorker.__new__(PicoScopeWorker)
+    worker._init_state() # the state init() sets up, so it cannot fall behind the worker
+    worker.pico = pico
+    worker.h5_file = h5_file
+    worker.device_name = device_name
+    worker.storage_config = storage_config
+    worker.channel_names = CHANNEL_NAMES[:len(pico.stream_buffer.channels)]
+    worker.siggen_config = {}
+    worker.preview_publisher = PreviewPublisher(None, None) # disabled, no GUI
+    worker.previews_dropped = 0
+    return worker
+
+
+def check_sample_exact(pico, path, device_name="picoscope", block_samples=1 << 20):
+    """
+    Compare every stored sample with the noise-free waveform of the simulated driver, so that a sample lost or
+    repeated at a wrap-around of the driver buffers or at the pre-trigger splice fails. Compared in blocks of
+    block_samples, to hold only one block of the capture in memory.
+    """
+    sim = pico.psa
+    buffer = pico.stream_buffer
+    pre, valid, total = buffer.pre_trigger_samples, buffer.pre_trigger_valid, buffer.total_samples
+    assert buffer.samples_ready == total, f"capture ended early: {buffer.samples_ready} of {total} samples"
+    with h5py.File(path, "r") as f:
+        ds = f[f"/data/traces/{device_name}"]
+        assert ds.shape[0] == total, f"{ds.shape[0]} samples stored, {total} captured"
+        assert not np.any(ds[:pre - valid]), "samples before the pre-trigger history are not zero"
+        # sample k of the capture is sample trigger_sample - pre + k of the simulated waveform
+        for start in range(pre - valid, total, block_samples):
+            stop = min(start + block_samples, total)
+            expected, _ = sim._generate(sim.trigger_sample - pre + start, stop - start)
+            expected_mv = adc_to_mv(expected, ds.attrs["channel_ranges"], ds.attrs["max_adc"])
+            stored_mv = traces_to_mv(ds, ds[start:stop]).T
+            wrong = np.flatnonzero(~np.isclose(stored_mv, expected_mv, rtol=1e-6, atol=0).all(axis=0))
+            assert wrong.size == 0, (f"{wrong.size} samples differ from the simulated waveform, "
+                                     f"the first at sample {start + wrong[0]}, {sim.lost_samples} samples lost "
+                                     f"in the driver")
+
+
+def run_case(args, n_channels, interval_ns, driver_buffer_size, path):
+    if args.serial:
+        pico = PicoScope4000A(args.serial)
+    else:
+        pico = PicoScope4000A("SIM", driver=SimulatedPs4000a(first_pulse_s=0.01, noise=0.0))
+    try:
+        for ch in range(8):
+            pico.set_channel(CHANNEL_NAMES[ch], "dc", RANGE_V, int(ch < n_channels), 0.0)
+        # the simulated pulses reach 60% of full scale
+        pico.set_simple_edge_trigger("channel_A", 0.3 * RANGE_V * 1e3, "rising", 0, 1 if args.serial else 0)
+
+        n_samples = int(round(args.duration_s * 1e9 / interval_ns))
+        with h5py.File(path, "w") as f:
+            f.require_group("/data/traces")
+
+        probe = CallbackProbe(pico.stream_buffer)
+        t_start = time.perf_counter()
+        pico.run_stream(interval_ns, n_samples, driver_buffer_size=driver_buffer_size)
+        worker = make_worker(pico, path, "picoscope", dict(units=args.units, compression=args.compression))
+
+        pico.trigger_event.wait(timeout=10)
+        t_trigger = time.perf_counter()
+        pico.stop_sampling_event.wait(timeout=args.duration_s * 10 + 10)
+        t_complete = time.perf_counter()
+        pico.fetching_thread.join()
+
+        t0 = time.perf_counter()
+        worker.transition_to_manual()
+        write_s = time.perf_counter() - t0
+
+        ready = pico.stream_buffer.samples_ready
+        driver = pico.psa
+        if not args.serial:
+            check_sample_exact(pico, path)
+        return dict(channels=n_channels,
+                    sample_interval_ns=interval_ns,
+                    actual_sample_interval_ns=pico.actual_sample_interval,
+                    driver_buffer_size=pico.stream_buffer.driver_buffer_size,
+                    samples=n_samples,
+                    samples_ready=ready,
+                    start_to_trigger_s=t_trigger - t_start,
+                    trigger_to_complete_s=t_complete - t_trigger,
+                    sustained_rate_msps=ready * n_channels / max(t_complete - t_trigger, 1e-9) / 1e6,
+                    truncated=pico.stream_buffer.truncated,
+                    lost_samples=getattr(driver, "lost_samples", None), # only known for the simulated driver
+                    end_of_shot_write_s=write_s,
+                    file_mb=os.path.getsize(path) / 1e6,
+                    fetch_scheduler=pico.fetch_scheduler.report(),
+                    peak_rss_mb=peak_rss_mb(),
+                    **probe.report())
+    finally:
+        pico.close_unit()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--serial", help="serial number of a real unit, default: simulated driver")
+    parser.add_argument("--channels", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--intervals-ns", type=int, nargs="+", default=[1000, 200])
+    parser.add_argument("--buffer-sizes", type=int, nargs="+", default=[0],
+                        help="driver buffer sizes in samples, 0 = sized automatically")
+    parser.add_argument("--duration-s", type=float, default=1.0, help="post-trigger capture time per case")
+    parser.add_argument("--units", choices=["adc", "mV"], default="adc")
+    parser.add_argument("--compression", default="none")
+    parser.add_argument("--json", help="write the results to this file")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "shot.h5")
+        for n_channels in args.channels:
+            for interval_ns in args.intervals_ns:
+                for buffer_size in args.buffer_sizes:
+                    result = run_case(args, n_channels, interval_ns, buffer_size or None, path)
+                    results.append(result)
+                    print(f"{n_channels} ch {interval_ns:6d} ns buffer {result['driver_buffer_size']:8d}: "
+                          f"{result['sustained_rate_msps']:7.2f} MS/s  "
+                          f"gap p99 {result['callback_gap_ms']['p99']:7.2f} ms  "
+                          f"truncated {result['truncated']}  lost {result['lost_samples']}  "
+                          f"write {result['end_of_shot_write_s']:.3f} s  rss {result['peak_rss_mb']} MB")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(dict(driver="real" if args.serial else "simulated", units=args.units,
+                           compression=args.compression, duration_s=args.duration_s, results=results), f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from user_devices.PicoScope4000A.analysis import window_slice, reduce_window, analyse_traces
+from user_devices.PicoScope4000A.trace_storage import adc_scale_mv
+
+MAX_ADC = 32767
+RANGE_5V = 8 # range enum of the 5 V range
+
+
+def test_window_slice_relative_to_trigger():
+    # 10 ns samples, trigger at sample 100
+    assert window_slice(0.0, 1e-6, 100, 10.0, 1000) == slice(100, 200)
+    assert window_slice(-0.5e-6, 0.0, 100, 10.0, 1000) == slice(50, 100)
+    assert window_slice(None, None, 100, 10.0, 1000) == slice(0, 1000)
+
+
+def test_window_slice_clipped_to_trace():
+    assert window_slice(-1.0, 1.0, 100, 10.0, 1000) == slice(0, 1000)
+    assert window_slice(5e-6, 1e-6, 100, 10.0, 1000) == slice(600, 600) # stop before start: empty
+
+
+@pytest.mark.parametrize("operation, expected", [
+    ("mean", 10 / 6),
+    ("max", 10.0),
+    ("min", -4.0),
+    ("peak", 10.0),
+    ("rms", np.sqrt((1 + 4 + 16 + 100 + 1 + 16) / 6)),
+])
+def test_reduce_window(operation, expected):
+    segment = np.array([1, -2, 4, 10, 1, -4], dtype=np.int16)
+    assert reduce_window(segment, operation, 1.0, 10.0) == pytest.approx(expected)
+
+
+def test_reduce_window_integral_and_peak_time():
+    segment = np.array([0, 0, -7, 3], dtype=np.int16)
+    assert reduce_window(segment, "integral", 2.0, 100.0) == pytest.approx(-4 * 2.0 * 100e-9)
+    assert reduce_window(segment, "peak", 1.0, 100.0) == -7
+    assert reduce_window(segment, "peak_time", 1.0, 100.0, t0_s=1e-6) == pytest.approx(1e-6 + 2 * 100e-9)
+
+
+def test_reduce_window_crossings():
+    segment = np.array([0, 5, 0, 5, 5, 0], dtype=np.int16)
+    assert reduce_window(segment, "crossings", 1.0, 1.0, threshold_adc=2, direction="rising") == 2
+    assert reduce_window(segment, "crossings", 1.0, 1.0, threshold_adc=2, direction="falling") == 2
+    assert reduce_window(segment, "crossings", 1.0, 1.0, threshold_adc=2, direction="rising_or_falling") == 4
+
+
+def test_reduce_window_empty_and_invalid():
+    assert np.isnan(reduce_window(np.zeros(0, dtype=np.int16), "mean", 1.0, 1.0))
+    assert np.isnan(reduce_window(np.zeros((3, 0), dtype=np.int16), "mean", 1.0, 1.0)).all()
+    with pytest.raises(ValueError):
+        reduce_window(np.zeros(3, dtype=np.int16), "median", 1.0, 1.0)
+
+
+def window(name, channel, operation, start=None, stop=None, **kwargs):
+    return dict(name=name, channel=f"channel_{'ABCDEFGH'[channel]}", channel_number=channel, operation=operation,
+                start=start, stop=stop, **kwargs)
+
+
+def test_analyse_traces_stream_and_segments():
+    scale = float(adc_scale_mv(RANGE_5V, MAX_ADC))
+    data = np.zeros((2, 200), dtype=np.int16)
+    data[1, 100:110] = 1000 # pulse on channel 2 just after the trigger at 100
+    windows = [window("signal", 2, "mean", 0.0, 100e-9),
+               window("background", 2, "mean", None, 0.0),
+               window("missing", 5, "mean")]
+    results = analyse_traces(windows, data, [0, 2], {0: RANGE_5V, 2: RANGE_5V}, MAX_ADC, 100, 10.0)
+    assert results["signal"] == pytest.approx(1000 * scale)
+    assert results["background"] == 0.0
+    assert "missing" not in results
+
+    segments = np.stack([data, 2 * data, 3 * data]) # rapid block: one result per segment
+    results = analyse_traces(windows[:1], segments, [0, 2], {0: RANGE_5V, 2: RANGE_5V}, MAX_ADC, 100, 10.0)
+    np.testing.assert_allclose(results["signal"], np.array([1, 2, 3]) * 1000 * scale)
+
+
+def test_analyse_traces_threshold_in_mv():
+    scale = float(adc_scale_mv(RANGE_5V, MAX_ADC))
+    data = np.zeros((1, 100), dtype=np.int16)
+    data[0, 10:20] = 2000
+    data[0, 50:60] = 500
+    windows = [window("pulses", 0, "crossings", threshold=1000 * scale)]
+    results = analyse_traces(windows, data, [0], {0: RANGE_5V}, MAX_ADC, 0, 10.0)
+    assert results["pulses"] == 1
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from user_devices.PicoScope4000A.dsp import design_lowpass, PolyphaseDecimator, LockIn, StreamDsp
+from user_devices.PicoScope4000A.streaming import StreamBuffer
+
+
+def process_in_blocks(filt, data, sizes):
+    """Feed data through filt.process in blocks of the given sizes (the last one takes the rest), concatenated"""
+    outputs = []
+    start = 0
+    for size in sizes:
+        outputs.append(filt.process(data[:, start:start + size]))
+        start += size
+    outputs.append(filt.process(data[:, start:]))
+    if isinstance(outputs[0], tuple):
+        return tuple(np.concatenate(part, axis=1) for part in zip(*outputs))
+    return np.concatenate(outputs, axis=1)
+
+
+def test_lowpass_unit_dc_gain():
+    taps = design_lowpass(8, taps_per_phase=12)
+    assert len(taps) == 96
+    assert taps.sum() == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize("sizes", [[1000], [1, 2, 3, 997], [333, 333], [7] * 100, [64] * 15 + [41]])
+def test_decimator_block_size_invariance(sizes):
+    rng = np.random.default_rng(1)
+    data = rng.normal(size=(3, 1001)).astype(np.float32) # odd length, the final block is odd
+    reference = PolyphaseDecimator(3, 10).process(data)
+    out = process_in_blocks(PolyphaseDecimator(3, 10), data, sizes)
+    assert out.shape == reference.shape
+    np.testing.assert_allclose(out, reference, rtol=1e-5, atol=1e-5)
+
+
+def test_decimator_matches_direct_convolution():
+    rng = np.random.default_rng(2)
+    data = rng.normal(size=(1, 400))
+    taps = design_lowpass(4, taps_per_phase=6)
+    decimator = PolyphaseDecimator(1, 4, taps, dtype=np.float64)
+    out = decimator.process(data)
+    # output k is the filter response at input sample k * 4 + 3, zeros before the stream
+    full = np.convolve(data[0], taps)
+    expected = full[3::4][:out.shape[1]]
+    np.testing.assert_allclose(out[0], expected, atol=1e-12)
+
+
+def test_decimator_dc():
+    decimator = PolyphaseDecimator(2, 5)
+    out = decimator.process(np.full((2, 1000), 100.0))
+    # once the filter is filled with samples, DC passes unchanged
+    np.testing.assert_allclose(out[:, 20:], 100.0, rtol=1e-4)
+
+
+def test_lockin_amplitude_and_phase():
+    interval_ns = 100.0
+    frequency_hz = 50e3
+    n = 20000
+    t = np.arange(n) * interval_ns * 1e-9
+    amplitude, phase = 300.0, 0.7
+    data = (amplitude * np.cos(2 * np.pi * frequency_hz * t + phase))[None, :]
+    i, q = process_in_blocks(LockIn(1, 200, frequency_hz, interval_ns), data, [999, 3001, 57])
+    settled = slice(i.shape[1] // 2, None)
+    np.testing.assert_allclose(np.hypot(i, q)[0, settled], amplitude, rtol=1e-2)
+    np.testing.assert_allclose(np.arctan2(q, i)[0, settled], phase, atol=1e-2)
+
+
+def test_lockin_block_size_invariance():
+    rng = np.random.default_rng(3)
+    data = rng.normal(size=(2, 2049))
+    reference = LockIn(2, 16, 1e5, 80.0).process(data)
+    out = process_in_blocks(LockIn(2, 16, 1e5, 80.0), data, [100, 1, 1023])
+    for part, reference_part in zip(out, reference):
+        np.testing.assert_allclose(part, reference_part, rtol=1e-4, atol=1e-4)
+
+
+def test_stream_dsp_follows_the_buffer():
+    buffer = StreamBuffer()
+    buffer.allocate([0, 1], total_samples=1001, driver_buffer_size=1001)
+    rng = np.random.default_rng(4)
+    buffer.driver[:] = rng.integers(-1000, 1000, size=buffer.driver.shape)
+    dsp = StreamDsp(buffer, 100.0, 10, lockin_frequency_hz=1e5)
+    dsp.start()
+    buffer.start_capture(0, 0, 500)
+    buffer.append(500, 501)
+    n = dsp.finish(timeout=5)
+
+    reference = PolyphaseDecimator(2, 10, design_lowpass(10)).process(buffer.max_data.astype(np.float32))
+    assert n == reference.shape[1]
+    np.testing.assert_allclose(dsp.decimated[:, :n], reference, rtol=1e-4, atol=1e-2)
+    assert dsp.sample_interval == 1000.0
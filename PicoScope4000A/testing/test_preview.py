@@ -0,0 +1,55 @@
+import numpy as np
+
+from user_devices.PicoScope4000A.preview import minmax_envelope, preview_times, preview_index
+
+
+def test_short_trace_is_not_binned():
+    data = np.arange(20, dtype=np.int16).reshape(2, 10)
+    envelope, bin_size = minmax_envelope(data, max_bins=5)
+    assert envelope is data
+    assert bin_size == 1
+
+
+def test_envelope_keeps_spikes():
+    rng = np.random.default_rng(0)
+    data = rng.integers(-100, 100, size=(3, 10000)).astype(np.int16)
+    data[1, 4321] = 30000
+    data[2, 17] = -30000
+    envelope, bin_size = minmax_envelope(data, max_bins=100)
+    assert bin_size == 100
+    assert envelope.shape == (3, 200)
+    np.testing.assert_array_equal(envelope.max(axis=1), data.max(axis=1))
+    np.testing.assert_array_equal(envelope.min(axis=1), data.min(axis=1))
+    assert envelope[1, 2 * (4321 // bin_size) + 1] == 30000 # the max of the bin is at its odd index
+
+
+def test_incomplete_last_bin():
+    data = np.arange(1005, dtype=np.float32)[None, :]
+    envelope, bin_size = minmax_envelope(data, max_bins=100)
+    assert bin_size == 11
+    assert envelope.shape == (1, 2 * 92) # 91 full bins and one of 4 samples
+    assert envelope[0, -2] == 1001 and envelope[0, -1] == 1004
+
+
+def test_envelope_with_aggregate_minima():
+    data_max = np.full((1, 8), 5, dtype=np.int16)
+    data_min = np.full((1, 8), -5, dtype=np.int16)
+    data_min[0, 3] = -9
+    envelope, bin_size = minmax_envelope(data_max, max_bins=100, data_min=data_min) # binned although short
+    assert bin_size == 2
+    np.testing.assert_array_equal(envelope[0], [-5, 5, -9, 5, -5, 5, -5, 5])
+
+
+def test_segment_axis():
+    data = np.arange(2 * 3 * 1000, dtype=np.int16).reshape(2, 3, 1000)
+    envelope, bin_size = minmax_envelope(data, max_bins=10)
+    assert envelope.shape == (2, 3, 20)
+    assert envelope[1, 2, 1] == data[1, 2, bin_size - 1]
+
+
+def test_preview_time_axis_and_index():
+    times = preview_times(6, 10, 2.0)
+    np.testing.assert_array_equal(times, [0, 10, 20, 30, 40, 50])
+    np.testing.assert_array_equal(preview_times(3, 1, 2.0), [0, 2, 4])
+    assert preview_index(25, 10) == 4
+    assert preview_index(25, 1) == 25
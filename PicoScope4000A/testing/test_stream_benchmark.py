@@ -0,0 +1,15 @@
+"""Smoke test: short cases of the streaming benchmark, each capture checked sample by sample"""
+import pytest
+
+from user_devices.PicoScope4000A.testing.stream_benchmark import parse_args, run_case
+
+
+@pytest.mark.parametrize("n_channels", [1, 8])
+@pytest.mark.parametrize("units", ["adc", "mV"])
+def test_stream_benchmark(tmp_path, n_channels, units):
+    args = parse_args(["--duration-s", "0.2", "--units", units])
+    # a driver buffer of 20 ms: the 200 ms capture wraps around it ten times
+    result = run_case(args, n_channels, 1000, 20000, str(tmp_path / "shot.h5"))
+    assert result["samples_ready"] == result["samples"]
+    assert result["lost_samples"] == 0
+    assert result["callbacks"] > 10
@@ -0,0 +1,159 @@
+"""
+End to end: PicoScope4000A.run_stream / run_block on the simulated driver, then PicoScopeWorker.transition_to_manual
+writes the shot file. The simulated waveform is noise free here, so every stored sample can be checked against it.
+"""
+import h5py
+import numpy as np
+import pytest
+
+from user_devices.PicoScope4000A.blacs_workers import PicoScope4000A
+from user_devices.PicoScope4000A.simulation import SimulatedPs4000a
+from user_devices.PicoScope4000A.testing.stream_benchmark import make_worker
+
+CHANNEL_NAMES = [f"channel_{c}" for c in "ABCDEFGH"]
+RANGE_V = 5
+
+
+@pytest.fixture
+def pico():
+    pico = PicoScope4000A("SIM", driver=SimulatedPs4000a(first_pulse_s=0.01, noise=0.0))
+    yield pico
+    pico.stop_sampling_event.set()
+    if pico.fetching_thread is not None:
+        pico.fetching_thread.join(5)
+    pico.close_unit()
+
+
+def arm(pico, n_channels, first_pulse_s=None):
+    if first_pulse_s is not None:
+        pico.psa.first_pulse_s = first_pulse_s
+    for ch in range(8):
+        pico.set_channel(CHANNEL_NAMES[ch], "dc", RANGE_V, int(ch < n_channels), 0.0)
+    # the simulated pulses reach 60% of full scale
+    pico.set_simple_edge_trigger("channel_A", 0.3 * RANGE_V * 1e3, "rising", 0, 0)
+
+
+def shot(pico, tmp_path, storage_config):
+    path = str(tmp_path / "shot.h5")
+    with h5py.File(path, "w") as f:
+        f.require_group("/data/traces")
+    worker = make_worker(pico, path, "picoscope", storage_config)
+    assert pico.stop_sampling_event.wait(10), "the capture did not complete"
+    pico.fetching_thread.join(5)
+    worker.transition_to_manual()
+    return path
+
+
+def expected_capture(pico):
+    """The samples the capture must hold: from pre_trigger_samples before the trigger on, zeros for missing history"""
+    sim = pico.psa
+    buffer = pico.stream_buffer
+    pre, valid = buffer.pre_trigger_samples, buffer.pre_trigger_valid
+    expected = np.zeros((len(buffer.channels), buffer.total_samples), dtype=np.int16)
+    expected[:, pre - valid:], _ = sim._generate(sim.trigger_sample - valid, buffer.total_samples - pre + valid)
+    return expected
+
+
+@pytest.mark.parametrize("layout", ["samples_channels", "channels_samples"])
+def test_stream_shot_file(pico, tmp_path, layout):
+    arm(pico, 2)
+    # the driver buffer is much smaller than the capture, it wraps around several times
+    pico.run_stream(1000, 100000, max_pre_trigger_samples=500, driver_buffer_size=20000)
+    path = shot(pico, tmp_path, dict(units="adc", layout=layout))
+
+    assert pico.psa.lost_samples == 0
+    with h5py.File(path, "r") as f:
+        ds = f["/data/traces/picoscope"]
+        data = ds[()] if layout == "channels_samples" else ds[()].T
+        assert data.shape == (2, 100500)
+        np.testing.assert_array_equal(data, expected_capture(pico))
+        assert ds.attrs["layout"] == layout
+        assert ds.attrs["units"] == "adc"
+        assert ds.attrs["triggered_at"] == 500
+        assert ds.attrs["pre_trigger_samples_valid"] == 500
+        assert ds.attrs["samples_valid"] == 100500
+        assert ds.attrs["sample_interval"] == 1000.0
+        assert list(ds.attrs["channel_names"]) == ["channel_A", "channel_B"]
+        assert ds.attrs["stream_callbacks"] > 1
+        # the trigger sample crosses the threshold on channel A
+        threshold = 0.3 * 32767
+        assert data[0, 499] < threshold <= data[0, 500]
+
+
+def test_stream_shot_in_millivolts(pico, tmp_path):
+    arm(pico, 1)
+    pico.run_stream(1000, 40000, driver_buffer_size=20000)
+    path = shot(pico, tmp_path, dict(units="mV"))
+    with h5py.File(path, "r") as f:
+        ds = f["/data/traces/picoscope"]
+        assert ds.dtype == np.float32
+        np.testing.assert_allclose(ds[:, 0], expected_capture(pico)[0] * (RANGE_V * 1e3 / 32767), rtol=1e-5)
+
+
+def test_trigger_in_first_callback(pico, tmp_path):
+    # the first pulse comes 20 µs after the start: the trigger is in the first callback, with little history
+    arm(pico, 2, first_pulse_s=20e-6)
+    pico.run_stream(1000, 50000, max_pre_trigger_samples=1000, driver_buffer_size=20000)
+    path = shot(pico, tmp_path, dict(units="adc"))
+
+    assert pico.psa.lost_samples == 0
+    with h5py.File(path, "r") as f:
+        ds = f["/data/traces/picoscope"]
+        valid = ds.attrs["pre_trigger_samples_valid"]
+        assert valid < 1000
+        assert ds.attrs["triggered_at"] == 1000
+        data = ds[()].T
+        np.testing.assert_array_equal(data[:, :1000 - valid], 0)
+        np.testing.assert_array_equal(data, expected_capture(pico))
+
+
+def test_shot_aborted_before_the_trigger(pico, tmp_path):
+    arm(pico, 2, first_pulse_s=10.0)
+    pico.run_stream(1000, 5000, max_pre_trigger_samples=500)
+    path = str(tmp_path / "shot.h5")
+    with h5py.File(path, "w") as f:
+        f.require_group("/data/traces")
+    worker = make_worker(pico, path, "picoscope", dict(units="adc"))
+    worker.abort_transition_to_buffered()
+
+    with h5py.File(path, "r") as f:
+        group = f["/data/traces"]
+        assert "picoscope" not in group
+        assert group.attrs["picoscope_triggered"] == False
+
+
+def test_aggregate_shot_file(pico, tmp_path):
+    arm(pico, 2)
+    pico.run_stream(100, 20000, downsample_ratio=10, downsample_ratio_mode="aggregate", driver_buffer_size=1000)
+    path = shot(pico, tmp_path, dict(units="adc"))
+    with h5py.File(path, "r") as f:
+        maxima, minima = f["/data/traces/picoscope"], f["/data/traces/picoscope_min"]
+        assert maxima.shape == minima.shape == (2000, 2)
+        assert (maxima[()] >= minima[()]).all()
+        assert maxima.attrs["downsample_ratio"] == 10
+        assert minima.attrs["derived_from"] == "picoscope"
+
+
+def test_block_shot_file(pico, tmp_path):
+    arm(pico, 2)
+    pico.run_block(100, 100, 400, n_segments=3)
+    path = shot(pico, tmp_path, dict(units="adc"))
+    with h5py.File(path, "r") as f:
+        ds = f["/data/traces/picoscope"]
+        assert ds.shape == (3, 2, 500)
+        assert ds.attrs["n_segments"] == 3
+        assert ds.attrs["triggered_at"] == 100
+        # every segment is centred on a pulse
+        assert (ds[:, 0, 100:110].max(axis=-1) > 0.5 * 32767).all()
+
+
+def test_stream_after_block_resets_segments(pico, tmp_path):
+    arm(pico, 2)
+    pico.run_block(100, 100, 400, n_segments=3)
+    shot(pico, tmp_path, dict(units="adc"))
+    assert pico.psa.n_segments == 3
+    pico.run_stream(1000, 40000, driver_buffer_size=20000)
+    assert pico.psa.n_segments == pico.psa.n_captures == 1
+    path = shot(pico, tmp_path, dict(units="adc"))
+    with h5py.File(path, "r") as f:
+        np.testing.assert_array_equal(f["/data/traces/picoscope"][()].T, expected_capture(pico))
@@ -0,0 +1,176 @@
+import numpy as np
+import pytest
+
+from user_devices.PicoScope4000A.streaming import RingBuffer, StreamBuffer
+
+
+def ramp(n_channels, start, n):
+    """(channels, n) block whose value is the absolute sample index, row i offset by 1000 * i"""
+    return (np.arange(start, start + n)[None, :] + 1000 * np.arange(n_channels)[:, None]).astype(np.int16)
+
+
+class DriverFeed(object):
+    """Feeds a ramp through the driver buffers of a StreamBuffer like the streaming callbacks do, wrapping around"""
+    def __init__(self, stream_buffer):
+        self.stream_buffer = stream_buffer
+        self.produced = 0
+        self.write_pos = 0
+
+    def next_block(self, n):
+        driver = self.stream_buffer.driver
+        if self.write_pos + n > driver.shape[1]:
+            self.write_pos = 0
+        start = self.write_pos
+        driver[:, start:start + n] = ramp(driver.shape[0], self.produced, n)
+        self.produced += n
+        self.write_pos += n
+        return start
+
+
+def test_ring_buffer_wrap_around():
+    ring = RingBuffer(2, 5)
+    ring.write(ramp(2, 0, 3))
+    ring.write(ramp(2, 3, 4)) # wraps around
+    out = np.full((2, 5), -1, dtype=np.int16)
+    assert ring.read_into(out) == 5
+    np.testing.assert_array_equal(out, ramp(2, 2, 5))
+    assert ring.count == 5
+
+
+def test_ring_buffer_block_larger_than_size():
+    ring = RingBuffer(1, 4)
+    ring.write(ramp(1, 0, 10))
+    out = np.zeros((1, 4), dtype=np.int16)
+    ring.read_into(out)
+    np.testing.assert_array_equal(out, ramp(1, 6, 4))
+
+
+def test_ring_buffer_read_into_longer_output():
+    ring = RingBuffer(1, 8)
+    ring.write(ramp(1, 0, 3))
+    out = np.full((1, 5), -1, dtype=np.int16)
+    assert ring.read_into(out) == 3
+    np.testing.assert_array_equal(out, [[-1, -1, 0, 1, 2]]) # the newest sample last
+
+
+def test_pre_trigger_splice_after_wrap_around():
+    buffer = StreamBuffer()
+    buffer.allocate([0, 1], total_samples=50, driver_buffer_size=16, pre_trigger_samples=10)
+    feed = DriverFeed(buffer)
+    # several callbacks before the trigger, the history wraps around more than once
+    for n in (7, 9, 5, 11):
+        buffer.record_history(feed.next_block(n), n)
+    trigger = feed.produced + 4
+    start = feed.next_block(13)
+    buffer.start_capture(start, 4, 13)
+    while not buffer.is_complete:
+        start = feed.next_block(9)
+        buffer.append(start, 9)
+
+    assert buffer.pre_trigger_valid == 10
+    np.testing.assert_array_equal(buffer.max_data, ramp(2, trigger - 10, 50))
+
+
+def test_trigger_in_first_callback():
+    buffer = StreamBuffer()
+    buffer.allocate([3], total_samples=30, driver_buffer_size=64, pre_trigger_samples=10)
+    feed = DriverFeed(buffer)
+    start = feed.next_block(40)
+    buffer.start_capture(start, 6, 40) # only 6 samples of history exist
+
+    assert buffer.pre_trigger_valid == 6
+    np.testing.assert_array_equal(buffer.data[:, :4], 0)
+    np.testing.assert_array_equal(buffer.data[:, 4:], ramp(1, 0, 26))
+    # 10 + 34 samples for a capture of 30
+    assert buffer.truncated == 14
+    assert buffer.samples_ready == 30
+
+
+def test_odd_final_block_is_truncated():
+    buffer = StreamBuffer()
+    buffer.allocate([0], total_samples=25, driver_buffer_size=16)
+    feed = DriverFeed(buffer)
+    start = feed.next_block(16)
+    buffer.start_capture(start, 0, 16)
+    assert buffer.append(feed.next_block(7), 7) == 0
+    assert buffer.append(feed.next_block(5), 5) == 3 # odd-length final block, 3 samples beyond the capture
+
+    assert buffer.is_complete
+    assert buffer.truncated == 3
+    np.testing.assert_array_equal(buffer.data, ramp(1, 0, 25))
+
+
+def test_aggregate_rows():
+    buffer = StreamBuffer()
+    buffer.allocate([0, 2], total_samples=10, driver_buffer_size=10, aggregate=True)
+    assert buffer.data.shape == (4, 10)
+    assert list(buffer.driver_rows()) == [0, 2]
+    assert buffer.driver_min_rows()[2] is not None
+    assert buffer.min_data.shape == (2, 10)
+
+
+def test_reallocation_only_on_change():
+    buffer = StreamBuffer()
+    buffer.allocate([0, 1], 100, 20)
+    data = buffer.data
+    buffer.allocate([0, 1], 100, 20)
+    assert buffer.data is data
+    buffer.allocate([0, 1, 2], 100, 20)
+    assert buffer.data.shape == (3, 100)
+
+
+def test_wait_for_samples_wakes_on_append():
+    import threading
+    buffer = StreamBuffer()
+    buffer.allocate([0], 100, 100)
+    results = []
+    consumers = [threading.Thread(target=lambda: results.append(buffer.wait_for_samples(10, timeout=5)))
+                 for _ in range(2)]
+    for consumer in consumers:
+        consumer.start()
+    buffer.driver[:] = 1
+    buffer.start_capture(0, 0, 20)
+    for consumer in consumers:
+        consumer.join(5)
+    assert results == [20, 20]
+
+
+@pytest.mark.parametrize("n_channels", [1, 8])
+def test_spill_file_capture(tmp_path, n_channels):
+    buffer = StreamBuffer()
+    buffer.allocate(list(range(n_channels)), 40, 16, spill_dir=str(tmp_path))
+    assert isinstance(buffer.data, np.memmap)
+    feed = DriverFeed(buffer)
+    buffer.start_capture(feed.next_block(16), 0, 16)
+    while not buffer.is_complete:
+        buffer.append(feed.next_block(16), 16)
+    np.testing.assert_array_equal(buffer.data, ramp(n_channels, 0, 40))
+
+
+def test_release_deletes_the_spill_file(tmp_path):
+    buffer = StreamBuffer()
+    buffer.allocate([0, 1], 40, 16, spill_dir=str(tmp_path))
+    mapping = buffer.data._mmap
+    buffer.release()
+    assert mapping.closed
+    assert buffer.data is None and buffer.spill_file is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_release_retries_a_spill_file_it_could_not_delete(tmp_path, monkeypatch):
+    buffer = StreamBuffer()
+    buffer.allocate([0], 40, 16, spill_dir=str(tmp_path))
+    view = buffer.rows()[0] # keeps the file mapped, as on Windows the file cannot be deleted then
+
+    def locked(path):
+        raise PermissionError(13, "The process cannot access the file", path)
+    with monkeypatch.context() as patch:
+        patch.setattr("os.remove", locked)
+        buffer.release()
+    assert len(buffer.stale_spill_files) == 1
+    assert len(list(tmp_path.iterdir())) == 1
+
+    del view
+    buffer.release()
+    assert buffer.stale_spill_files == []
+    assert list(tmp_path.iterdir()) == []
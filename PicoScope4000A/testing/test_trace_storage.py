@@ -0,0 +1,84 @@
+import h5py
+import numpy as np
+import pytest
+
+from user_devices.PicoScope4000A.trace_storage import (adc_to_mv, trace_attributes, trace_layout, write_trace_blocks,
+                                                       read_channel, traces_to_mv, capture_names, CHANNEL_RANGES_MV)
+
+MAX_ADC = 32767
+RANGES = [8, 5, 11] # 5 V, 500 mV, 50 V
+
+
+@pytest.fixture
+def data_adc():
+    rng = np.random.default_rng(0)
+    return rng.integers(-MAX_ADC, MAX_ADC, size=(3, 1001)).astype(np.int16) # (channels, samples)
+
+
+def test_trace_layout():
+    assert trace_layout(1000, 4) == ((1000, 4), (1000, 4))
+    assert trace_layout(10 ** 6, 4, chunk_samples=1000) == ((10 ** 6, 4), (1000, 4))
+    assert trace_layout(10 ** 6, 4, 'channels_samples', chunk_samples=1000) == ((4, 10 ** 6), (1, 1000))
+    assert trace_layout(10 ** 6, 4, 'channels_samples', 1000, chunk_channels=2) == ((4, 10 ** 6), (2, 1000))
+    with pytest.raises(ValueError):
+        trace_layout(10, 1, 'samples')
+
+
+def test_adc_to_mv_per_channel(data_adc):
+    data_mv = adc_to_mv(data_adc, RANGES, MAX_ADC)
+    for i, range_index in enumerate(RANGES):
+        np.testing.assert_allclose(data_mv[i], data_adc[i] * CHANNEL_RANGES_MV[range_index] / MAX_ADC, rtol=1e-6)
+    np.testing.assert_allclose(adc_to_mv(data_adc.T, RANGES, MAX_ADC, axis=1), data_mv.T)
+    offsets_mv = adc_to_mv(data_adc, RANGES, MAX_ADC, analog_offsets_v=[0.1, 0.0, -1.0])
+    np.testing.assert_allclose(offsets_mv[2], data_mv[2] + 1000.0, rtol=1e-5)
+
+
+def write_traces(f, name, data_adc, layout, units, chunk_samples=100):
+    shape, chunks = trace_layout(data_adc.shape[1], data_adc.shape[0], layout, chunk_samples)
+    dtype = np.int16 if units == "adc" else np.float32
+    convert = None if units == "adc" else (lambda block: adc_to_mv(block, RANGES, MAX_ADC))
+    ds = f.create_dataset(name, shape=shape, dtype=dtype, chunks=chunks)
+    write_trace_blocks(ds, data_adc, 0, data_adc.shape[1], chunk_samples, convert, layout)
+    ds.attrs["layout"] = layout
+    ds.attrs["channel_names"] = np.array(["channel_A", "channel_B", "channel_C"], dtype=h5py.string_dtype())
+    for key, value in trace_attributes(RANGES, MAX_ADC, [0.0] * 3, units).items():
+        ds.attrs[key] = value
+    return ds
+
+
+@pytest.mark.parametrize("layout", ["samples_channels", "channels_samples"])
+@pytest.mark.parametrize("units", ["adc", "mV"])
+def test_read_channel(tmp_path, data_adc, layout, units):
+    expected = adc_to_mv(data_adc, RANGES, MAX_ADC)
+    with h5py.File(tmp_path / "shot.h5", "w") as f:
+        ds = write_traces(f, "picoscope", data_adc, layout, units)
+        stored = ds[()] if layout == "channels_samples" else ds[()].T
+        if units == "adc":
+            np.testing.assert_array_equal(stored, data_adc)
+        np.testing.assert_allclose(read_channel(ds, "channel_B"), expected[1], rtol=1e-6)
+        np.testing.assert_allclose(read_channel(ds, 2, 100, 301), expected[2, 100:301], rtol=1e-6)
+        mv = traces_to_mv(ds)
+        np.testing.assert_allclose(mv if layout == "channels_samples" else mv.T, expected, rtol=1e-6)
+
+
+def test_read_channel_segments(tmp_path):
+    rng = np.random.default_rng(1)
+    segments = rng.integers(-1000, 1000, size=(4, 3, 50)).astype(np.int16)
+    with h5py.File(tmp_path / "shot.h5", "w") as f:
+        ds = f.create_dataset("picoscope", data=segments)
+        for key, value in trace_attributes(RANGES, MAX_ADC, [0.0] * 3, "adc").items():
+            ds.attrs[key] = value
+        ds.attrs["channel_names"] = np.array(["channel_A", "channel_B", "channel_C"], dtype=h5py.string_dtype())
+        channel = read_channel(ds, "channel_C", 10, 20)
+        assert channel.shape == (4, 10)
+        np.testing.assert_allclose(channel, adc_to_mv(segments[:, 2, 10:20], RANGES[2], MAX_ADC))
+        np.testing.assert_allclose(traces_to_mv(ds), adc_to_mv(segments, RANGES, MAX_ADC, axis=1))
+
+
+def test_capture_names(tmp_path, data_adc):
+    with h5py.File(tmp_path / "shot.h5", "w") as f:
+        group = f.create_group("/data/traces")
+        write_traces(group, "picoscope", data_adc, "samples_channels", "adc")
+        write_traces(group, "picoscope_min", data_adc, "samples_channels", "adc").attrs["derived_from"] = "picoscope"
+        write_traces(group, "other_decimated", data_adc, "samples_channels", "mV") # its capture was not stored
+        assert sorted(capture_names(group)) == ["other_decimated", "picoscope"]
@@ -0,0 +1,263 @@
+import threading
+import time
+import h5py
+import numpy as np
+
+# Input ranges in mV, indexed by the PicoScope range enum (PS4000A_10MV = 0 ... PS4000A_200V = 13)
+CHANNEL_RANGES_MV = np.array([10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000, 200000],
+                             dtype=np.float64)
+
+TRACE_UNITS = ['mV', 'adc']
+# 'samples_channels': one (samples x channels) dataset, 'channels_samples': one (channels x samples) dataset,
+# chunked one channel at a time by default so that a single channel is read without touching the others
+TRACE_LAYOUTS = ['samples_channels', 'channels_samples']
+DEFAULT_CHUNK_SAMPLES = 1 << 16 # samples per chunk of the traces dataset
+# datasets the worker writes next to /data/traces/<device>: aggregate minima and the DSP outputs
+DERIVED_TRACE_SUFFIXES = ('_min', '_decimated', '_lockin_i', '_lockin_q')
+
+
+def adc_scale_mv(channel_ranges, max_adc) -> np.ndarray:
+    """
+    Millivolts per ADC count for each channel.
+    :param channel_ranges: range enum (int) or sequence of range enums, one per channel
+    :param max_adc: maximum ADC count of the unit
+    """
+    return CHANNEL_RANGES_MV[np.asarray(channel_ranges, dtype=np.intp)] / float(max_adc)
+
+
+def adc_to_mv(data_adc, channel_ranges, max_adc, analog_offsets_v=None, axis=0, dtype=np.float32):
+    """
+    Vectorised conversion of raw ADC counts to millivolts.
+
+    :param data_adc: int16 counts, either 1-D for a single channel or N-D with the channels along `axis`
+    :param channel_ranges: range enum (int) for 1-D data, or one range enum per channel
+    :param max_adc: maximum ADC count of the unit (attribute 'max_adc' of the traces dataset)
+    :param analog_offsets_v: optional analogue offset per channel in V. The offset is added to the input
+        before digitisation, so it is subtracted here to recover the input voltage.
+    :param axis: axis of data_adc that enumerates the channels
+    :param dtype: floating point type of the result
+    :return: array of the same shape as data_adc in mV
+    """
+    data_adc = np.asarray(data_adc)
+    scale = adc_scale_mv(channel_ranges, max_adc).astype(dtype)
+    offset = None
+    if analog_offsets_v is not None:
+        offset = (np.asarray(analog_offsets_v, dtype=np.float64) * 1e3).astype(dtype)
+
+    if scale.ndim > 0 and data_adc.ndim > 1:
+        # broadcast the per-channel constants along the channel axis
+        shape = [1] * data_adc.ndim
+        shape[axis] = scale.shape[0]
+        scale = scale.reshape(shape)
+        if offset is not None:
+            offset = offset.reshape(shape)
+
+    data_mv = np.multiply(data_adc, scale, dtype=dtype)
+    if offset is not None:
+        data_mv -= offset
+    return data_mv
+
+
+def trace_attributes(channel_ranges, max_adc, analog_offsets_v, units) -> dict:
+    """Per-channel scale/offset attributes stored next to the traces, enough to convert raw counts to mV."""
+    return dict(units=units,
+                max_adc=int(max_adc),
+                channel_ranges=np.asarray(channel_ranges, dtype=np.int32),
+                channel_ranges_mv=CHANNEL_RANGES_MV[np.asarray(channel_ranges, dtype=np.intp)],
+                analog_offsets_v=np.asarray(analog_offsets_v, dtype=np.float64),
+                scale_mv=adc_scale_mv(channel_ranges, max_adc))
+
+
+def capture_names(traces_group) -> list:
+    """
+    Names of the captures in /data/traces, one per device, without the datasets derived from them
+    (<device>_min, <device>_decimated, ...). A derived dataset whose capture was not stored (DSP with store_raw=False)
+    is kept, it is the only trace of its device.
+    """
+    names = []
+    for name in traces_group.keys():
+        source = traces_group[name].attrs.get("derived_from")
+        if source is None: # written before the attribute existed
+            source = next((name[:-len(suffix)] for suffix in DERIVED_TRACE_SUFFIXES if name.endswith(suffix)), None)
+        if source is None or source not in traces_group:
+            names.append(name)
+    return names
+
+
+def traces_to_mv(traces_ds, data=None):
+    """
+    Read a traces dataset as millivolts, whichever units it was stored in: (samples x channels) or
+    (channels x samples) for streaming, (segments x channels x samples) for rapid block mode.
+    Like the 'mV' storage mode, the analogue offset is not removed.
+    :param traces_ds: h5py dataset from /data/traces/<device>
+    :param data: optionally, already read data of the dataset (e.g. a time slice)
+    """
+    if data is None:
+        data = traces_ds[()]
+    if traces_ds.attrs.get("units", "mV") != "adc":
+        return data
+    if traces_ds.ndim == 3:
+        axis = 1
+    else:
+        axis = 0 if traces_ds.attrs.get("layout", "samples_channels") == "channels_samples" else -1
+    return adc_to_mv(data, traces_ds.attrs["channel_ranges"], traces_ds.attrs["max_adc"], axis=axis)
+
+
+def read_channel(traces_ds, channel, start=None, stop=None):
+    """
+    Read one channel of a traces dataset as millivolts, whatever its layout and units. Only the chunks holding that
+    channel and sample range are read and decompressed.
+    :param traces_ds: h5py dataset from /data/traces/<device>
+    :param channel: channel name (attribute 'channel_names') or index
+    :param start: first sample, None = from the start
+    :param stop: end sample (exclusive), None = to the end
+    :return: (samples,) or, for rapid block mode, (segments, samples)
+    """
+    if not isinstance(channel, (int, np.integer)):
+        names = [name.decode() if isinstance(name, bytes) else str(name) for name in traces_ds.attrs["channel_names"]]
+        channel = names.index(channel)
+    span = slice(start, stop)
+    if traces_ds.ndim == 3:
+        data = traces_ds[:, channel, span]
+    elif traces_ds.attrs.get("layout", "samples_channels") == "channels_samples":
+        data = traces_ds[channel, span]
+    else:
+        data = traces_ds[span, channel]
+    if traces_ds.attrs.get("units", "mV") != "adc":
+        return data
+    return adc_to_mv(data, int(traces_ds.attrs["channel_ranges"][channel]), traces_ds.attrs["max_adc"])
+
+
+def dataset_chunks(n_samples, n_channels, chunk_samples=DEFAULT_CHUNK_SAMPLES, chunk_channels=None):
+    """Chunk shape of a (samples x channels) traces dataset, clipped to the dataset shape."""
+    chunk_samples = max(1, min(int(chunk_samples), int(n_samples)))
+    n_channels = max(int(n_channels), 1)
+    chunk_channels = n_channels if chunk_channels is None else max(1, min(int(chunk_channels), n_channels))
+    return chunk_samples, chunk_channels
+
+
+def trace_layout(n_samples, n_channels, layout='samples_channels', chunk_samples=DEFAULT_CHUNK_SAMPLES,
+                 chunk_channels=None):
+    """
+    Shape and chunk shape of a traces dataset in the given layout.
+    :param chunk_channels: channels per chunk, default all channels for 'samples_channels' and 1 for 'channels_samples'
+    :return: (shape, chunks), both in dataset order
+    """
+    if layout not in TRACE_LAYOUTS:
+        raise ValueError(f"Invalid layout: {layout}. Allowed values: {TRACE_LAYOUTS}")
+    if layout == 'channels_samples':
+        chunk_samples, chunk_channels = dataset_chunks(n_samples, n_channels, chunk_samples,
+                                                       1 if chunk_channels is None else chunk_channels)
+        return (int(n_channels), int(n_samples)), (chunk_channels, chunk_samples)
+    return (int(n_samples), int(n_channels)), dataset_chunks(n_samples, n_channels, chunk_samples, chunk_channels)
+
+
+def write_trace_blocks(ds, data, start: int, stop: int, chunk_samples: int, convert=None, layout='samples_channels'):
+    """
+    Write samples [start, stop) of (channels, samples) data into a traces dataset, one chunk of samples at a time,
+    so that at most one converted chunk is held in memory (e.g. for a memory-mapped capture).
+    :param convert: optional callable converting a (channels, samples) block of ADC counts to the dataset dtype
+    :param layout: layout of the dataset, 'channels_samples' is written without transposing
+    """
+    chunk_samples = max(1, int(chunk_samples))
+    for block_start in range(start, stop, chunk_samples):
+        block_stop = min(block_start + chunk_samples, stop)
+        block = data[:, block_start:block_stop]
+        if convert is not None:
+            block = convert(block)
+        if layout == 'channels_samples':
+            ds[:, block_start:block_stop] = block
+        else:
+            ds[block_start:block_stop, :] = block.T
+
+
+class TraceWriter(object):
+    """
+    Writes a streaming capture into its pre-created, chunked dataset in /data/traces/<device> (see TRACE_LAYOUTS)
+    while the capture is still running.
+
+    A background thread waits for new samples in the StreamBuffer and appends every completed chunk straight from
+    the buffer (no intermediate copies are queued), converting it on the way if the traces are stored in mV.
+    `finish` only has to flush the incomplete tail chunk, and shrinks the dataset to the samples actually captured
+    if the capture ended early.
+    """
+    def __init__(self, h5_file, device_name, stream_buffer, dtype=np.int16, convert=None,
+                 chunk_samples=DEFAULT_CHUNK_SAMPLES, chunk_channels=None, filters=None, layout='samples_channels'):
+        """
+        :param h5_file: path of the shot file
+        :param device_name: name of the dataset in /data/traces
+        :param stream_buffer: the StreamBuffer the capture is written to
+        :param dtype: dtype of the dataset
+        :param convert: optional callable converting a (channels, samples) block of ADC counts to `dtype`
+        :param chunk_samples: number of samples per chunk, which is also the unit of writing
+        :param chunk_channels: number of channels per chunk, default all
+        :param filters: create_dataset keyword arguments of the filter pipeline, see hdf5_filters.compression_kwargs
+        :param layout: one of TRACE_LAYOUTS
+        """
+        self.h5_file = h5_file
+        self.dataset_path = f'/data/traces/{device_name}'
+        self.stream_buffer = stream_buffer
+        self.dtype = dtype
+        self.convert = convert
+        self.chunk_samples = max(1, min(int(chunk_samples), stream_buffer.total_samples))
+        self.layout = layout
+        self.shape, self.chunks = trace_layout(stream_buffer.total_samples, len(stream_buffer.channels), layout,
+                                               chunk_samples, chunk_channels)
+        self.filters = dict(compression='gzip') if filters is None else filters
+
+        self.written = 0 # samples already in the file
+        self.write_time_s = 0.0
+        self._finishing = threading.Event()
+        self._thread = None
+        self._error = None
+
+    def start(self):
+        with h5py.File(self.h5_file, 'r+') as f:
+            f.require_group('/data/traces')
+            f.create_dataset(self.dataset_path,
+                             shape=self.shape,
+                             dtype=self.dtype,
+                             chunks=self.chunks,
+                             maxshape=self._maxshape(),
+                             **self.filters)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _maxshape(self):
+        """the sample axis is resizable, for captures that end before total_samples"""
+        if self.layout == 'channels_samples':
+            return (self.shape[0], None)
+        return (None, self.shape[1])
+
+    def _run(self):
+        stream_buffer = self.stream_buffer
+        try:
+            while not self._finishing.is_set():
+                ready = stream_buffer.wait_for_samples(self.written + self.chunk_samples, timeout=0.1)
+                self._write_until(ready - ready % self.chunk_samples) # complete chunks only
+            self._write_until(self.stream_buffer.samples_ready) # tail
+        except Exception as e:
+            self._error = e
+
+    def _write_until(self, end):
+        if end <= self.written:
+            return
+        t0 = time.perf_counter()
+        with h5py.File(self.h5_file, 'r+') as f:
+            write_trace_blocks(f[self.dataset_path], self.stream_buffer.max_data, self.written, end,
+                               self.chunk_samples, self.convert, self.layout)
+        self.written = end
+        self.write_time_s += time.perf_counter() - t0
+
+    def finish(self, timeout=None):
+        """Flush the remaining samples and stop the thread. Raises if writing failed."""
+        self._finishing.set()
+        self.stream_buffer.wake()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._error is not None:
+            raise self._error
+        if self.written < self.stream_buffer.total_samples:
+            with h5py.File(self.h5_file, 'r+') as f:
+                f[self.dataset_path].resize(self.written, axis=1 if self.layout == 'channels_samples' else 0)
+        return self.written
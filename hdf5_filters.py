@@ -0,0 +1,47 @@
+"""HDF5 compression filters shared by the devices that write bulk data (traces, images) into the shot files."""
+from user_devices.logger_config import logger
+
+try:
+    import hdf5plugin # registers the Blosc filter with HDF5
+except ImportError:
+    hdf5plugin = None
+
+COMPRESSIONS = ['none', 'lzf', 'gzip', 'blosc-lz4']
+
+
+def check_compression(compression, level=None):
+    """Raise ValueError for an unknown codec or level, to be used when compiling the shot."""
+    compression = 'none' if compression is None else str(compression).lower()
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Invalid compression: {compression}. Allowed values: {COMPRESSIONS}")
+    if level is not None:
+        if compression == 'gzip' and not 0 <= int(level) <= 9:
+            raise ValueError(f"Invalid gzip level: {level}. Expected 0..9")
+        if compression == 'blosc-lz4' and not 0 <= int(level) <= 9:
+            raise ValueError(f"Invalid blosc level: {level}. Expected 0..9")
+    return compression
+
+
+def compression_kwargs(compression='gzip', level=None, shuffle=False) -> dict:
+    """
+    Keyword arguments for h5py's create_dataset selecting the given filter pipeline.
+
+    :param compression: 'none', 'lzf', 'gzip' or 'blosc-lz4'. 'blosc-lz4' needs the hdf5plugin package
+        and falls back to 'lzf' if it is not installed.
+    :param level: gzip level 0..9 (default 4) or blosc clevel 0..9 (default 5)
+    :param shuffle: byte-shuffle before compressing, usually improves the ratio of int16/float32 samples
+    """
+    compression = check_compression(compression, level)
+
+    if compression == 'blosc-lz4':
+        if hdf5plugin is not None:
+            blosc_shuffle = hdf5plugin.Blosc.SHUFFLE if shuffle else hdf5plugin.Blosc.NOSHUFFLE
+            return dict(hdf5plugin.Blosc(cname='lz4', clevel=5 if level is None else int(level), shuffle=blosc_shuffle))
+        logger.warning("hdf5plugin is not installed, falling back from blosc-lz4 to lzf compression")
+        compression = 'lzf'
+
+    if compression == 'none':
+        return {}
+    if compression == 'lzf':
+        return dict(compression='lzf', shuffle=bool(shuffle))
+    return dict(compression='gzip', compression_opts=4 if level is None else int(level), shuffle=bool(shuffle))
@@ -3,6 +3,7 @@ from lyse import *
 from pylab import *
 import pyqtgraph as pg
 from qtutils.qt import QtWidgets, QtGui, QtCore
+from user_devices.PicoScope4000A.trace_storage import read_channel, capture_names
 
 
 df = data()
@@ -28,11 +29,18 @@ for path in df['filepath']:
                     titles.append(f"{orientation}/{label}/{image_name}")
 
         traces = {}
-        for picoscope in shot.trace_names():
+        # one capture per picoscope, the derived datasets (<device>_min, DSP outputs) are skipped
+        for picoscope in capture_names(shot.h5_file.get('data/traces', {})):
             traces_ds = shot.h5_file['data']['traces'][picoscope]
             traces_names = traces_ds.attrs["channel_names"]
-            data_array = traces_ds[()]
-            traces[picoscope] = {name: data_array[:, i] for i, name in enumerate(traces_names)}
+            traces[picoscope] = {}
+            # one channel at a time, only its chunks are read (fast with layout='channels_samples')
+            for i, name in enumerate(traces_names):
+                y = read_channel(traces_ds, i)
+                if y.ndim == 2: # rapid block mode: (segments, samples), one trace per segment
+                    traces[picoscope].update({f"{name}[{k}]": segment for k, segment in enumerate(y)})
+                else:
+                    traces[picoscope][name] = y
 
     shots_data.append({
         'path': path,
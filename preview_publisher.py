@@ -0,0 +1,90 @@
+"""Non-blocking publication of previews (traces, images) from a BLACS worker to the receiver of its tab."""
+import threading
+
+import numpy as np
+import zmq
+from labscript_utils.ls_zprocess import Context
+
+from user_devices.logger_config import logger
+
+
+class PreviewPublisher(object):
+    """
+    Sends previews to the tab's ZMQServer (the usual REQ/'ok' protocol) from a background thread.
+
+    `publish` never waits for the GUI: it only replaces the single pending preview, so a slow or minimised BLACS
+    window drops intermediate previews instead of delaying the shot. Only the newest preview is ever shown.
+    `dropped` counts the previews replaced before they could be sent.
+    """
+    def __init__(self, host, port, name="preview"):
+        """
+        :param host: parent host of the worker
+        :param port: port of the tab's receiver, None disables the publisher
+        :param name: used in the log messages
+        """
+        self.address = None if port is None else f'tcp://{host}:{port}'
+        self.name = name
+        self.published = 0
+        self.sent = 0
+        self.dropped = 0
+
+        self._pending = None # (metadata, array) waiting to be sent, latest only
+        self._condition = threading.Condition()
+        self._closing = False
+        self._thread = None
+        if self.address is not None:
+            self._thread = threading.Thread(target=self._run, name=f"{name}-publisher", daemon=True)
+            self._thread.start()
+
+    def publish(self, metadata: dict, array, copy=False):
+        """
+        Queue a preview, replacing the one still waiting to be sent. Returns immediately.
+        :param metadata: json-serialisable dict sent as the first frame, dtype and shape are added
+        :param array: numpy array sent as the second frame
+        :param copy: copy the array, required if the caller reuses its memory (e.g. a frame pool)
+        """
+        if self._thread is None:
+            return
+        array = np.array(array, copy=True) if copy else np.ascontiguousarray(array)
+        metadata = dict(metadata, dtype=str(array.dtype), shape=array.shape)
+        with self._condition:
+            if self._pending is not None:
+                self.dropped += 1
+            self._pending = (metadata, array)
+            self.published += 1
+            self._condition.notify()
+
+    def _run(self):
+        # the socket is created and used only in this thread, zmq sockets are not thread safe
+        socket = Context().socket(zmq.REQ)
+        socket.connect(self.address)
+        try:
+            while True:
+                with self._condition:
+                    while self._pending is None and not self._closing:
+                        self._condition.wait()
+                    if self._closing:
+                        return
+                    metadata, array = self._pending
+                    self._pending = None
+                socket.send_json(metadata, zmq.SNDMORE)
+                socket.send(array, copy=False)
+                response = socket.recv()
+                if response != b'ok':
+                    logger.warning(f"{self.name}: unexpected response from the GUI: {response!r}")
+                self.sent += 1
+        except Exception as e:
+            logger.error(f"{self.name}: preview publisher stopped: {e}")
+        finally:
+            socket.close(linger=0)
+
+    def report(self) -> dict:
+        return dict(published=self.published, sent=self.sent, dropped=self.dropped)
+
+    def close(self, timeout=1.0):
+        """Stop the sender thread. A pending preview is discarded."""
+        with self._condition:
+            self._closing = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
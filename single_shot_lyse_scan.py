@@ -6,6 +6,7 @@ from qtutils.qt import QtWidgets, QtGui, QtCore
 from pylab import *
 from lyse import *
 import h5py
+from user_devices.PicoScope4000A.trace_storage import traces_to_mv, capture_names
 
 parent = QtWidgets.QApplication.activeWindow()
 
@@ -38,26 +39,34 @@ def plot_traces(shot):
     win = pg.GraphicsLayoutWidget(show=True, title="Picoscope traces")
     win.resize(1200, 800)
     plot_row = 0
-    picoscopes = shot.trace_names()  # gets the dataset names per picoscope
+    # one capture per picoscope, the derived datasets (<device>_min, DSP outputs) are skipped
+    picoscopes = capture_names(shot.h5_file.get('data/traces', {}))
     for picoscope in picoscopes:
         print(picoscope)
         traces_ds = shot.h5_file['data']['traces'][picoscope]
         traces_names = traces_ds.attrs["channel_names"]
         dt = traces_ds.attrs["sample_interval"]
         triggered_at = traces_ds.attrs["triggered_at"]
-        data = traces_ds[()]
-        N, C = data.shape
+        data = traces_to_mv(traces_ds) # mV for 'mV' and 'adc' datasets
+        if data.ndim == 3: # rapid block mode: (segments, channels, samples), the segments are drawn on top
+            segments = data
+        elif traces_ds.attrs.get("layout", "samples_channels") == "channels_samples":
+            segments = data[None]
+        else:
+            segments = data.T[None]
+        N = segments.shape[-1]
         t = np.linspace(0, (N-1) * dt, N)
-        traces = {name: data[:, i] for i, name in enumerate(traces_names)}
 
         p = win.addPlot(row=plot_row, col=0, title=picoscope)
         p.addLegend(offset=(1, 1))
         p.showGrid(x=True, y=True)
 
-        for i, (name, y) in enumerate(traces.items()):
-            p.plot(t, y, pen=pg.intColor(i), name=name)
-            if i == 0: # plot the trigger dot on the first channel
-                p.plot([t[triggered_at]], [y[triggered_at]], pen=None, symbol='o', symbolBrush='r')
+        for i, name in enumerate(traces_names):
+            for segment, traces in enumerate(segments):
+                y = traces[i]
+                p.plot(t, y, pen=pg.intColor(i), name=name if segment == 0 else None)
+                if i == 0 and 0 <= triggered_at < N: # plot the trigger dot on the first channel
+                    p.plot([t[triggered_at]], [y[triggered_at]], pen=None, symbol='o', symbolBrush='r')
         plot_row += 1
 
     return win